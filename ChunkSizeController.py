@@ -0,0 +1,115 @@
+from collections import deque
+from typing import Optional
+from config import ChunkSizePolicy
+from PCMAudio import PCM_BYTES_PER_SECOND, PCM_FRAME_BYTES
+import time
+
+
+class ChunkSizeController:
+    def __init__(
+        self,
+        policy: ChunkSizePolicy = ChunkSizePolicy.LATENCY,
+        initialChunkBytes: int = 16000,
+        minChunkBytes: int = PCM_BYTES_PER_SECOND // 10,
+        maxChunkBytes: int = PCM_BYTES_PER_SECOND * 4,
+        targetPartialsPerSecond: float = 2,
+        smoothing: float = 0.3,
+    ) -> None:
+        self.__POLICY = policy
+        self.__MIN_CHUNK_BYTES = minChunkBytes
+        self.__MAX_CHUNK_BYTES = maxChunkBytes
+        self.__TARGET_RESPONSE_INTERVAL_SECONDS = 1 / targetPartialsPerSecond
+        self.__SMOOTHING = smoothing
+        self.__CHUNK_BYTES = self.__clamp(initialChunkBytes)
+        self.__IN_FLIGHT: deque[tuple[float, int]] = deque()
+        self.__LAST_RESPONSE_AT: float = 0
+        self.__AVERAGE_SERVICE_SECONDS: Optional[float] = None
+        self.__AVERAGE_BYTES: Optional[float] = None
+        self.__MIN_ROUND_TRIP: Optional[float] = None
+        self.__ROUND_TRIPS: int = 0
+        self.__ROUND_TRIP_SECONDS_TOTAL: float = 0
+        self.__CHUNK_BYTES_MIN_USED: Optional[int] = None
+        self.__CHUNK_BYTES_MAX_USED: Optional[int] = None
+
+    def __clamp(self, chunkBytes: float) -> int:
+        chunkBytes = min(
+            max(chunkBytes, self.__MIN_CHUNK_BYTES), self.__MAX_CHUNK_BYTES
+        )
+        return max(int(chunkBytes) // PCM_FRAME_BYTES, 1) * PCM_FRAME_BYTES
+
+    def get_chunk_bytes(self) -> int:
+        return self.__CHUNK_BYTES
+
+    def on_sent(self, chunkBytes: int) -> None:
+        self.__IN_FLIGHT.append((time.monotonic(), chunkBytes))
+        self.__CHUNK_BYTES_MIN_USED = min(
+            chunkBytes, self.__CHUNK_BYTES_MIN_USED or chunkBytes
+        )
+        self.__CHUNK_BYTES_MAX_USED = max(
+            chunkBytes, self.__CHUNK_BYTES_MAX_USED or chunkBytes
+        )
+
+    def on_response(self) -> None:
+        # vosk-server answers every message exactly once and in order.
+        if not self.__IN_FLIGHT:
+            return
+        sentAt, chunkBytes = self.__IN_FLIGHT.popleft()
+        now = time.monotonic()
+        roundTrip = now - sentAt
+        # With several chunks in flight a round trip includes queueing behind
+        # earlier chunks, so the server's own time is measured from whichever
+        # came last: this chunk being sent or the previous response.
+        serviceSeconds = now - max(sentAt, self.__LAST_RESPONSE_AT)
+        self.__LAST_RESPONSE_AT = now
+        self.__ROUND_TRIPS += 1
+        self.__ROUND_TRIP_SECONDS_TOTAL += roundTrip
+        if self.__MIN_ROUND_TRIP is None or roundTrip < self.__MIN_ROUND_TRIP:
+            self.__MIN_ROUND_TRIP = roundTrip
+        if self.__AVERAGE_SERVICE_SECONDS is None or self.__AVERAGE_BYTES is None:
+            self.__AVERAGE_SERVICE_SECONDS = serviceSeconds
+            self.__AVERAGE_BYTES = chunkBytes
+        else:
+            self.__AVERAGE_SERVICE_SECONDS += self.__SMOOTHING * (
+                serviceSeconds - self.__AVERAGE_SERVICE_SECONDS
+            )
+            self.__AVERAGE_BYTES += self.__SMOOTHING * (
+                chunkBytes - self.__AVERAGE_BYTES
+            )
+        self.__adapt()
+
+    def __adapt(self) -> None:
+        if self.__POLICY == ChunkSizePolicy.FIXED:
+            return
+        secondsPerByte = (
+            self.__AVERAGE_SERVICE_SECONDS / self.__AVERAGE_BYTES  # type: ignore
+        )
+        if secondsPerByte <= 0:
+            targetChunkBytes = self.__MAX_CHUNK_BYTES
+        elif self.__POLICY == ChunkSizePolicy.LATENCY:
+            # Small enough that a response, and with it any new partial or
+            # finalized segment, arrives `targetPartialsPerSecond` times a second.
+            targetChunkBytes = (
+                self.__TARGET_RESPONSE_INTERVAL_SECONDS / secondsPerByte
+            )
+        else:
+            # Big enough that the fastest round trip seen, which approximates
+            # the fixed per-message cost, stays under 10% of the server's time.
+            targetChunkBytes = 9 * (self.__MIN_ROUND_TRIP or 0) / secondsPerByte
+        self.__CHUNK_BYTES = self.__clamp(
+            self.__CHUNK_BYTES
+            + self.__SMOOTHING * (targetChunkBytes - self.__CHUNK_BYTES)
+        )
+
+    def get_policy(self) -> ChunkSizePolicy:
+        return self.__POLICY
+
+    def get_average_round_trip_seconds(self) -> float:
+        if self.__ROUND_TRIPS == 0:
+            return 0
+        return self.__ROUND_TRIP_SECONDS_TOTAL / self.__ROUND_TRIPS
+
+    def get_chunk_bytes_range(self) -> tuple[int, int]:
+        return (
+            self.__CHUNK_BYTES_MIN_USED or self.__CHUNK_BYTES,
+            self.__CHUNK_BYTES_MAX_USED or self.__CHUNK_BYTES,
+        )
@@ -33,6 +33,7 @@ class SingleLocale(BaseModel):
     messageSentAsAFileWithSubtitles: str
     errorWhileDownloading: str
     fullMessageAfterProcessing: str
+    messageQueued: str
 
 
 class Locale:
@@ -0,0 +1,420 @@
+from bisect import bisect_left
+from typing import Awaitable, Callable, Optional, Union
+from Tracing import get_current_trace
+import asyncio
+import inspect
+import logging
+import math
+import threading
+import time
+
+
+LabelValues = tuple[str, ...]
+CollectedValues = Union[float, dict[LabelValues, float]]
+Collector = Callable[[], Union[CollectedValues, Awaitable[CollectedValues]]]
+
+DEFAULT_SECONDS_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_sample(
+    name: str,
+    labelNames: tuple[str, ...],
+    labelValues: LabelValues,
+    value: float,
+    extraLabel: Optional[tuple[str, str]] = None,
+) -> str:
+    labels = [
+        f'{labelName}="{escape_label_value(labelValue)}"'
+        for labelName, labelValue in zip(labelNames, labelValues)
+    ]
+    if extraLabel is not None:
+        labels.append(f'{extraLabel[0]}="{extraLabel[1]}"')
+    formattedValue = (
+        ("+Inf" if value > 0 else "-Inf") if math.isinf(value) else repr(float(value))
+    )
+    if not labels:
+        return f"{name} {formattedValue}"
+    return f"{name}{{{','.join(labels)}}} {formattedValue}"
+
+
+def format_bucket_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+class ScalarMetric:
+    TYPE = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelNames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = labelNames
+        self.__VALUES: dict[LabelValues, float] = {}
+        self.__COLLECTOR: Optional[Collector] = None
+        # Updates also come from threads (`asyncio.to_thread` callers).
+        self.__LOCK = threading.Lock()
+
+    def get_label_values(self, labels: dict) -> LabelValues:
+        if len(labels) != len(self.labelNames):
+            raise ValueError(
+                f"Metric `{self.name}` expects labels {self.labelNames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[labelName]) for labelName in self.labelNames)
+
+    def _apply(self, labels: dict, amount: float, replace: bool = False) -> None:
+        labelValues = self.get_label_values(labels)
+        with self.__LOCK:
+            self.__VALUES[labelValues] = (
+                amount if replace else self.__VALUES.get(labelValues, 0) + amount
+            )
+
+    def get(self, **labels) -> float:
+        return self.__VALUES.get(self.get_label_values(labels), 0)
+
+    def set_collector(self, collector: Optional[Collector]) -> None:
+        # Values kept elsewhere are read at scrape time instead of mirrored.
+        self.__COLLECTOR = collector
+
+    async def collect(self) -> list[str]:
+        values: CollectedValues
+        if self.__COLLECTOR is not None:
+            collected = self.__COLLECTOR()
+            values = await collected if inspect.isawaitable(collected) else collected  # type: ignore
+        else:
+            with self.__LOCK:
+                values = dict(self.__VALUES)
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ] + [
+            format_sample(self.name, self.labelNames, labelValues, value)
+            for labelValues, value in sorted(values.items())
+        ]
+
+
+class Counter(ScalarMetric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._apply(labels, amount)
+
+
+class Gauge(ScalarMetric):
+    TYPE = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self._apply(labels, amount)
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self._apply(labels, -amount)
+
+    def set(self, value: float, **labels) -> None:
+        self._apply(labels, value, replace=True)
+
+
+class Histogram:
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelNames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_SECONDS_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = labelNames
+        self.__BUCKETS = tuple(sorted(buckets)) + (math.inf,)
+        self.__COUNTS: dict[LabelValues, list[int]] = {}
+        self.__SUMS: dict[LabelValues, float] = {}
+        self.__LOCK = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        if len(labels) != len(self.labelNames):
+            raise ValueError(
+                f"Metric `{self.name}` expects labels {self.labelNames}, got {tuple(labels)}"
+            )
+        labelValues = tuple(str(labels[labelName]) for labelName in self.labelNames)
+        with self.__LOCK:
+            counts = self.__COUNTS.get(labelValues)
+            if counts is None:
+                counts = self.__COUNTS[labelValues] = [0] * len(self.__BUCKETS)
+            counts[bisect_left(self.__BUCKETS, value)] += 1
+            self.__SUMS[labelValues] = self.__SUMS.get(labelValues, 0) + value
+
+    async def collect(self) -> list[str]:
+        with self.__LOCK:
+            counts = {labelValues: list(c) for labelValues, c in self.__COUNTS.items()}
+            sums = dict(self.__SUMS)
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        for labelValues in sorted(counts):
+            cumulative = 0
+            for bound, count in zip(self.__BUCKETS, counts[labelValues]):
+                cumulative += count
+                lines.append(
+                    format_sample(
+                        f"{self.name}_bucket",
+                        self.labelNames,
+                        labelValues,
+                        cumulative,
+                        ("le", format_bucket_bound(bound)),
+                    )
+                )
+            lines.append(
+                format_sample(
+                    f"{self.name}_sum", self.labelNames, labelValues, sums[labelValues]
+                )
+            )
+            lines.append(
+                format_sample(
+                    f"{self.name}_count", self.labelNames, labelValues, cumulative
+                )
+            )
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "vocalballs_") -> None:
+        self.__PREFIX = prefix
+        self.__METRICS: dict[str, Union[ScalarMetric, Histogram]] = {}
+
+    def __register(self, metric):
+        if metric.name in self.__METRICS:
+            raise ValueError(f"Metric `{metric.name}` is already registered")
+        self.__METRICS[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelNames: tuple[str, ...] = ()
+    ) -> Counter:
+        return self.__register(Counter(self.__PREFIX + name, documentation, labelNames))
+
+    def gauge(
+        self, name: str, documentation: str, labelNames: tuple[str, ...] = ()
+    ) -> Gauge:
+        return self.__register(Gauge(self.__PREFIX + name, documentation, labelNames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelNames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_SECONDS_BUCKETS,
+    ) -> Histogram:
+        return self.__register(
+            Histogram(self.__PREFIX + name, documentation, labelNames, buckets)
+        )
+
+    async def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.__METRICS.values():
+            try:
+                lines += await metric.collect()
+            except Exception as e:
+                logging.warning("Could not collect metric `%s`: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+STAGE_DURATION_SECONDS = METRICS.histogram(
+    "stage_duration_seconds",
+    "Time spent in a processing stage.",
+    ("stage", "operation"),
+)
+STAGE_CALLS = METRICS.counter(
+    "stage_calls_total",
+    "Processing stage runs by outcome.",
+    ("stage", "operation", "outcome"),
+)
+STAGE_IN_PROGRESS = METRICS.gauge(
+    "stage_in_progress",
+    "Processing stage runs currently in progress.",
+    ("stage", "operation"),
+)
+AUDIO_SECONDS_DECODED = METRICS.counter(
+    "audio_decoded_seconds_total",
+    "Seconds of audio decoded by ffmpeg and streamed to Vosk.",
+    ("language",),
+)
+VOSK_REALTIME_FACTOR = METRICS.histogram(
+    "vosk_realtime_factor",
+    "Wall time over audio duration of finished Vosk transcriptions.",
+    ("language",),
+    (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5),
+)
+VOSK_ROUND_TRIP_SECONDS = METRICS.histogram(
+    "vosk_chunk_round_trip_seconds",
+    "Average chunk round trip of finished Vosk transcriptions.",
+    ("language",),
+)
+VOSK_CHUNK_BYTES = METRICS.histogram(
+    "vosk_chunk_bytes",
+    "Size of audio chunks sent to Vosk.",
+    ("language", "policy"),
+    (1600, 3200, 6400, 8000, 16000, 32000, 64000, 96000, 128000),
+)
+JOBS_IN_FLIGHT = METRICS.gauge(
+    "jobs_in_flight", "Transcription jobs being run.", ("language",)
+)
+SCHEDULER_QUEUE_DEPTH = METRICS.gauge(
+    "scheduler_queue_depth", "Transcription jobs waiting in the in-process scheduler."
+)
+TRANSCRIPTION_QUEUE_DEPTH = METRICS.gauge(
+    "transcription_queue_depth", "Transcription jobs waiting in the shared queue."
+)
+VOSK_POOL_CONNECTIONS = METRICS.gauge(
+    "vosk_pool_connections", "Pooled Vosk connections.", ("language", "state")
+)
+VOSK_POOL_ACQUISITIONS = METRICS.counter(
+    "vosk_pool_acquisitions_total",
+    "Vosk connections handed out by the pool.",
+    ("language", "reused"),
+)
+VOSK_POOL_ACQUIRE_WAIT_SECONDS = METRICS.counter(
+    "vosk_pool_acquire_wait_seconds_total",
+    "Time spent waiting for a free Vosk pool slot.",
+    ("language",),
+)
+TELEGRAM_FLOOD_WAITS = METRICS.counter(
+    "telegram_flood_waits_total", "FloodWait errors returned by Telegram."
+)
+TELEGRAM_SUPERSEDED_EDITS = METRICS.counter(
+    "telegram_superseded_edits_total",
+    "Message edits merged into a newer edit before being sent.",
+)
+
+
+class StageTimer:
+    __slots__ = ("stage", "operation", "outcome", "startedAt")
+
+    def __init__(self, stage: str, operation: str) -> None:
+        self.stage = stage
+        self.operation = operation
+        # Callers that swallow their own errors set this before leaving.
+        self.outcome: Optional[str] = None
+        self.startedAt = 0.0
+
+    def __enter__(self) -> "StageTimer":
+        STAGE_IN_PROGRESS.inc(stage=self.stage, operation=self.operation)
+        self.startedAt = time.monotonic()
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> bool:
+        duration = time.monotonic() - self.startedAt
+        STAGE_DURATION_SECONDS.observe(
+            duration, stage=self.stage, operation=self.operation
+        )
+        if self.outcome is None:
+            if excType is None:
+                self.outcome = "ok"
+            elif issubclass(excType, (asyncio.CancelledError, GeneratorExit)):
+                self.outcome = "cancelled"
+            else:
+                self.outcome = "error"
+        STAGE_CALLS.inc(
+            stage=self.stage, operation=self.operation, outcome=self.outcome
+        )
+        trace = get_current_trace()
+        if trace is not None:
+            trace.add_span(
+                self.operation,
+                self.stage,
+                self.startedAt,
+                duration,
+                outcome=self.outcome,
+            )
+        STAGE_IN_PROGRESS.dec(stage=self.stage, operation=self.operation)
+        return False
+
+
+def track_stage(stage: str, operation: str) -> StageTimer:
+    return StageTimer(stage, operation)
+
+
+class MetricsServer:
+    def __init__(
+        self,
+        registry: MetricsRegistry = METRICS,
+        host: str = "127.0.0.1",
+        port: int = 9108,
+        requestTimeout: float = 5,
+    ) -> None:
+        self.__REGISTRY = registry
+        self.__HOST = host
+        self.__PORT = port
+        self.__REQUEST_TIMEOUT = requestTimeout
+        self.__SERVER: Optional[asyncio.AbstractServer] = None
+
+    async def __read_request_path(self, reader: asyncio.StreamReader) -> str:
+        requestLine = (await reader.readline()).decode("latin-1").split()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if len(requestLine) < 2 or requestLine[0] != "GET":
+            return ""
+        return requestLine[1].split("?")[0]
+
+    async def __handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            path = await asyncio.wait_for(
+                self.__read_request_path(reader), timeout=self.__REQUEST_TIMEOUT
+            )
+            if path == "/metrics":
+                status, contentType = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+                body = (await self.__REGISTRY.render()).encode()
+            else:
+                status, contentType = "404 Not Found", "text/plain; charset=utf-8"
+                body = b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {contentType}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logging.debug("Dropped a metrics request: %s", e)
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        self.__SERVER = await asyncio.start_server(
+            self.__handle, self.__HOST, self.__PORT
+        )
+        logging.info(
+            "Serving metrics on http://%s:%s/metrics", self.__HOST, self.__PORT
+        )
+
+    async def close(self) -> None:
+        if self.__SERVER is not None:
+            self.__SERVER.close()
+            await self.__SERVER.wait_closed()
+            self.__SERVER = None
@@ -0,0 +1,206 @@
+from array import array
+from bisect import bisect_right
+from collections import deque
+import sys
+
+
+# ffmpeg is asked for 16 kHz mono s16le, i.e. 2 bytes per sample.
+PCM_SAMPLE_RATE = 16000
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * 2
+PCM_FRAME_BYTES = PCM_BYTES_PER_SECOND // 50
+
+
+def seconds_to_pcm_bytes(seconds: float) -> int:
+    return int(seconds * PCM_SAMPLE_RATE) * 2
+
+
+def get_frame_energy(frame: bytes) -> float:
+    samples = array("h")
+    samples.frombytes(frame[: len(frame) - len(frame) % 2])
+    if not samples:
+        return 0
+    if sys.byteorder != "little":
+        samples.byteswap()
+    return sum(map(abs, samples)) / len(samples)
+
+
+class PCMSegment:
+    __slots__ = ("index", "startOffset", "cutOffset", "pcm")
+
+    def __init__(self, index: int, startOffset: int, cutOffset: int, pcm: bytes) -> None:
+        self.index = index
+        # `startOffset` is where `pcm` begins; everything before `cutOffset`
+        # is overlap that already belongs to the previous segment.
+        self.startOffset = startOffset
+        self.cutOffset = cutOffset
+        self.pcm = pcm
+
+
+class PCMSegmenter:
+    def __init__(
+        self,
+        segmentSeconds: float = 60,
+        overlapSeconds: float = 0.5,
+        searchSeconds: float = 5,
+    ) -> None:
+        self.__SEGMENT_BYTES = max(
+            seconds_to_pcm_bytes(segmentSeconds) // PCM_FRAME_BYTES, 1
+        ) * PCM_FRAME_BYTES
+        self.__OVERLAP_BYTES = seconds_to_pcm_bytes(overlapSeconds)
+        self.__SEARCH_BYTES = min(
+            seconds_to_pcm_bytes(searchSeconds) // PCM_FRAME_BYTES * PCM_FRAME_BYTES,
+            self.__SEGMENT_BYTES - PCM_FRAME_BYTES,
+        )
+        self.__BUFFER = bytearray()
+        self.__BUFFER_OFFSET = 0
+        self.__CUT_OFFSET = 0
+        self.__NEXT_INDEX = 0
+
+    def __find_quietest_offset(self, searchFrom: int, searchTo: int) -> int:
+        frameOffsets = list(range(searchFrom, searchTo, PCM_FRAME_BYTES))
+        energies = [
+            get_frame_energy(
+                self.__BUFFER[
+                    frameOffset
+                    - self.__BUFFER_OFFSET : frameOffset
+                    - self.__BUFFER_OFFSET
+                    + PCM_FRAME_BYTES
+                ]
+            )
+            for frameOffset in frameOffsets
+        ]
+        # Cut in the middle of the longest run of near-quietest frames, so
+        # that the overlap on both sides of the cut is silence too.
+        threshold = min(energies) * 1.5 + 1
+        bestStart, bestLength, runStart = 0, 0, None
+        for index, energy in enumerate(energies + [threshold + 1]):
+            if energy <= threshold:
+                if runStart is None:
+                    runStart = index
+                continue
+            if runStart is not None and index - runStart > bestLength:
+                bestStart, bestLength = runStart, index - runStart
+            runStart = None
+        return frameOffsets[bestStart + bestLength // 2] + PCM_FRAME_BYTES // 2
+
+    def __emit(self, endOffset: int) -> PCMSegment:
+        startOffset = max(self.__CUT_OFFSET - self.__OVERLAP_BYTES, self.__BUFFER_OFFSET)
+        segment = PCMSegment(
+            index=self.__NEXT_INDEX,
+            startOffset=startOffset,
+            cutOffset=self.__CUT_OFFSET,
+            pcm=bytes(
+                self.__BUFFER[
+                    startOffset
+                    - self.__BUFFER_OFFSET : endOffset
+                    - self.__BUFFER_OFFSET
+                ]
+            ),
+        )
+        self.__NEXT_INDEX += 1
+        self.__CUT_OFFSET = endOffset
+        keepFrom = max(endOffset - self.__OVERLAP_BYTES, self.__BUFFER_OFFSET)
+        del self.__BUFFER[: keepFrom - self.__BUFFER_OFFSET]
+        self.__BUFFER_OFFSET = keepFrom
+        return segment
+
+    def feed(self, data: bytes) -> list[PCMSegment]:
+        self.__BUFFER.extend(data)
+        segments: list[PCMSegment] = []
+        bufferEnd = self.__BUFFER_OFFSET + len(self.__BUFFER)
+        while bufferEnd - self.__CUT_OFFSET >= self.__SEGMENT_BYTES:
+            searchTo = self.__CUT_OFFSET + self.__SEGMENT_BYTES - PCM_FRAME_BYTES
+            segments.append(
+                self.__emit(
+                    self.__find_quietest_offset(
+                        searchTo - self.__SEARCH_BYTES, searchTo
+                    )
+                )
+            )
+        return segments
+
+    def flush(self) -> list[PCMSegment]:
+        bufferEnd = self.__BUFFER_OFFSET + len(self.__BUFFER)
+        if bufferEnd <= self.__CUT_OFFSET:
+            return []
+        return [self.__emit(bufferEnd)]
+
+
+class VoiceActivityFilter:
+    def __init__(
+        self, energyThreshold: float = 300, keepSilenceSeconds: float = 0.3
+    ) -> None:
+        self.__ENERGY_THRESHOLD = energyThreshold
+        self.__KEEP_SILENCE_FRAMES = max(
+            seconds_to_pcm_bytes(keepSilenceSeconds) // PCM_FRAME_BYTES, 1
+        )
+        self.__REMAINDER = bytearray()
+        self.__SILENT_FRAMES = 0
+        # Silent frames just before speech resumes are held back and sent
+        # with it, so utterances keep some leading silence as well.
+        self.__HELD: deque[tuple[int, bytes]] = deque(
+            maxlen=self.__KEEP_SILENCE_FRAMES
+        )
+        self.__ORIGINAL_OFFSET = 0
+        self.__SENT_OFFSET = 0
+        self.__MAP_SENT_OFFSETS: list[int] = [0]
+        self.__MAP_ORIGINAL_OFFSETS: list[int] = [0]
+        self.__DROPPED_BYTES = 0
+
+    def get_dropped_bytes(self) -> int:
+        return self.__DROPPED_BYTES
+
+    def __keep(self, originalOffset: int, frame: bytes, output: bytearray) -> None:
+        if (
+            originalOffset - self.__SENT_OFFSET
+            != self.__MAP_ORIGINAL_OFFSETS[-1] - self.__MAP_SENT_OFFSETS[-1]
+        ):
+            self.__MAP_SENT_OFFSETS.append(self.__SENT_OFFSET)
+            self.__MAP_ORIGINAL_OFFSETS.append(originalOffset)
+        output += frame
+        self.__SENT_OFFSET += len(frame)
+
+    def filter(self, data: bytes) -> bytes:
+        self.__REMAINDER.extend(data)
+        output = bytearray()
+        usableBytes = len(self.__REMAINDER) - len(self.__REMAINDER) % PCM_FRAME_BYTES
+        for start in range(0, usableBytes, PCM_FRAME_BYTES):
+            frame = bytes(self.__REMAINDER[start : start + PCM_FRAME_BYTES])
+            originalOffset = self.__ORIGINAL_OFFSET
+            self.__ORIGINAL_OFFSET += PCM_FRAME_BYTES
+            if get_frame_energy(frame) >= self.__ENERGY_THRESHOLD:
+                while self.__HELD:
+                    self.__keep(*self.__HELD.popleft(), output)
+                self.__SILENT_FRAMES = 0
+                self.__keep(originalOffset, frame, output)
+                continue
+            self.__SILENT_FRAMES += 1
+            if self.__SILENT_FRAMES <= self.__KEEP_SILENCE_FRAMES:
+                self.__keep(originalOffset, frame, output)
+                continue
+            if len(self.__HELD) == self.__KEEP_SILENCE_FRAMES:
+                self.__DROPPED_BYTES += PCM_FRAME_BYTES
+            self.__HELD.append((originalOffset, frame))
+        del self.__REMAINDER[:usableBytes]
+        return bytes(output)
+
+    def flush(self) -> bytes:
+        self.__DROPPED_BYTES += sum(len(frame) for _, frame in self.__HELD)
+        self.__HELD.clear()
+        output = bytearray()
+        if self.__REMAINDER and self.__SILENT_FRAMES <= self.__KEEP_SILENCE_FRAMES:
+            self.__keep(self.__ORIGINAL_OFFSET, bytes(self.__REMAINDER), output)
+        else:
+            self.__DROPPED_BYTES += len(self.__REMAINDER)
+        self.__ORIGINAL_OFFSET += len(self.__REMAINDER)
+        self.__REMAINDER.clear()
+        return bytes(output)
+
+    def to_original_seconds(self, sentSeconds: float) -> float:
+        sentOffset = sentSeconds * PCM_BYTES_PER_SECOND
+        index = max(bisect_right(self.__MAP_SENT_OFFSETS, sentOffset) - 1, 0)
+        return (
+            sentOffset
+            - self.__MAP_SENT_OFFSETS[index]
+            + self.__MAP_ORIGINAL_OFFSETS[index]
+        ) / PCM_BYTES_PER_SECOND
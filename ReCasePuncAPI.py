@@ -1,16 +1,39 @@
-from typing import Optional
+from typing import Callable, Optional
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pydantic import HttpUrl, parse_obj_as
-from config import AvailableLanguages
+from config import AvailableLanguages, Config
 from models import RecasepuncResponseModel, RecasepuncRequestBodyModel
+from VoskAPI import VoskResult
+from Metrics import track_stage
+import asyncio
 import logging
 import json
 
 
 class RecasepuncAPI:
-    def __init__(self, endpointBase: HttpUrl, apiKey: str) -> None:
+    # An instance is made per message, while the session's connection pool
+    # and the threads requests block are shared by all of them, so both are
+    # sized once from the config rather than per instance.
+    __SESSION: Optional[requests.Session] = None
+    __CONCURRENCY_LIMIT = asyncio.Semaphore(
+        max(Config.get_vprw_rcpapi_max_concurrency(), 1)
+    )
+
+    def __init__(
+        self,
+        endpointBase: HttpUrl,
+        apiKey: str,
+        timeout: float = 10,
+        maxBatchCharacters: int = 2000,
+        batchLingerSeconds: float = 0.15,
+    ) -> None:
         self.__ENDPOINT = endpointBase
         self.__APIKEY = apiKey
+        self.__TIMEOUT = timeout
+        self.__MAX_BATCH_CHARACTERS = maxBatchCharacters
+        self.__BATCH_LINGER_SECONDS = batchLingerSeconds
 
     def __get_headers(self) -> dict:
         return {
@@ -21,14 +44,46 @@ class RecasepuncAPI:
     def __get_endpoint(self, language: AvailableLanguages) -> HttpUrl:
         return parse_obj_as(HttpUrl, self.__ENDPOINT + "/" + language.value)
 
+    def __get_session(self) -> requests.Session:
+        if RecasepuncAPI.__SESSION is None:
+            adapter = HTTPAdapter(
+                pool_connections=len(AvailableLanguages),
+                pool_maxsize=max(Config.get_vprw_rcpapi_max_concurrency(), 1),
+                max_retries=Retry(
+                    total=Config.get_vprw_rcpapi_max_retries(),
+                    backoff_factor=0.2,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(["POST"]),
+                    raise_on_status=False,
+                ),
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            RecasepuncAPI.__SESSION = session
+        return RecasepuncAPI.__SESSION
+
     def make_request(
         self, request: RecasepuncRequestBodyModel
     ) -> Optional[RecasepuncResponseModel]:
-        response = requests.post(
-            url=self.__get_endpoint(request.lang),
-            headers=self.__get_headers(),
-            data=json.dumps({"text": request.text}),
-        )
+        with track_stage("recasepunc", request.lang.value) as stageTimer:
+            try:
+                response = self.__get_session().post(
+                    url=self.__get_endpoint(request.lang),
+                    headers=self.__get_headers(),
+                    data=json.dumps({"text": request.text}),
+                    timeout=self.__TIMEOUT,
+                )
+            except requests.RequestException as e:
+                stageTimer.outcome = "error"
+                logging.warning(
+                    "RecasepuncAPI request failed for language `%s`: %s",
+                    request.lang.value,
+                    e,
+                )
+                return None
+            if response.status_code != 200:
+                stageTimer.outcome = "error"
         if response.status_code == 200:
             logging.debug(
                 "RecasepuncAPI request successful with status code %s for language `%s`",
@@ -37,3 +92,208 @@ class RecasepuncAPI:
             )
             return RecasepuncResponseModel(**response.json())
         return None
+
+    async def make_requests(
+        self, requestBodies: list[RecasepuncRequestBodyModel]
+    ) -> list[Optional[RecasepuncResponseModel]]:
+        async def make_bounded_request(
+            request: RecasepuncRequestBodyModel,
+        ) -> Optional[RecasepuncResponseModel]:
+            async with RecasepuncAPI.__CONCURRENCY_LIMIT:
+                return await asyncio.to_thread(self.make_request, request)
+
+        return await asyncio.gather(
+            *[make_bounded_request(request) for request in requestBodies]
+        )
+
+    @staticmethod
+    def __normalize_for_alignment(text: str) -> str:
+        return "".join(character for character in text.lower() if character.isalnum())
+
+    @staticmethod
+    def __split_into_batches(
+        texts: list[str], maxBatchCharacters: int
+    ) -> list[list[int]]:
+        batches: list[list[int]] = []
+        currentBatch: list[int] = []
+        currentLength = 0
+        for index, text in enumerate(texts):
+            if currentBatch and currentLength + len(text) + 1 > maxBatchCharacters:
+                batches.append(currentBatch)
+                currentBatch = []
+                currentLength = 0
+            currentBatch.append(index)
+            currentLength += len(text) + 1
+        if currentBatch:
+            batches.append(currentBatch)
+        return batches
+
+    @staticmethod
+    def __align_batch_result(texts: list[str], result: str) -> Optional[list[str]]:
+        # recasepunc only changes casing and inserts punctuation tokens, so the
+        # alphanumeric characters of every segment must reappear in order.
+        tokens = result.split()
+        position = 0
+        alignedTexts: list[str] = []
+        for text in texts:
+            target = RecasepuncAPI.__normalize_for_alignment(text)
+            consumed = ""
+            startPosition = position
+            while len(consumed) < len(target) and position < len(tokens):
+                consumed += RecasepuncAPI.__normalize_for_alignment(tokens[position])
+                position += 1
+            if consumed != target:
+                return None
+            while (
+                position < len(tokens)
+                and RecasepuncAPI.__normalize_for_alignment(tokens[position]) == ""
+            ):
+                position += 1
+            alignedTexts.append(" ".join(tokens[startPosition:position]))
+        if position != len(tokens):
+            return None
+        return alignedTexts
+
+    async def make_batched_requests(
+        self,
+        texts: list[str],
+        language: AvailableLanguages,
+    ) -> list[Optional[str]]:
+        formattedTexts: list[Optional[str]] = [None] * len(texts)
+        batches = self.__split_into_batches(texts, self.__MAX_BATCH_CHARACTERS)
+        responses = await self.make_requests(
+            [
+                RecasepuncRequestBodyModel(
+                    text=" ".join(texts[index] for index in batch), lang=language
+                )
+                for batch in batches
+            ]
+        )
+        fallbackIndexes: list[int] = []
+        for batch, response in zip(batches, responses):
+            alignedTexts = (
+                self.__align_batch_result(
+                    [texts[index] for index in batch], response.result
+                )
+                if response is not None and response.result is not None
+                else None
+            )
+            if alignedTexts is None:
+                fallbackIndexes.extend(batch)
+                continue
+            for index, alignedText in zip(batch, alignedTexts):
+                formattedTexts[index] = RecasepuncResponseModel(
+                    error=None, result=alignedText
+                ).fix_result_apostrophe()
+        if fallbackIndexes:
+            logging.warning(
+                "Could not align %d batched RecasepuncAPI segments for language `%s`, falling back to per-segment requests",
+                len(fallbackIndexes),
+                language.value,
+            )
+            fallbackResponses = await self.make_requests(
+                [
+                    RecasepuncRequestBodyModel(text=texts[index], lang=language)
+                    for index in fallbackIndexes
+                ]
+            )
+            for index, response in zip(fallbackIndexes, fallbackResponses):
+                formattedTexts[index] = (
+                    response.fix_result_apostrophe() if response is not None else None
+                )
+        return formattedTexts
+
+    async def __punctuate_segments(
+        self,
+        segments: list[VoskResult],
+        language: AvailableLanguages,
+        onPunctuated: Optional[Callable[[VoskResult], None]] = None,
+    ) -> list[VoskResult]:
+        try:
+            formattedTexts = await self.make_batched_requests(
+                [segment.text for segment in segments], language
+            )
+        except Exception as e:
+            logging.warning(
+                "RecasepuncAPI batch of %d segments failed for language `%s`: %s",
+                len(segments),
+                language.value,
+                e,
+            )
+            return segments
+        failedSegments: list[VoskResult] = []
+        for segment, formattedText in zip(segments, formattedTexts):
+            if formattedText is None:
+                failedSegments.append(segment)
+            elif formattedText:
+                segment.text = formattedText
+                if onPunctuated is not None:
+                    onPunctuated(segment)
+        return failedSegments
+
+    async def punctuate_stream(
+        self,
+        segments: asyncio.Queue,
+        language: AvailableLanguages,
+        onPunctuated: Optional[Callable[[VoskResult], None]] = None,
+    ) -> bool:
+        # Returns whether every segment ended up punctuated.
+        loop = asyncio.get_running_loop()
+        pendingTasks: set[asyncio.Task] = set()
+        failedSegments: list[VoskResult] = []
+        finished = False
+        try:
+            while not finished:
+                batch: list[VoskResult] = []
+                batchCharacters = 0
+                segment = await segments.get()
+                # Vosk finalizes segments a few at a time, so the batch waits
+                # a little for more of them instead of sending one per request.
+                lingerUntil = loop.time() + self.__BATCH_LINGER_SECONDS
+                while True:
+                    if segment is None:
+                        finished = True
+                        break
+                    batch.append(segment)
+                    batchCharacters += len(segment.text)
+                    if batchCharacters >= self.__MAX_BATCH_CHARACTERS:
+                        break
+                    if not segments.empty():
+                        segment = segments.get_nowait()
+                        continue
+                    try:
+                        segment = await asyncio.wait_for(
+                            segments.get(), timeout=lingerUntil - loop.time()
+                        )
+                    except asyncio.TimeoutError:
+                        break
+                if batch:
+                    task = asyncio.create_task(
+                        self.__punctuate_segments(batch, language, onPunctuated)
+                    )
+                    pendingTasks.add(task)
+                    task.add_done_callback(pendingTasks.discard)
+                    task.add_done_callback(
+                        lambda task: failedSegments.extend(task.result())
+                        if not task.cancelled()
+                        else None
+                    )
+            await asyncio.gather(*pendingTasks)
+        except BaseException:
+            for task in pendingTasks:
+                task.cancel()
+            raise
+        if not failedSegments:
+            return True
+        # Failed segments get one more try, so a single bad batch does not
+        # leave the reply a mix of punctuated and raw text.
+        failedSegments = await self.__punctuate_segments(
+            failedSegments, language, onPunctuated
+        )
+        if failedSegments:
+            logging.warning(
+                "Could not punctuate %d segments for language `%s`",
+                len(failedSegments),
+                language.value,
+            )
+        return not failedSegments
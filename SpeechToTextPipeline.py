@@ -1,19 +1,23 @@
 from enum import Enum
+from typing import AsyncIterator, Optional
+from pyrogram import Client as BotClient  # type: ignore
 from pyrogram.types import Message as PyrogramMessage
-from models import UserModel
+from models import UserModel, UserStatisticsModel
 from config import Config, AvailableLanguages
 import logging
 import uuid
 import time
-import threading
 from pathlib import Path
-from VoskAPI import VoskAPI
+from VoskAPI import VoskAPI, VoskResult
+from VoskConnectionPool import VOSK_CONNECTION_POOLS
+from TranscriptCache import TRANSCRIPT_CACHE, TranscriptCache
+from TelegramRateLimiter import TELEGRAM_RATE_LIMITER
 from Locale import LOCALE
+from Metrics import track_stage
+from Tracing import MessageTrace
 import asyncio
 from utils import Utils
-import audioread
 from ReCasePuncAPI import RecasepuncAPI
-from models import SpeechRecognitionVoskPartialResult
 
 
 class MESSAGE_TYPES_FILTRED(Enum):
@@ -21,6 +25,15 @@ class MESSAGE_TYPES_FILTRED(Enum):
     AUDIO = "audio"
 
 
+NON_STREAMABLE_MIME_TYPES = (
+    "audio/mp4",
+    "audio/m4a",
+    "audio/x-m4a",
+    "audio/aac",
+    "video/mp4",
+)
+
+
 class STTPipeline:
     def __init__(
         self,
@@ -28,29 +41,47 @@ class STTPipeline:
         message: PyrogramMessage,
         user: UserModel,
         config: Config,
+        client: BotClient,
     ) -> None:
         self.messageType = messageType
         self.message = message
         self.user = user
         self.config = config
+        self.client = client
         self.__post_init__()
 
     def __post_init__(self) -> None:
-        self.user.prefs.statistics.messagesReceived += 1
+        self.statisticsDelta = UserStatisticsModel(
+            processedWithLanguage={language: 0 for language in AvailableLanguages}
+        )
+        self.statisticsDelta.messagesReceived += 1
         self.initialLanguage: AvailableLanguages = self.user.prefs.language
+        self.trace = MessageTrace(
+            f"{self.messageType.value} message",
+            messageId=self.message.id,
+            telegramUserId=self.message.from_user.id,
+            language=self.initialLanguage.value,
+            estimatedDuration=self.get_estimated_duration(),
+        )
+        self.trace.mark("received")
         logging.info(
             "Received %s message from user #%s for message ID #%s",
             self.messageType.value,
             self.message.from_user.id,
             self.message.id,
         )
-        self.botRepliedMessage: PyrogramMessage = self.message.reply_text(
-            f"__💬 {LOCALE.get(self.user.prefs.language, 'voiceMessageReceived') if self.messageType == MESSAGE_TYPES_FILTRED.VOICE else LOCALE.get(self.user.prefs.language, 'fileMessageReceived')}...__",
-            quote=True,
-        )  # type: ignore
         self.vosk = VoskAPI(
             apiKey=self.config.get_vosk_api_key(),
             language=self.initialLanguage,
+            connectionPool=VOSK_CONNECTION_POOLS.get(self.initialLanguage),
+            voiceActivityThreshold=(
+                self.config.get_vosk_vad_energy_threshold()
+                if self.config.get_vosk_vad_enabled()
+                else None
+            ),
+            keepSilenceSeconds=self.config.get_vosk_vad_keep_silence_seconds(),
+            chunkSizePolicy=self.config.get_vosk_chunk_size_policy(),
+            targetPartialsPerSecond=self.config.get_vosk_target_partials_per_second(),
         )
         self.outputFile = (
             Path(f"files_download/{uuid.uuid4().__str__().replace('-', '')}.ogg")
@@ -59,103 +90,279 @@ class STTPipeline:
                 f"files_download/{uuid.uuid4().__str__().replace('-', '')[:16]}-{self.message.audio.file_name.replace(' ', '_').replace('/', '_').replace('-', '_')}"
             )
         )
-        self.results: list[SpeechRecognitionVoskPartialResult] = []
+        self.streamMedia: bool = (
+            self.config.get_telegram_stream_media() and self.__is_streamable()
+        )
+        self.downloadError: Optional[Exception] = None
+        self.statusMessage: Optional[PyrogramMessage] = None
+        self.results: list[VoskResult] = []
+        self.punctuationComplete: bool = True
 
     def get_user(self) -> UserModel:
         return self.user
 
-    def run(self) -> int:
-        if self.__download_message() != 0:
-            return 1
-        self.__start_threads()
-        RCPAPI = RecasepuncAPI(
+    def get_statistics_delta(self) -> UserStatisticsModel:
+        return self.statisticsDelta
+
+    def set_status_message(self, statusMessage: PyrogramMessage) -> None:
+        self.statusMessage = statusMessage
+
+    def __is_streamable(self) -> bool:
+        # MP4-family containers keep their index at the end of the file, so
+        # ffmpeg cannot decode them from a non-seekable pipe.
+        if self.messageType == MESSAGE_TYPES_FILTRED.VOICE:
+            return True
+        return self.message.audio.mime_type not in NON_STREAMABLE_MIME_TYPES
+
+    @staticmethod
+    def get_message_media(
+        message: PyrogramMessage, messageType: MESSAGE_TYPES_FILTRED
+    ):
+        return (
+            message.voice
+            if messageType == MESSAGE_TYPES_FILTRED.VOICE
+            else message.audio
+        )
+
+    @staticmethod
+    def estimate_media_duration(media) -> float:
+        if media.duration:
+            return int(media.duration)
+        # Fall back to the file size at a typical 32 kbit/s voice bitrate.
+        return (media.file_size or 0) / 4000
+
+    def __get_media(self):
+        return STTPipeline.get_message_media(self.message, self.messageType)
+
+    def __get_media_duration(self) -> int:
+        media = self.__get_media()
+        return int(media.duration) if media.duration else 0
+
+    def get_estimated_duration(self) -> float:
+        return STTPipeline.estimate_media_duration(self.__get_media())
+
+    def __cleanup_downloaded_file(self) -> None:
+        self.outputFile.unlink(missing_ok=True)
+
+    async def run(self) -> int:
+        self.trace.mark("started")
+        receivedText = f"__💬 {LOCALE.get(self.user.prefs.language, 'voiceMessageReceived') if self.messageType == MESSAGE_TYPES_FILTRED.VOICE else LOCALE.get(self.user.prefs.language, 'fileMessageReceived')}...__"
+        if self.statusMessage is not None:
+            self.botRepliedMessage: PyrogramMessage = self.statusMessage
+            _ = await TELEGRAM_RATE_LIMITER.edit_text(
+                self.botRepliedMessage, text=receivedText
+            )
+        else:
+            self.botRepliedMessage: PyrogramMessage = (
+                await TELEGRAM_RATE_LIMITER.reply_text(
+                    self.message,
+                    receivedText,
+                    quote=True,
+                )
+            )  # type: ignore
+        try:
+            results, fromCache = await TRANSCRIPT_CACHE.get_or_compute(
+                TranscriptCache.make_key(
+                    self.__get_media().file_unique_id,
+                    self.initialLanguage,
+                    self.user.prefs.recasepunc,
+                ),
+                self.__transcribe,
+                isCacheable=lambda: self.punctuationComplete,
+            )
+            self.trace.mark("transcribed", fromCache=fromCache)
+            if results is None:
+                return 1
+            if fromCache:
+                logging.info(
+                    "Reusing transcript of an identical file for message ID #%s",
+                    self.message.id,
+                )
+            await self.__get_and_process_results(results)
+        finally:
+            # Durations come from the decoded PCM stream, so the file is not
+            # needed past transcription.
+            self.__cleanup_downloaded_file()
+        return 0
+
+    async def __transcribe(self) -> Optional[list[VoskResult]]:
+        if not self.streamMedia and await self.__download_message() != 0:
+            return None
+        if await self.__start_tasks() != 0:
+            return None
+        return self.vosk.get_results()
+
+    def __get_recasepunc_api(self) -> RecasepuncAPI:
+        return RecasepuncAPI(
             apiKey=self.config.get_vprw_rcpapi_key(),
             endpointBase=self.config.get_vprw_rcpapi_endpoint(),
+            timeout=self.config.get_vprw_rcpapi_timeout_seconds(),
+            maxBatchCharacters=self.config.get_vprw_rcpapi_batch_max_characters(),
+            batchLingerSeconds=self.config.get_vprw_rcpapi_batch_linger_seconds(),
+        )
+
+    async def __stream_message(self) -> AsyncIterator[bytes]:
+        try:
+            with track_stage("download", "stream"):
+                async for chunk in self.client.stream_media(self.message):  # type: ignore
+                    yield chunk
+        except Exception as e:
+            self.downloadError = e
+            raise
+
+    async def __report_download_error(self, e: Exception) -> None:
+        logging.error(
+            "Error while downloading message from user #%s for message ID #%s: %s",
+            self.message.from_user.id,
+            self.message.id,
+            e,
+        )
+        _ = await TELEGRAM_RATE_LIMITER.edit_text(
+            self.botRepliedMessage,
+            f"__❌ {LOCALE.get(self.user.prefs.language, 'errorWhileDownloading')}__\n\n```{e}```"
         )
-        self.__get_and_process_results(RCPAPI)
-        return 0
 
-    def __download_message(self) -> int:
+    async def __download_message(self) -> int:
         try:
-            _ = self.message.download(file_name=self.outputFile.__str__())
+            with track_stage("download", "file"):
+                _ = await self.message.download(file_name=self.outputFile.__str__())
             return 0
         except Exception as e:
-            logging.error(
-                "Error while downloading message from user #%s for message ID #%s: %s",
-                self.message.from_user.id,
-                self.message.id,
-                e,
-            )
-            _ = self.botRepliedMessage.edit_text(
-                f"__❌ {LOCALE.get(self.user.prefs.language, 'errorWhileDownloading')}__\n\n```{e}```"
-            )
+            await self.__report_download_error(e)
             return 1
 
-    def __start_threads(self) -> None:
-        threadProcessor = threading.Thread(
-            target=asyncio.run,
-            args=(
-                self.vosk.process_audio_file(
-                    audioFile=self.outputFile,
-                    bytesToReadEveryTime=64000,
-                ),
-            ),
+    def __get_parallel_sessions(self) -> int:
+        # Only long audio files are worth splitting; voice messages are short
+        # and their latency is dominated by the first segment anyway.
+        if (
+            self.messageType == MESSAGE_TYPES_FILTRED.AUDIO
+            and self.get_estimated_duration()
+            >= self.config.get_vosk_parallel_min_duration_seconds()
+        ):
+            return self.config.get_vosk_parallel_sessions()
+        return 1
+
+    async def __start_tasks(self) -> int:
+        parallelSessions = self.__get_parallel_sessions()
+        segmentSeconds = self.config.get_vosk_parallel_segment_seconds()
+        initialChunkBytes = self.config.get_vosk_initial_chunk_bytes()
+        taskProcessor = asyncio.create_task(
+            self.vosk.process_audio_stream(
+                inputChunks=self.__stream_message(),
+                sourceDescription=f"message #{self.message.id}",
+                bytesToReadEveryTime=initialChunkBytes,
+                parallelSessions=parallelSessions,
+                segmentSeconds=segmentSeconds,
+            )
+            if self.streamMedia
+            else self.vosk.process_audio_file(
+                audioFile=self.outputFile,
+                bytesToReadEveryTime=initialChunkBytes,
+                parallelSessions=parallelSessions,
+                segmentSeconds=segmentSeconds,
+            )
         )
-        threadTelegramMessageEditor = threading.Thread(
-            target=Utils.update_stt_result_as_everything_comes_in,
-            args=(
+        editorSubscriber = self.vosk.subscribe()
+        taskTelegramMessageEditor = asyncio.create_task(
+            Utils.update_stt_result_as_everything_comes_in(
                 self.botRepliedMessage,
                 self.vosk,
                 self.user.prefs.howManyDigitsAfterDot,
-            ),
+                subscriber=editorSubscriber,
+            )
         )
-        threadProcessor.start()
-        threadTelegramMessageEditor.start()
-        _ = self.botRepliedMessage.edit_text(
+        taskPunctuation = asyncio.create_task(
+            self.__get_recasepunc_api().punctuate_stream(
+                self.vosk.subscribe(),
+                self.initialLanguage,
+                # Punctuated segments are sent to the live editor again.
+                onPunctuated=editorSubscriber.put_nowait,
+            )
+            if self.user.prefs.recasepunc
+            else asyncio.sleep(0)
+        )
+        if self.user.prefs.recasepunc:
+            taskPunctuation.add_done_callback(
+                lambda _: self.trace.mark("punctuation_done", "recasepunc")
+            )
+        _ = await TELEGRAM_RATE_LIMITER.edit_text(
+            self.botRepliedMessage,
             text=f"__🔁 {LOCALE.get(self.user.prefs.language, 'voiceMessageProcessing') if self.messageType == MESSAGE_TYPES_FILTRED.VOICE else LOCALE.get(self.user.prefs.language, 'fileMessageProcessing')}...__"
         )
-        threadProcessor.join()
-        threadTelegramMessageEditor.join()
+        processorResult, editorResult, punctuationResult = await asyncio.gather(
+            taskProcessor,
+            taskTelegramMessageEditor,
+            taskPunctuation,
+            return_exceptions=True,
+        )
+        if isinstance(editorResult, Exception):
+            logging.warning(
+                "Live editing failed for message ID #%s: %s",
+                self.message.id,
+                editorResult,
+            )
+        if isinstance(punctuationResult, Exception):
+            logging.warning(
+                "Punctuation failed for message ID #%s: %s",
+                self.message.id,
+                punctuationResult,
+            )
+        if self.user.prefs.recasepunc:
+            self.punctuationComplete = punctuationResult is True
+        if isinstance(processorResult, Exception):
+            if self.downloadError is not None:
+                await self.__report_download_error(self.downloadError)
+                return 1
+            raise processorResult
+        return 0
 
-    def __get_and_process_results(self, RCPAPI: RecasepuncAPI) -> None:
-        self.results = self.vosk.get_results()
+    async def __get_and_process_results(
+        self, results: list[VoskResult]
+    ) -> None:
+        self.results = results
         if self.results is None or len(self.results) == 0:
-            _ = self.botRepliedMessage.edit_text(
+            _ = await TELEGRAM_RATE_LIMITER.edit_text(
+                self.botRepliedMessage,
                 text=f"__⚠️ {LOCALE.get(self.user.prefs.language, 'noWordsFound')}!__"
             )
             return
-        Utils.send_stt_result_with_respecting_max_message_length(
-            message=self.message,
-            initialMessage=self.botRepliedMessage,
-            vosk=self.vosk,
-            user=self.user,
-            rcpapi=RCPAPI if self.user.prefs.recasepunc else None,
-            language=self.initialLanguage,
-        )
+        with self.trace.span("send"):
+            await Utils.send_stt_result_with_respecting_max_message_length(
+                message=self.message,
+                initialMessage=self.botRepliedMessage,
+                results=self.results,
+                user=self.user,
+                language=self.initialLanguage,
+            )
 
     def analytics(self, newUser: UserModel) -> None:
+        with self.trace.span("analytics"):
+            self.__analytics(newUser)
+
+    def __analytics(self, newUser: UserModel) -> None:
         startTimeAnalytics = time.time()
         self.user = newUser
         if self.user.prefs.participateInStatistics:
-            self.user.prefs.statistics.processedWithLanguage[
+            self.statisticsDelta.processedWithLanguage[
                 self.initialLanguage.value
             ] += 1
-            self.user.prefs.statistics.messagesProcessed += 1
-            self.user.prefs.statistics.charactersProcessed += sum(
+            self.statisticsDelta.messagesProcessed += 1
+            self.statisticsDelta.charactersProcessed += sum(
                 len(resultResult.text) for resultResult in self.results
             )
-            fileOggType = audioread.audio_open(self.outputFile.__str__())
-            self.user.prefs.statistics.secondsOfAudioProcessed += (
-                int(fileOggType.duration) if fileOggType.duration else 0
+            decodedSeconds = self.vosk.get_stream_statistics().audioSeconds
+            self.statisticsDelta.secondsOfAudioProcessed += (
+                int(decodedSeconds)
+                if decodedSeconds > 0
+                else self.__get_media_duration()
             )
         self.user.name = (
             f"{self.message.from_user.first_name} {self.message.from_user.last_name} (@{self.message.from_user.username})"
             if self.message.from_user.username is not None
             else f"{self.message.from_user.first_name} {self.message.from_user.last_name} (null)"
         )
-        self.outputFile.unlink()
         logging.info(
-            "Processed %s message analytics and cleaned up for user #%s for message ID #%s in %s seconds",
+            "Processed %s message analytics for user #%s for message ID #%s in %s seconds",
             self.messageType.value,
             self.message.from_user.id,
             self.message.id,
@@ -0,0 +1,72 @@
+from typing import Optional
+from models import UserStatisticsModel
+from UserCache import UserCache
+import asyncio
+import logging
+
+
+class StatisticsAggregator:
+    def __init__(
+        self,
+        userCache: UserCache,
+        flushIntervalSeconds: float = 30,
+        maxUsersPerBatch: int = 50,
+    ) -> None:
+        self.__USER_CACHE = userCache
+        self.__FLUSH_INTERVAL_SECONDS = flushIntervalSeconds
+        self.__MAX_USERS_PER_BATCH = maxUsersPerBatch
+        self.__PENDING: dict[int, UserStatisticsModel] = {}
+        self.__FLUSH_LOCK = asyncio.Lock()
+        self.__FLUSH_TASK: Optional[asyncio.Task] = None
+
+    def record(self, telegramUserId: int, delta: UserStatisticsModel) -> None:
+        pending = self.__PENDING.get(telegramUserId)
+        if pending is None:
+            self.__PENDING[telegramUserId] = delta.copy(deep=True)
+            return
+        pending.add(delta)
+
+    def get_pending_count(self) -> int:
+        return len(self.__PENDING)
+
+    async def __flush_user(
+        self, telegramUserId: int, delta: UserStatisticsModel
+    ) -> None:
+        try:
+            await self.__USER_CACHE.add_statistics(telegramUserId, delta)
+        except Exception as e:
+            logging.error(
+                "Error while flushing statistics for user #%s: %s", telegramUserId, e
+            )
+            self.record(telegramUserId, delta)
+
+    async def flush(self) -> None:
+        async with self.__FLUSH_LOCK:
+            pending, self.__PENDING = self.__PENDING, {}
+            if not pending:
+                return
+            pendingItems = list(pending.items())
+            for batchStart in range(0, len(pendingItems), self.__MAX_USERS_PER_BATCH):
+                await asyncio.gather(
+                    *[
+                        self.__flush_user(telegramUserId, delta)
+                        for telegramUserId, delta in pendingItems[
+                            batchStart : batchStart + self.__MAX_USERS_PER_BATCH
+                        ]
+                    ]
+                )
+            logging.info("Flushed statistics for %d users", len(pendingItems))
+
+    async def __flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.__FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    def start(self) -> None:
+        if self.__FLUSH_TASK is None or self.__FLUSH_TASK.done():
+            self.__FLUSH_TASK = asyncio.create_task(self.__flush_periodically())
+
+    async def close(self) -> None:
+        if self.__FLUSH_TASK is not None:
+            self.__FLUSH_TASK.cancel()
+        await self.flush()
@@ -0,0 +1,211 @@
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from pyrogram.types import Message as PyrogramMessage
+from pyrogram.errors import FloodWait
+from config import Config
+from Metrics import (
+    TELEGRAM_FLOOD_WAITS,
+    TELEGRAM_SUPERSEDED_EDITS,
+    track_stage,
+)
+import asyncio
+import time
+import logging
+
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updatedAt", "blockedUntil", "lock")
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updatedAt = time.monotonic()
+        self.blockedUntil = 0.0
+        self.lock = asyncio.Lock()
+
+    def __refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updatedAt) * self.rate
+        )
+        self.updatedAt = now
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self.__refill(now)
+        return (
+            not self.lock.locked()
+            and self.tokens >= self.capacity
+            and self.blockedUntil <= now
+        )
+
+    def block_for(self, seconds: float) -> None:
+        self.blockedUntil = max(self.blockedUntil, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.__refill(now)
+                waitFor = self.blockedUntil - now
+                if waitFor <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    waitFor = (1 - self.tokens) / self.rate
+                await asyncio.sleep(waitFor)
+
+
+class PendingEdit:
+    __slots__ = ("text", "kwargs", "future")
+
+    def __init__(self, text: str, kwargs: dict, future: asyncio.Future) -> None:
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+
+
+class TelegramRateLimiter:
+    def __init__(
+        self,
+        globalRatePerSecond: float = 25,
+        globalBurst: int = 30,
+        chatRatePerSecond: float = 1,
+        chatBurst: int = 3,
+        floodWaitMaxRetries: int = 3,
+        maxIdleChatBuckets: int = 10000,
+    ) -> None:
+        self.__GLOBAL_BUCKET = TokenBucket(globalRatePerSecond, globalBurst)
+        self.__CHAT_RATE_PER_SECOND = chatRatePerSecond
+        self.__CHAT_BURST = chatBurst
+        self.__FLOOD_WAIT_MAX_RETRIES = floodWaitMaxRetries
+        self.__MAX_IDLE_CHAT_BUCKETS = maxIdleChatBuckets
+        self.__CHAT_BUCKETS: dict[int, TokenBucket] = {}
+        self.__PENDING_EDITS: dict[tuple[int, int], PendingEdit] = {}
+        self.__SUPERSEDED_EDITS: int = 0
+        self.__FLOOD_WAITS: int = 0
+
+    def get_superseded_edits_count(self) -> int:
+        return self.__SUPERSEDED_EDITS
+
+    def get_flood_waits_count(self) -> int:
+        return self.__FLOOD_WAITS
+
+    def __get_chat_bucket(self, chatId: int) -> TokenBucket:
+        bucket = self.__CHAT_BUCKETS.get(chatId)
+        if bucket is not None:
+            return bucket
+        if len(self.__CHAT_BUCKETS) >= self.__MAX_IDLE_CHAT_BUCKETS:
+            for cachedChatId, cachedBucket in list(self.__CHAT_BUCKETS.items()):
+                if cachedBucket.is_idle():
+                    del self.__CHAT_BUCKETS[cachedChatId]
+        bucket = TokenBucket(self.__CHAT_RATE_PER_SECOND, self.__CHAT_BURST)
+        self.__CHAT_BUCKETS[chatId] = bucket
+        return bucket
+
+    async def __acquire(self, chatId: int, methodName: str) -> None:
+        with track_stage("telegram_throttle", methodName):
+            await self.__get_chat_bucket(chatId).acquire()
+            await self.__GLOBAL_BUCKET.acquire()
+
+    @staticmethod
+    def __get_method_name(method: Callable) -> str:
+        return getattr(method, "__name__", "unknown")
+
+    async def __call(
+        self, chatId: int, method: Callable[..., Awaitable[T]], *args, **kwargs
+    ) -> T:
+        methodName = self.__get_method_name(method)
+        attempt = 0
+        while True:
+            try:
+                with track_stage("telegram", methodName):
+                    return await method(*args, **kwargs)
+            except FloodWait as e:
+                attempt += 1
+                self.__FLOOD_WAITS += 1
+                retryAfter = float(e.value)  # type: ignore
+                logging.warning(
+                    "Telegram asked to wait %s seconds before calling `%s` in chat #%s",
+                    retryAfter,
+                    methodName,
+                    chatId,
+                )
+                self.__get_chat_bucket(chatId).block_for(retryAfter)
+                # Waits longer than the chat's own pacing usually cover the
+                # whole bot account, so other chats would only hit it too.
+                if retryAfter * self.__CHAT_RATE_PER_SECOND > 1:
+                    self.__GLOBAL_BUCKET.block_for(retryAfter)
+                if attempt > self.__FLOOD_WAIT_MAX_RETRIES:
+                    raise
+                await self.__acquire(chatId, methodName)
+
+    async def call(
+        self, chatId: int, method: Callable[..., Awaitable[T]], *args, **kwargs
+    ) -> T:
+        await self.__acquire(chatId, self.__get_method_name(method))
+        return await self.__call(chatId, method, *args, **kwargs)
+
+    async def reply_text(self, message: PyrogramMessage, *args, **kwargs) -> Any:
+        return await self.call(message.chat.id, message.reply_text, *args, **kwargs)
+
+    async def reply_document(self, message: PyrogramMessage, *args, **kwargs) -> Any:
+        return await self.call(
+            message.chat.id, message.reply_document, *args, **kwargs
+        )
+
+    async def delete(self, message: PyrogramMessage) -> Any:
+        return await self.call(message.chat.id, message.delete)
+
+    async def edit_text(
+        self, message: PyrogramMessage, text: str, **kwargs
+    ) -> Optional[PyrogramMessage]:
+        # An edit still waiting for its turn is overwritten by newer ones for
+        # the same message, so only the latest text is ever sent.
+        key = (message.chat.id, message.id)
+        pending = self.__PENDING_EDITS.get(key)
+        if pending is not None:
+            pending.text, pending.kwargs = text, kwargs
+            self.__SUPERSEDED_EDITS += 1
+            return await asyncio.shield(pending.future)
+        pending = PendingEdit(text, kwargs, asyncio.get_running_loop().create_future())
+        self.__PENDING_EDITS[key] = pending
+        try:
+            await self.__acquire(message.chat.id, "edit_text")
+        except BaseException:
+            pending.future.cancel()
+            raise
+        finally:
+            del self.__PENDING_EDITS[key]
+        try:
+            result = await self.__call(
+                message.chat.id,
+                message.edit_text,
+                text=pending.text,
+                **pending.kwargs,
+            )
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                pending.future.cancel()
+            else:
+                pending.future.set_exception(e)
+                pending.future.exception()
+            raise
+        pending.future.set_result(result)
+        return result
+
+
+TELEGRAM_RATE_LIMITER = TelegramRateLimiter(
+    globalRatePerSecond=Config.get_telegram_global_rate_per_second(),
+    globalBurst=Config.get_telegram_global_burst(),
+    chatRatePerSecond=Config.get_telegram_chat_rate_per_second(),
+    chatBurst=Config.get_telegram_chat_burst(),
+    floodWaitMaxRetries=Config.get_telegram_flood_wait_max_retries(),
+)
+
+TELEGRAM_FLOOD_WAITS.set_collector(TELEGRAM_RATE_LIMITER.get_flood_waits_count)
+TELEGRAM_SUPERSEDED_EDITS.set_collector(
+    TELEGRAM_RATE_LIMITER.get_superseded_edits_count
+)
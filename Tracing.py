@@ -0,0 +1,338 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
+from config import Config, TraceFormat
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+
+
+class TraceSpan:
+    __slots__ = ("name", "category", "startedAt", "duration", "attributes")
+
+    def __init__(
+        self,
+        name: str,
+        category: str,
+        startedAt: float,
+        duration: Optional[float],
+        attributes: dict,
+    ) -> None:
+        self.name = name
+        self.category = category
+        self.startedAt = startedAt
+        # Marks are spans without a duration.
+        self.duration = duration
+        self.attributes = attributes
+
+
+class MessageTrace:
+    def __init__(self, name: str, **attributes) -> None:
+        self.traceId = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.startedAt = time.time()
+        self.__STARTED_MONOTONIC = time.monotonic()
+        self.__FINISHED_MONOTONIC: Optional[float] = None
+        # Spans are also added from `asyncio.to_thread` workers; list appends
+        # are atomic, so no lock is needed.
+        self.__SPANS: list[TraceSpan] = []
+        self.__MARKED: set[str] = set()
+
+    def add_span(
+        self,
+        name: str,
+        category: str,
+        startedAt: float,
+        duration: Optional[float] = None,
+        **attributes,
+    ) -> None:
+        self.__SPANS.append(
+            TraceSpan(
+                name,
+                category,
+                startedAt - self.__STARTED_MONOTONIC,
+                duration,
+                attributes,
+            )
+        )
+
+    def mark(self, name: str, category: str = "pipeline", **attributes) -> None:
+        self.__MARKED.add(name)
+        self.add_span(name, category, time.monotonic(), **attributes)
+
+    def mark_once(self, name: str, category: str = "pipeline", **attributes) -> None:
+        if name not in self.__MARKED:
+            self.mark(name, category, **attributes)
+
+    @contextmanager
+    def span(
+        self, name: str, category: str = "pipeline", **attributes
+    ) -> Iterator[None]:
+        startedAt = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(
+                name, category, startedAt, time.monotonic() - startedAt, **attributes
+            )
+
+    def finish(self) -> None:
+        if self.__FINISHED_MONOTONIC is None:
+            self.__FINISHED_MONOTONIC = time.monotonic()
+            self.mark("finished")
+
+    def get_duration(self) -> float:
+        return (
+            self.__FINISHED_MONOTONIC or time.monotonic()
+        ) - self.__STARTED_MONOTONIC
+
+    def get_spans(self) -> list[TraceSpan]:
+        return sorted(self.__SPANS, key=lambda span: span.startedAt)
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.traceId,
+            "name": self.name,
+            "startedAt": self.startedAt,
+            "duration": self.get_duration(),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "category": span.category,
+                    "offset": span.startedAt,
+                    "duration": span.duration,
+                    "attributes": span.attributes,
+                }
+                for span in self.get_spans()
+            ],
+        }
+
+    def to_chrome_events(self) -> list[dict]:
+        # One row per category keeps concurrent stages (live edits while
+        # Vosk is still streaming) from being drawn on top of each other.
+        processId = os.getpid()
+        threadIds: dict[str, int] = {}
+        events: list[dict] = []
+        for span in self.get_spans():
+            if span.category not in threadIds:
+                threadIds[span.category] = len(threadIds) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": processId,
+                        "tid": threadIds[span.category],
+                        "args": {"name": span.category},
+                    }
+                )
+            event = {
+                "name": span.name,
+                "cat": span.category,
+                "ts": (self.startedAt + span.startedAt) * 1e6,
+                "pid": processId,
+                "tid": threadIds[span.category],
+                "args": span.attributes,
+            }
+            if span.duration is None:
+                event.update({"ph": "i", "s": "t"})
+            else:
+                event.update({"ph": "X", "dur": span.duration * 1e6})
+            events.append(event)
+        return events
+
+
+CURRENT_TRACE: ContextVar[Optional[MessageTrace]] = ContextVar(
+    "CURRENT_TRACE", default=None
+)
+
+
+def get_current_trace() -> Optional[MessageTrace]:
+    return CURRENT_TRACE.get()
+
+
+@contextmanager
+def activate_trace(trace: MessageTrace) -> Iterator[MessageTrace]:
+    # Tasks copy the context they are created in, so everything the pipeline
+    # spawns while the trace is active reports into it.
+    token = CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        CURRENT_TRACE.reset(token)
+
+
+def mark_current_trace(name: str, category: str = "pipeline", **attributes) -> None:
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.mark(name, category, **attributes)
+
+
+def mark_current_trace_once(
+    name: str, category: str = "pipeline", **attributes
+) -> None:
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.mark_once(name, category, **attributes)
+
+
+class TraceExporter:
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        traceFormat: TraceFormat = TraceFormat.JSONL,
+        slowThresholdSeconds: float = 30,
+    ) -> None:
+        self.__DIRECTORY = directory
+        self.__FORMAT = traceFormat
+        self.__SLOW_THRESHOLD_SECONDS = slowThresholdSeconds
+        self.__LOCK = threading.Lock()
+        if self.__DIRECTORY is not None:
+            self.__DIRECTORY.mkdir(parents=True, exist_ok=True)
+
+    def get_enabled(self) -> bool:
+        return self.__DIRECTORY is not None
+
+    def __write(self, trace: MessageTrace) -> Path:
+        assert self.__DIRECTORY is not None
+        if self.__FORMAT == TraceFormat.CHROME:
+            path = self.__DIRECTORY / f"{int(trace.startedAt)}-{trace.traceId}.json"
+            path.write_text(
+                json.dumps(
+                    {
+                        "traceEvents": trace.to_chrome_events(),
+                        "displayTimeUnit": "ms",
+                        "otherData": {"name": trace.name, **trace.attributes},
+                    },
+                    default=str,
+                )
+            )
+            return path
+        path = self.__DIRECTORY / "traces.jsonl"
+        line = json.dumps(trace.to_dict(), default=str)
+        with self.__LOCK:
+            with path.open("a") as f:
+                f.write(line + "\n")
+        return path
+
+    async def export(self, trace: MessageTrace) -> Optional[Path]:
+        if self.__DIRECTORY is None:
+            return None
+        if trace.get_duration() < self.__SLOW_THRESHOLD_SECONDS:
+            return None
+        try:
+            path = await asyncio.to_thread(self.__write, trace)
+        except OSError as e:
+            logging.warning("Could not export trace `%s`: %s", trace.traceId, e)
+            return None
+        logging.info(
+            "Exported trace `%s` of a %.2f seconds %s to `%s`",
+            trace.traceId,
+            trace.get_duration(),
+            trace.name,
+            path,
+        )
+        return path
+
+
+class MessageProfiler:
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        sampleEvery: int = 100,
+        enabled: bool = False,
+    ) -> None:
+        self.__DIRECTORY = directory
+        self.__SAMPLE_EVERY = max(1, sampleEvery)
+        self.__ENABLED = enabled and directory is not None
+        self.__MESSAGES_SEEN = 0
+        self.__ACTIVE = False
+        if self.__DIRECTORY is not None:
+            self.__DIRECTORY.mkdir(parents=True, exist_ok=True)
+
+    def get_enabled(self) -> bool:
+        return self.__ENABLED
+
+    def set_enabled(self, enabled: bool) -> None:
+        if enabled and self.__DIRECTORY is None:
+            logging.warning("Profiling needs PROFILING_DIRECTORY to be set")
+            return
+        self.__ENABLED = enabled
+        logging.info(
+            "Message profiling %s (1 in %d messages)",
+            "enabled" if enabled else "disabled",
+            self.__SAMPLE_EVERY,
+        )
+
+    def set_sample_every(self, sampleEvery: int) -> None:
+        self.__SAMPLE_EVERY = max(1, sampleEvery)
+
+    def toggle(self) -> None:
+        self.set_enabled(not self.__ENABLED)
+
+    def __should_sample(self) -> bool:
+        if not self.__ENABLED or self.__ACTIVE:
+            return False
+        self.__MESSAGES_SEEN += 1
+        return self.__MESSAGES_SEEN % self.__SAMPLE_EVERY == 0
+
+    @asynccontextmanager
+    async def profile(self, trace: MessageTrace) -> AsyncIterator[None]:
+        if not self.__should_sample():
+            yield
+            return
+        # cProfile follows the event loop thread, so the profile also holds
+        # whatever other messages ran meanwhile; only one runs at a time
+        # since the interpreter allows a single active profiler.
+        profiler = cProfile.Profile()
+        self.__ACTIVE = True
+        try:
+            profiler.enable()
+        except ValueError as e:
+            self.__ACTIVE = False
+            logging.warning("Could not start the profiler: %s", e)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.__ACTIVE = False
+            assert self.__DIRECTORY is not None
+            path = self.__DIRECTORY / f"{int(trace.startedAt)}-{trace.traceId}.prof"
+            trace.attributes["profile"] = path.__str__()
+            try:
+                await asyncio.to_thread(profiler.dump_stats, path.__str__())
+                logging.info("Profiled trace `%s` to `%s`", trace.traceId, path)
+            except OSError as e:
+                logging.warning("Could not write profile `%s`: %s", path, e)
+
+    def install_signal_toggle(self) -> None:
+        # `kill -USR1 <pid>` switches sampling on and off without a restart.
+        if not hasattr(signal, "SIGUSR1"):
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.toggle)
+        except (NotImplementedError, RuntimeError) as e:
+            logging.debug("Could not install the profiling signal handler: %s", e)
+
+
+TRACE_EXPORTER = TraceExporter(
+    directory=Config.get_trace_directory(),
+    traceFormat=Config.get_trace_format(),
+    slowThresholdSeconds=Config.get_trace_slow_threshold_seconds(),
+)
+
+MESSAGE_PROFILER = MessageProfiler(
+    directory=Config.get_profiling_directory(),
+    sampleEvery=Config.get_profiling_sample_every(),
+    enabled=Config.get_profiling_enabled(),
+)
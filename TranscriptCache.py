@@ -0,0 +1,230 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+from config import AvailableLanguages, Config
+from models import SpeechRecognitionVoskPartialResult
+from pydantic import ValidationError
+from VoskAPI import VoskResult
+import asyncio
+import hashlib
+import json
+import time
+import logging
+
+
+TranscriptCacheKey = tuple[str, AvailableLanguages, bool]
+
+
+class TranscriptCache:
+    def __init__(
+        self,
+        maxEntries: int = 1024,
+        ttlSeconds: float = 86400,
+        directory: Optional[Path] = None,
+        diskMaxBytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.__MAX_ENTRIES = maxEntries
+        self.__TTL_SECONDS = ttlSeconds
+        self.__DIRECTORY = directory
+        self.__DISK_MAX_BYTES = diskMaxBytes
+        self.__MEMORY: OrderedDict[
+            TranscriptCacheKey, tuple[float, list[VoskResult]]
+        ] = OrderedDict()
+        self.__IN_FLIGHT: dict[TranscriptCacheKey, asyncio.Future] = {}
+        if self.__DIRECTORY is not None:
+            self.__DIRECTORY.mkdir(parents=True, exist_ok=True)
+        logging.debug(
+            "Initialized TranscriptCache with %d entries, %s seconds TTL and disk tier `%s`",
+            maxEntries,
+            ttlSeconds,
+            directory,
+        )
+
+    @staticmethod
+    def make_key(
+        fileUniqueId: str, language: AvailableLanguages, recasepunc: bool
+    ) -> TranscriptCacheKey:
+        return (fileUniqueId, language, recasepunc)
+
+    @staticmethod
+    def __copy_results(
+        results: list[VoskResult],
+    ) -> list[VoskResult]:
+        return [result.copy() for result in results]
+
+    def __get_disk_path(self, key: TranscriptCacheKey) -> Path:
+        digest = hashlib.sha256(
+            f"{key[0]}-{key[1].value}-{int(key[2])}".encode()
+        ).hexdigest()
+        return self.__DIRECTORY / f"{digest}.json"  # type: ignore
+
+    def __get_from_memory(
+        self, key: TranscriptCacheKey
+    ) -> Optional[list[VoskResult]]:
+        entry = self.__MEMORY.get(key)
+        if entry is None:
+            return None
+        storedAt, results = entry
+        if time.time() - storedAt > self.__TTL_SECONDS:
+            del self.__MEMORY[key]
+            return None
+        self.__MEMORY.move_to_end(key)
+        return self.__copy_results(results)
+
+    def __put_to_memory(
+        self,
+        key: TranscriptCacheKey,
+        results: list[VoskResult],
+        storedAt: float,
+    ) -> None:
+        self.__MEMORY[key] = (storedAt, self.__copy_results(results))
+        self.__MEMORY.move_to_end(key)
+        while len(self.__MEMORY) > self.__MAX_ENTRIES:
+            self.__MEMORY.popitem(last=False)
+
+    def __get_from_disk(
+        self, key: TranscriptCacheKey
+    ) -> Optional[tuple[float, list[VoskResult]]]:
+        path = self.__get_disk_path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if time.time() - data["storedAt"] > self.__TTL_SECONDS:
+                path.unlink(missing_ok=True)
+                return None
+            return data["storedAt"], [
+                VoskResult.from_model(SpeechRecognitionVoskPartialResult(**result))
+                for result in data["results"]
+            ]
+        except OSError:
+            return None
+        except (json.JSONDecodeError, KeyError, TypeError, ValidationError) as e:
+            # Truncated or outdated entries are misses and get replaced.
+            logging.warning(
+                "Dropping unreadable transcript cache entry `%s`: %s", path, e
+            )
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return None
+
+    def __put_to_disk(
+        self,
+        key: TranscriptCacheKey,
+        results: list[VoskResult],
+        storedAt: float,
+    ) -> None:
+        path = self.__get_disk_path(key)
+        temporaryPath = path.with_suffix(".tmp")
+        with open(temporaryPath, "w") as f:
+            json.dump(
+                {
+                    "storedAt": storedAt,
+                    "results": [result.to_model().dict() for result in results],
+                },
+                f,
+            )
+        temporaryPath.replace(path)
+        self.__evict_disk()
+
+    def __evict_disk(self) -> None:
+        now = time.time()
+        files: list[tuple[float, int, Path]] = []
+        for path in self.__DIRECTORY.glob("*.json"):  # type: ignore
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.__TTL_SECONDS:
+                path.unlink(missing_ok=True)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        totalBytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if totalBytes <= self.__DISK_MAX_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            totalBytes -= size
+
+    async def get(
+        self, key: TranscriptCacheKey
+    ) -> Optional[list[VoskResult]]:
+        results = self.__get_from_memory(key)
+        if results is not None or self.__DIRECTORY is None:
+            return results
+        entry = await asyncio.to_thread(self.__get_from_disk, key)
+        if entry is None:
+            return None
+        self.__put_to_memory(key, entry[1], entry[0])
+        return entry[1]
+
+    async def put(
+        self,
+        key: TranscriptCacheKey,
+        results: list[VoskResult],
+    ) -> None:
+        storedAt = time.time()
+        self.__put_to_memory(key, results, storedAt)
+        if self.__DIRECTORY is None:
+            return
+        try:
+            await asyncio.to_thread(self.__put_to_disk, key, results, storedAt)
+        except OSError as e:
+            logging.warning("Could not write transcript to the disk cache: %s", e)
+
+    async def get_or_compute(
+        self,
+        key: TranscriptCacheKey,
+        compute: Callable[
+            [], Awaitable[Optional[list[VoskResult]]]
+        ],
+        isCacheable: Callable[[], bool] = lambda: True,
+    ) -> tuple[Optional[list[VoskResult]], bool]:
+        while True:
+            results = await self.get(key)
+            if results is not None:
+                logging.debug("Transcript cache hit for file `%s`", key[0])
+                return results, True
+            inFlight = self.__IN_FLIGHT.get(key)
+            if inFlight is None:
+                break
+            try:
+                results = await asyncio.shield(inFlight)
+            except asyncio.CancelledError:
+                if not inFlight.cancelled():
+                    raise
+                results = None
+            except Exception:
+                results = None
+            if results is not None:
+                logging.debug("Transcript shared with an in-flight run for `%s`", key[0])
+                return self.__copy_results(results), True
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.__IN_FLIGHT[key] = future
+        try:
+            results = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            # Empty or partly punctuated transcripts may come from a transient
+            # failure, so the next identical file is transcribed again.
+            if results and isCacheable():
+                await self.put(key, results)
+            future.set_result(results)
+        finally:
+            del self.__IN_FLIGHT[key]
+        return results, False
+
+
+TRANSCRIPT_CACHE = TranscriptCache(
+    maxEntries=Config.get_transcript_cache_max_entries(),
+    ttlSeconds=Config.get_transcript_cache_ttl_seconds(),
+    directory=Config.get_transcript_cache_directory(),
+    diskMaxBytes=Config.get_transcript_cache_disk_max_bytes(),
+)
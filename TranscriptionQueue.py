@@ -0,0 +1,248 @@
+from abc import ABC, abstractmethod
+from contextlib import closing
+from pathlib import Path
+from typing import Optional
+from config import Config
+from models import TranscriptionQueueJobModel
+import asyncio
+import sqlite3
+import time
+import logging
+
+
+class TranscriptionQueueBackend(ABC):
+    @abstractmethod
+    async def enqueue(self, job: TranscriptionQueueJobModel) -> None:
+        ...
+
+    @abstractmethod
+    async def lease(self, workerId: str) -> Optional[TranscriptionQueueJobModel]:
+        ...
+
+    @abstractmethod
+    async def renew(self, jobId: str, workerId: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def complete(self, jobId: str, workerId: str) -> None:
+        ...
+
+    @abstractmethod
+    async def fail(self, jobId: str, workerId: str, error: str) -> None:
+        ...
+
+    @abstractmethod
+    async def get_depth(self) -> int:
+        ...
+
+
+class InProcessTranscriptionQueue(TranscriptionQueueBackend):
+    def __init__(
+        self, leaseSeconds: float = 60, maxAttempts: int = 3, agingFactor: float = 10
+    ) -> None:
+        self.__LEASE_SECONDS = leaseSeconds
+        self.__MAX_ATTEMPTS = maxAttempts
+        self.__AGING_FACTOR = agingFactor
+        self.__JOBS: dict[str, TranscriptionQueueJobModel] = {}
+        self.__ENQUEUED_AT: dict[str, float] = {}
+        self.__LEASES: dict[str, tuple[str, float]] = {}
+
+    def __expire_leases(self, now: float) -> None:
+        for jobId, (workerId, leaseExpiresAt) in list(self.__LEASES.items()):
+            if leaseExpiresAt >= now:
+                continue
+            del self.__LEASES[jobId]
+            logging.warning(
+                "Lease of transcription job `%s` held by worker `%s` expired",
+                jobId,
+                workerId,
+            )
+            if self.__JOBS[jobId].attempts >= self.__MAX_ATTEMPTS:
+                del self.__JOBS[jobId]
+                del self.__ENQUEUED_AT[jobId]
+
+    async def enqueue(self, job: TranscriptionQueueJobModel) -> None:
+        self.__JOBS[job.jobId] = job
+        self.__ENQUEUED_AT[job.jobId] = time.time()
+
+    async def lease(self, workerId: str) -> Optional[TranscriptionQueueJobModel]:
+        now = time.time()
+        self.__expire_leases(now)
+        available = [
+            job for jobId, job in self.__JOBS.items() if jobId not in self.__LEASES
+        ]
+        if not available:
+            return None
+        job = min(
+            available,
+            key=lambda job: job.estimatedCost
+            - self.__AGING_FACTOR * (now - self.__ENQUEUED_AT[job.jobId]),
+        )
+        job.attempts += 1
+        self.__LEASES[job.jobId] = (workerId, now + self.__LEASE_SECONDS)
+        return job.copy(deep=True)
+
+    async def renew(self, jobId: str, workerId: str) -> bool:
+        lease = self.__LEASES.get(jobId)
+        if lease is None or lease[0] != workerId:
+            return False
+        self.__LEASES[jobId] = (workerId, time.time() + self.__LEASE_SECONDS)
+        return True
+
+    async def complete(self, jobId: str, workerId: str) -> None:
+        lease = self.__LEASES.get(jobId)
+        if lease is None or lease[0] != workerId:
+            return
+        del self.__LEASES[jobId]
+        del self.__JOBS[jobId]
+        del self.__ENQUEUED_AT[jobId]
+
+    async def fail(self, jobId: str, workerId: str, error: str) -> None:
+        lease = self.__LEASES.get(jobId)
+        if lease is None or lease[0] != workerId:
+            return
+        del self.__LEASES[jobId]
+        if self.__JOBS[jobId].attempts >= self.__MAX_ATTEMPTS:
+            logging.error("Transcription job `%s` failed for good: %s", jobId, error)
+            del self.__JOBS[jobId]
+            del self.__ENQUEUED_AT[jobId]
+
+    async def get_depth(self) -> int:
+        self.__expire_leases(time.time())
+        return len(self.__JOBS) - len(self.__LEASES)
+
+
+class SQLiteTranscriptionQueue(TranscriptionQueueBackend):
+    def __init__(
+        self,
+        path: Path,
+        leaseSeconds: float = 60,
+        maxAttempts: int = 3,
+        agingFactor: float = 10,
+    ) -> None:
+        self.__PATH = path
+        self.__LEASE_SECONDS = leaseSeconds
+        self.__MAX_ATTEMPTS = maxAttempts
+        self.__AGING_FACTOR = agingFactor
+        with self.__connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    jobId TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    estimatedCost REAL NOT NULL,
+                    enqueuedAt REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    leasedBy TEXT,
+                    leaseExpiresAt REAL,
+                    lastError TEXT
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobsStatus ON jobs (status, leaseExpiresAt)"
+            )
+
+    def __connect(self) -> closing[sqlite3.Connection]:
+        return closing(sqlite3.connect(self.__PATH, timeout=30, isolation_level=None))
+
+    def __enqueue(self, job: TranscriptionQueueJobModel) -> None:
+        with self.__connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (jobId, payload, status, estimatedCost, enqueuedAt) VALUES (?, ?, 'queued', ?, ?)",
+                (job.jobId, job.json(), job.estimatedCost, time.time()),
+            )
+
+    def __lease(self, workerId: str) -> Optional[TranscriptionQueueJobModel]:
+        now = time.time()
+        with self.__connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', lastError = 'lease expired' WHERE status = 'leased' AND leaseExpiresAt < ? AND attempts >= ?",
+                    (now, self.__MAX_ATTEMPTS),
+                )
+                row = connection.execute(
+                    "SELECT jobId, payload, attempts FROM jobs WHERE status = 'queued' OR (status = 'leased' AND leaseExpiresAt < ?) ORDER BY estimatedCost - ? * (? - enqueuedAt) LIMIT 1",
+                    (now, self.__AGING_FACTOR, now),
+                ).fetchone()
+                if row is None:
+                    connection.execute("COMMIT")
+                    return None
+                connection.execute(
+                    "UPDATE jobs SET status = 'leased', leasedBy = ?, leaseExpiresAt = ?, attempts = attempts + 1 WHERE jobId = ?",
+                    (workerId, now + self.__LEASE_SECONDS, row[0]),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        job = TranscriptionQueueJobModel.parse_raw(row[1])
+        job.attempts = row[2] + 1
+        return job
+
+    def __renew(self, jobId: str, workerId: str) -> bool:
+        with self.__connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET leaseExpiresAt = ? WHERE jobId = ? AND leasedBy = ? AND status = 'leased'",
+                (time.time() + self.__LEASE_SECONDS, jobId, workerId),
+            )
+            return cursor.rowcount == 1
+
+    def __complete(self, jobId: str, workerId: str) -> None:
+        with self.__connect() as connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE jobId = ? AND leasedBy = ? AND status = 'leased'",
+                (jobId, workerId),
+            )
+
+    def __fail(self, jobId: str, workerId: str, error: str) -> None:
+        with self.__connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, leasedBy = NULL, leaseExpiresAt = NULL, lastError = ? WHERE jobId = ? AND leasedBy = ? AND status = 'leased'",
+                (self.__MAX_ATTEMPTS, error, jobId, workerId),
+            )
+
+    def __get_depth(self) -> int:
+        with self.__connect() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' OR (status = 'leased' AND leaseExpiresAt < ?)",
+                (time.time(),),
+            ).fetchone()[0]
+
+    async def enqueue(self, job: TranscriptionQueueJobModel) -> None:
+        await asyncio.to_thread(self.__enqueue, job)
+
+    async def lease(self, workerId: str) -> Optional[TranscriptionQueueJobModel]:
+        return await asyncio.to_thread(self.__lease, workerId)
+
+    async def renew(self, jobId: str, workerId: str) -> bool:
+        return await asyncio.to_thread(self.__renew, jobId, workerId)
+
+    async def complete(self, jobId: str, workerId: str) -> None:
+        await asyncio.to_thread(self.__complete, jobId, workerId)
+
+    async def fail(self, jobId: str, workerId: str, error: str) -> None:
+        await asyncio.to_thread(self.__fail, jobId, workerId, error)
+
+    async def get_depth(self) -> int:
+        return await asyncio.to_thread(self.__get_depth)
+
+
+def create_transcription_queue(config: Config) -> TranscriptionQueueBackend:
+    backend = config.get_transcription_queue_backend()
+    if backend == "sqlite":
+        return SQLiteTranscriptionQueue(
+            path=config.get_transcription_queue_sqlite_path(),
+            leaseSeconds=config.get_transcription_queue_lease_seconds(),
+            maxAttempts=config.get_transcription_queue_max_attempts(),
+            agingFactor=config.get_scheduler_aging_factor(),
+        )
+    elif backend == "memory":
+        return InProcessTranscriptionQueue(
+            leaseSeconds=config.get_transcription_queue_lease_seconds(),
+            maxAttempts=config.get_transcription_queue_max_attempts(),
+            agingFactor=config.get_scheduler_aging_factor(),
+        )
+    else:
+        raise Exception(f"Unsupported transcription queue backend: {backend}")
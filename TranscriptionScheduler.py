@@ -0,0 +1,169 @@
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from config import AvailableLanguages
+import asyncio
+import time
+import logging
+
+
+class TranscriptionJob:
+    __slots__ = ("telegramUserId", "language", "run", "estimatedCost", "enqueuedAt")
+
+    def __init__(
+        self,
+        telegramUserId: int,
+        language: AvailableLanguages,
+        run: Callable[[], Awaitable[None]],
+        estimatedCost: float = 0,
+    ) -> None:
+        self.telegramUserId = telegramUserId
+        self.language = language
+        self.run = run
+        self.estimatedCost = estimatedCost
+        self.enqueuedAt = time.monotonic()
+
+
+class TranscriptionScheduler:
+    def __init__(
+        self,
+        maxConcurrentJobs: int = 16,
+        maxConcurrentJobsPerLanguage: int = 8,
+        maxConcurrentJobsPerUser: int = 1,
+        agingFactor: float = 10,
+    ) -> None:
+        self.__MAX_CONCURRENT_JOBS = maxConcurrentJobs
+        self.__MAX_CONCURRENT_JOBS_PER_LANGUAGE = maxConcurrentJobsPerLanguage
+        self.__MAX_CONCURRENT_JOBS_PER_USER = maxConcurrentJobsPerUser
+        self.__AGING_FACTOR = agingFactor
+        self.__QUEUES: dict[int, list[TranscriptionJob]] = {}
+        self.__ROTATION: deque[int] = deque()
+        self.__RUNNING_PER_USER: dict[int, int] = {}
+        self.__RUNNING_PER_LANGUAGE: dict[AvailableLanguages, int] = {
+            language: 0 for language in AvailableLanguages
+        }
+        self.__RUNNING_TASKS: set[asyncio.Task] = set()
+
+    def get_queue_depth(self) -> int:
+        return sum(len(queue) for queue in self.__QUEUES.values())
+
+    def get_running_count(self) -> int:
+        return len(self.__RUNNING_TASKS)
+
+    def get_running_count_per_language(self) -> dict[AvailableLanguages, int]:
+        return dict(self.__RUNNING_PER_LANGUAGE)
+
+    def __can_run(self, telegramUserId: int, language: AvailableLanguages) -> bool:
+        return (
+            len(self.__RUNNING_TASKS) < self.__MAX_CONCURRENT_JOBS
+            and self.__RUNNING_PER_LANGUAGE[language]
+            < self.__MAX_CONCURRENT_JOBS_PER_LANGUAGE
+            and self.__RUNNING_PER_USER.get(telegramUserId, 0)
+            < self.__MAX_CONCURRENT_JOBS_PER_USER
+        )
+
+    def __get_priority(self, job: TranscriptionJob, now: float) -> float:
+        # Shortest job first within a user's own queue, with waiting time
+        # slowly earning long jobs their turn so they are never starved by a
+        # stream of short ones. Users themselves take turns regardless.
+        return job.estimatedCost - self.__AGING_FACTOR * (now - job.enqueuedAt)
+
+    def estimate_position(
+        self,
+        telegramUserId: int,
+        language: AvailableLanguages,
+        estimatedCost: float = 0,
+    ) -> int:
+        if telegramUserId not in self.__QUEUES and self.__can_run(
+            telegramUserId, language
+        ):
+            return 0
+        now = time.monotonic()
+        ownJobsAhead = sum(
+            1
+            for job in self.__QUEUES.get(telegramUserId, [])
+            if self.__get_priority(job, now) <= estimatedCost
+        )
+        # Every other user gets a turn before each of the user's own jobs.
+        return (
+            ownJobsAhead
+            + sum(
+                min(len(queue), ownJobsAhead + 1)
+                for queuedUserId, queue in self.__QUEUES.items()
+                if queuedUserId != telegramUserId
+            )
+            + 1
+        )
+
+    def submit(self, job: TranscriptionJob) -> None:
+        if job.telegramUserId not in self.__QUEUES:
+            self.__QUEUES[job.telegramUserId] = []
+            self.__ROTATION.append(job.telegramUserId)
+        self.__QUEUES[job.telegramUserId].append(job)
+        self.__dispatch()
+
+    def __pop_next_runnable(self) -> Optional[TranscriptionJob]:
+        now = time.monotonic()
+        bestJob: Optional[TranscriptionJob] = None
+        bestPriority = 0.0
+        # The first user in rotation with a runnable job goes next, and runs
+        # the best job of their own queue.
+        for telegramUserId in self.__ROTATION:
+            for job in self.__QUEUES[telegramUserId]:
+                if not self.__can_run(telegramUserId, job.language):
+                    continue
+                priority = self.__get_priority(job, now)
+                if bestJob is None or priority < bestPriority:
+                    bestJob, bestPriority = job, priority
+            if bestJob is not None:
+                break
+        if bestJob is None:
+            return None
+        queue = self.__QUEUES[bestJob.telegramUserId]
+        queue.remove(bestJob)
+        self.__ROTATION.remove(bestJob.telegramUserId)
+        if queue:
+            self.__ROTATION.append(bestJob.telegramUserId)
+        else:
+            del self.__QUEUES[bestJob.telegramUserId]
+        return bestJob
+
+    def __dispatch(self) -> None:
+        while len(self.__RUNNING_TASKS) < self.__MAX_CONCURRENT_JOBS:
+            job = self.__pop_next_runnable()
+            if job is None:
+                return
+            self.__RUNNING_PER_USER[job.telegramUserId] = (
+                self.__RUNNING_PER_USER.get(job.telegramUserId, 0) + 1
+            )
+            self.__RUNNING_PER_LANGUAGE[job.language] += 1
+            task = asyncio.create_task(self.__run(job))
+            self.__RUNNING_TASKS.add(task)
+            task.add_done_callback(self.__RUNNING_TASKS.discard)
+
+    async def __run(self, job: TranscriptionJob) -> None:
+        logging.debug(
+            "Starting transcription job for user #%s after %s seconds in queue",
+            job.telegramUserId,
+            time.monotonic() - job.enqueuedAt,
+        )
+        try:
+            await job.run()
+        except Exception as e:
+            logging.error(
+                "Transcription job for user #%s failed: %s", job.telegramUserId, e
+            )
+        finally:
+            self.__RUNNING_PER_LANGUAGE[job.language] -= 1
+            self.__RUNNING_PER_USER[job.telegramUserId] -= 1
+            if self.__RUNNING_PER_USER[job.telegramUserId] == 0:
+                del self.__RUNNING_PER_USER[job.telegramUserId]
+            self.__RUNNING_TASKS.discard(asyncio.current_task())  # type: ignore
+            self.__dispatch()
+
+    async def close(self) -> None:
+        self.__QUEUES.clear()
+        self.__ROTATION.clear()
+        runningTasks = list(self.__RUNNING_TASKS)
+        for task in runningTasks:
+            task.cancel()
+        await asyncio.gather(*runningTasks, return_exceptions=True)
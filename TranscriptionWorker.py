@@ -0,0 +1,185 @@
+from typing import Optional
+from pyrogram import Client as BotClient  # type: ignore
+from pyrogram.types import Message as PyrogramMessage
+from config import Config
+from models import TranscriptionQueueJobModel
+from SpeechToTextPipeline import STTPipeline, MESSAGE_TYPES_FILTRED
+from TranscriptionQueue import TranscriptionQueueBackend
+from UserCache import UserCache
+from StatisticsAggregator import StatisticsAggregator
+from Metrics import JOBS_IN_FLIGHT, track_stage
+from Tracing import MESSAGE_PROFILER, TRACE_EXPORTER, activate_trace
+import asyncio
+import logging
+
+
+async def run_voice_pipeline(
+    STTP: STTPipeline,
+    message: PyrogramMessage,
+    userCache: UserCache,
+    statistics: StatisticsAggregator,
+    isFinalAttempt: bool = True,
+) -> None:
+    JOBS_IN_FLIGHT.inc(language=STTP.initialLanguage.value)
+    recordStatistics = True
+    try:
+        with activate_trace(STTP.trace), track_stage(
+            "job", STTP.messageType.value
+        ) as stage:
+            async with MESSAGE_PROFILER.profile(STTP.trace):
+                if await STTP.run() != 0:
+                    stage.outcome = "error"
+                    return
+                STTP.analytics(await userCache.get(message.from_user.id))
+                userCache.update_name(message.from_user.id, STTP.get_user())
+    except BaseException:
+        # A job that is going to be retried is counted by the attempt that
+        # settles it, not by every attempt.
+        recordStatistics = isFinalAttempt
+        raise
+    finally:
+        JOBS_IN_FLIGHT.dec(language=STTP.initialLanguage.value)
+        if recordStatistics:
+            statistics.record(message.from_user.id, STTP.get_statistics_delta())
+        STTP.trace.finish()
+        await TRACE_EXPORTER.export(STTP.trace)
+
+
+class TranscriptionWorker:
+    def __init__(
+        self,
+        client: BotClient,
+        queue: TranscriptionQueueBackend,
+        config: Config,
+        userCache: UserCache,
+        statistics: StatisticsAggregator,
+        workerId: str,
+        concurrency: int = 4,
+        leaseSeconds: float = 60,
+        pollIntervalSeconds: float = 1,
+    ) -> None:
+        self.__CLIENT = client
+        self.__QUEUE = queue
+        self.__CONFIG = config
+        self.__USER_CACHE = userCache
+        self.__STATISTICS = statistics
+        self.__WORKER_ID = workerId
+        self.__CONCURRENCY = concurrency
+        self.__LEASE_SECONDS = leaseSeconds
+        self.__POLL_INTERVAL_SECONDS = pollIntervalSeconds
+        self.__TASKS: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self.__TASKS:
+            return
+        self.__TASKS = [
+            asyncio.create_task(self.__worker_loop()) for _ in range(self.__CONCURRENCY)
+        ]
+        logging.info(
+            "Started transcription worker `%s` with %d slots",
+            self.__WORKER_ID,
+            self.__CONCURRENCY,
+        )
+
+    async def __worker_loop(self) -> None:
+        while True:
+            try:
+                job = await self.__QUEUE.lease(self.__WORKER_ID)
+            except Exception as e:
+                logging.error("Could not lease a transcription job: %s", e)
+                job = None
+            if job is None:
+                await asyncio.sleep(self.__POLL_INTERVAL_SECONDS)
+                continue
+            try:
+                await self.__process(job)
+            except Exception as e:
+                logging.error(
+                    "Could not settle transcription job `%s`: %s", job.jobId, e
+                )
+
+    async def __heartbeat(
+        self, job: TranscriptionQueueJobModel, processing: asyncio.Task
+    ) -> None:
+        while True:
+            await asyncio.sleep(self.__LEASE_SECONDS / 3)
+            if not await self.__QUEUE.renew(job.jobId, self.__WORKER_ID):
+                # Another worker may already be running the job again, so
+                # this attempt must neither reply nor settle it.
+                logging.warning(
+                    "Lost the lease of transcription job `%s`, cancelling it",
+                    job.jobId,
+                )
+                processing.cancel()
+                return
+
+    async def __get_message(
+        self, chatId: int, messageId: Optional[int]
+    ) -> Optional[PyrogramMessage]:
+        if messageId is None:
+            return None
+        message = await self.__CLIENT.get_messages(chatId, messageId)
+        if message is None or message.empty:
+            return None
+        return message  # type: ignore
+
+    async def __process(self, job: TranscriptionQueueJobModel) -> None:
+        logging.info(
+            "Worker `%s` leased transcription job `%s` (attempt %d)",
+            self.__WORKER_ID,
+            job.jobId,
+            job.attempts,
+        )
+        processing = asyncio.create_task(self.__run_job(job))
+        heartbeat = asyncio.create_task(self.__heartbeat(job, processing))
+        try:
+            await processing
+        except asyncio.CancelledError:
+            if not heartbeat.done() or heartbeat.cancelled():
+                raise
+            logging.info(
+                "Worker `%s` abandoned transcription job `%s`",
+                self.__WORKER_ID,
+                job.jobId,
+            )
+        finally:
+            heartbeat.cancel()
+
+    async def __run_job(self, job: TranscriptionQueueJobModel) -> None:
+        try:
+            message = await self.__get_message(job.chatId, job.messageId)
+            if message is None:
+                logging.warning(
+                    "Message of transcription job `%s` no longer exists", job.jobId
+                )
+                await self.__QUEUE.complete(job.jobId, self.__WORKER_ID)
+                return
+            user = await self.__USER_CACHE.get(job.telegramUserId)
+            STTP = STTPipeline(
+                messageType=MESSAGE_TYPES_FILTRED(job.messageType),
+                message=message,
+                user=user.copy(update={"prefs": job.prefs}),
+                config=self.__CONFIG,
+                client=self.__CLIENT,
+            )
+            statusMessage = await self.__get_message(job.chatId, job.statusMessageId)
+            if statusMessage is not None:
+                STTP.set_status_message(statusMessage)
+            await run_voice_pipeline(
+                STTP,
+                message,
+                self.__USER_CACHE,
+                self.__STATISTICS,
+                isFinalAttempt=job.attempts
+                >= self.__CONFIG.get_transcription_queue_max_attempts(),
+            )
+            await self.__QUEUE.complete(job.jobId, self.__WORKER_ID)
+        except Exception as e:
+            logging.error("Transcription job `%s` failed: %s", job.jobId, e)
+            await self.__QUEUE.fail(job.jobId, self.__WORKER_ID, str(e))
+
+    async def close(self) -> None:
+        for task in self.__TASKS:
+            task.cancel()
+        await asyncio.gather(*self.__TASKS, return_exceptions=True)
+        self.__TASKS = []
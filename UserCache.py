@@ -0,0 +1,268 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+from appwrite.services.users import Users as AppWriteUsers
+from appwrite.exception import AppwriteException
+from models import UserModel, UserPreferencesModel, UserStatisticsModel
+from Metrics import track_stage
+import asyncio
+import contextvars
+import time
+import logging
+
+
+class UserCacheEntry:
+    __slots__ = ("user", "loadedAt", "dirtyPrefs", "dirtyName")
+
+    def __init__(self, user: UserModel) -> None:
+        self.user = user
+        self.loadedAt = time.monotonic()
+        self.dirtyPrefs = False
+        self.dirtyName = False
+
+    def is_dirty(self) -> bool:
+        return self.dirtyPrefs or self.dirtyName
+
+
+class UserCache:
+    def __init__(
+        self,
+        appwriteUsers: AppWriteUsers,
+        maxEntries: int = 10000,
+        ttlSeconds: float = 300,
+        flushDelaySeconds: float = 2,
+    ) -> None:
+        self.__APPWRITEUSERS = appwriteUsers
+        self.__MAX_ENTRIES = maxEntries
+        self.__TTL_SECONDS = ttlSeconds
+        self.__FLUSH_DELAY_SECONDS = flushDelaySeconds
+        self.__ENTRIES: OrderedDict[int, UserCacheEntry] = OrderedDict()
+        self.__LOADING: dict[int, asyncio.Future] = {}
+        self.__FLUSH_TASKS: dict[int, asyncio.Task] = {}
+        self.__WRITE_LOCKS: dict[int, tuple[asyncio.Lock, int]] = {}
+
+    @staticmethod
+    def get_internal_id(telegramUserId: int) -> str:
+        return f"tlgrm-vocalballsbot-{telegramUserId}"
+
+    def __load_user(self, telegramUserId: int) -> UserModel:
+        INTERNAL_ID = self.get_internal_id(telegramUserId)
+        try:
+            with track_stage("appwrite", "get") as stage:
+                try:
+                    USER: UserModel = UserModel(
+                        **self.__APPWRITEUSERS.get(user_id=INTERNAL_ID)  # type: ignore
+                    )
+                except AppwriteException as e:
+                    # A user writing for the first time is not a failure.
+                    if e.code == 404:
+                        stage.outcome = "not_found"
+                    raise
+        except AppwriteException:
+            with track_stage("appwrite", "create"):
+                USER: UserModel = UserModel(
+                    **self.__APPWRITEUSERS.create(user_id=INTERNAL_ID)  # type: ignore
+                )
+            with track_stage("appwrite", "update_prefs"):
+                self.__APPWRITEUSERS.update_prefs(
+                    user_id=INTERNAL_ID,
+                    prefs=USER.prefs.dict(),
+                )
+        return USER
+
+    def __load_stored_prefs(self, telegramUserId: int) -> UserPreferencesModel:
+        with track_stage("appwrite", "get"):
+            return UserModel(
+                **self.__APPWRITEUSERS.get(  # type: ignore
+                    user_id=self.get_internal_id(telegramUserId)
+                )
+            ).prefs
+
+    @asynccontextmanager
+    async def __lock_writes(self, telegramUserId: int) -> AsyncIterator[None]:
+        lock, holders = self.__WRITE_LOCKS.get(telegramUserId, (asyncio.Lock(), 0))
+        self.__WRITE_LOCKS[telegramUserId] = (lock, holders + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, holders = self.__WRITE_LOCKS[telegramUserId]
+            if holders == 1:
+                del self.__WRITE_LOCKS[telegramUserId]
+            else:
+                self.__WRITE_LOCKS[telegramUserId] = (lock, holders - 1)
+
+    async def __write_prefs(
+        self,
+        telegramUserId: int,
+        update: Callable[[UserPreferencesModel], UserPreferencesModel],
+    ) -> UserPreferencesModel:
+        # Appwrite only replaces the whole prefs document, so every write
+        # starts from what is stored: settings and counters written by other
+        # processes, or by the other writer here, are never rolled back.
+        async with self.__lock_writes(telegramUserId):
+            storedPrefs = await asyncio.to_thread(
+                self.__load_stored_prefs, telegramUserId
+            )
+            prefs = update(storedPrefs)
+            with track_stage("appwrite", "update_prefs"):
+                await asyncio.to_thread(
+                    self.__APPWRITEUSERS.update_prefs,
+                    user_id=self.get_internal_id(telegramUserId),
+                    prefs=prefs.dict(),
+                )
+        return prefs
+
+    async def add_statistics(
+        self, telegramUserId: int, delta: UserStatisticsModel
+    ) -> None:
+        def merge(storedPrefs: UserPreferencesModel) -> UserPreferencesModel:
+            storedPrefs.statistics.add(delta)
+            return storedPrefs
+
+        prefs = await self.__write_prefs(telegramUserId, merge)
+        entry = self.__ENTRIES.get(telegramUserId)
+        if entry is not None:
+            entry.user.prefs.statistics = prefs.statistics.copy(deep=True)
+
+    def __get_fresh_entry(self, telegramUserId: int) -> Optional[UserCacheEntry]:
+        entry = self.__ENTRIES.get(telegramUserId)
+        if entry is None:
+            return None
+        if (
+            not entry.is_dirty()
+            and time.monotonic() - entry.loadedAt > self.__TTL_SECONDS
+        ):
+            del self.__ENTRIES[telegramUserId]
+            return None
+        self.__ENTRIES.move_to_end(telegramUserId)
+        return entry
+
+    def __store(self, telegramUserId: int, entry: UserCacheEntry) -> None:
+        self.__ENTRIES[telegramUserId] = entry
+        self.__ENTRIES.move_to_end(telegramUserId)
+        if len(self.__ENTRIES) <= self.__MAX_ENTRIES:
+            return
+        for cachedUserId in list(self.__ENTRIES.keys()):
+            if len(self.__ENTRIES) <= self.__MAX_ENTRIES:
+                break
+            if not self.__ENTRIES[cachedUserId].is_dirty():
+                del self.__ENTRIES[cachedUserId]
+
+    async def get(self, telegramUserId: int) -> UserModel:
+        entry = self.__get_fresh_entry(telegramUserId)
+        if entry is not None:
+            return entry.user
+        loading = self.__LOADING.get(telegramUserId)
+        if loading is not None:
+            return await asyncio.shield(loading)
+        loading = asyncio.get_running_loop().create_future()
+        self.__LOADING[telegramUserId] = loading
+        try:
+            user = await asyncio.to_thread(self.__load_user, telegramUserId)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                loading.cancel()
+            else:
+                loading.set_exception(e)
+                loading.exception()
+            raise
+        finally:
+            del self.__LOADING[telegramUserId]
+        self.__store(telegramUserId, UserCacheEntry(user))
+        loading.set_result(user)
+        return user
+
+    def __get_or_create_entry(
+        self, telegramUserId: int, user: UserModel
+    ) -> UserCacheEntry:
+        entry = self.__ENTRIES.get(telegramUserId)
+        if entry is None:
+            entry = UserCacheEntry(user)
+        entry.user = user
+        self.__store(telegramUserId, entry)
+        return entry
+
+    def update_prefs(self, telegramUserId: int, user: UserModel) -> None:
+        self.__get_or_create_entry(telegramUserId, user).dirtyPrefs = True
+        self.__schedule_flush(telegramUserId)
+
+    def update_name(self, telegramUserId: int, user: UserModel) -> None:
+        self.__get_or_create_entry(telegramUserId, user).dirtyName = True
+        self.__schedule_flush(telegramUserId)
+
+    def __schedule_flush(self, telegramUserId: int) -> None:
+        if telegramUserId in self.__FLUSH_TASKS:
+            return
+        # The flush runs after the message is done and may cover later
+        # messages too, so it starts without the caller's trace.
+        self.__FLUSH_TASKS[telegramUserId] = asyncio.create_task(
+            self.__delayed_flush(telegramUserId), context=contextvars.Context()
+        )
+
+    async def __delayed_flush(self, telegramUserId: int) -> None:
+        try:
+            await asyncio.sleep(self.__FLUSH_DELAY_SECONDS)
+        finally:
+            if self.__FLUSH_TASKS.get(telegramUserId) is asyncio.current_task():
+                del self.__FLUSH_TASKS[telegramUserId]
+        await self.__flush_user(telegramUserId)
+
+    async def __flush_user(self, telegramUserId: int) -> None:
+        entry = self.__ENTRIES.get(telegramUserId)
+        if entry is None or not entry.is_dirty():
+            return
+        flushPrefs, flushName = entry.dirtyPrefs, entry.dirtyName
+        prefs, name = entry.user.prefs.copy(deep=True), entry.user.name
+        entry.dirtyPrefs = entry.dirtyName = False
+
+        def keep_stored_statistics(
+            storedPrefs: UserPreferencesModel,
+        ) -> UserPreferencesModel:
+            # Counters are only ever written by `add_statistics`.
+            prefs.statistics = storedPrefs.statistics
+            return prefs
+
+        try:
+            if flushPrefs:
+                storedPrefs = await self.__write_prefs(
+                    telegramUserId, keep_stored_statistics
+                )
+                entry.user.prefs.statistics = storedPrefs.statistics.copy(deep=True)
+            if flushName and name is not None:
+                with track_stage("appwrite", "update_name"):
+                    await asyncio.to_thread(
+                        self.__APPWRITEUSERS.update_name,
+                        user_id=self.get_internal_id(telegramUserId),
+                        name=name,
+                    )
+        except Exception as e:
+            logging.error(
+                "Error while flushing cached user #%s to Appwrite: %s",
+                telegramUserId,
+                e,
+            )
+            entry.dirtyPrefs = entry.dirtyPrefs or flushPrefs
+            entry.dirtyName = entry.dirtyName or flushName
+            self.__schedule_flush(telegramUserId)
+
+    def get_dirty_count(self) -> int:
+        return sum(1 for entry in self.__ENTRIES.values() if entry.is_dirty())
+
+    async def flush(self) -> None:
+        for flushTask in list(self.__FLUSH_TASKS.values()):
+            flushTask.cancel()
+        self.__FLUSH_TASKS.clear()
+        await asyncio.gather(
+            *[
+                self.__flush_user(telegramUserId)
+                for telegramUserId, entry in list(self.__ENTRIES.items())
+                if entry.is_dirty()
+            ]
+        )
+
+    async def close(self) -> None:
+        await self.flush()
+        for flushTask in list(self.__FLUSH_TASKS.values()):
+            flushTask.cancel()
+        self.__FLUSH_TASKS.clear()
@@ -1,26 +1,112 @@
+from contextlib import AsyncExitStack, asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional
 import websockets
-from config import AvailableLanguages, Config
-from models import SpeechRecognitionVoskPartialResult
+from config import AvailableLanguages, ChunkSizePolicy, Config
+from models import SpeechRecognitionVoskPartialResult, VoskStreamStatistics
+from VoskConnectionPool import VoskConnectionPool
+from ChunkSizeController import ChunkSizeController
+from Metrics import (
+    AUDIO_SECONDS_DECODED,
+    VOSK_CHUNK_BYTES,
+    VOSK_REALTIME_FACTOR,
+    VOSK_ROUND_TRIP_SECONDS,
+    track_stage,
+)
+from Tracing import mark_current_trace, mark_current_trace_once
+from PCMAudio import (
+    PCM_SAMPLE_RATE,
+    PCM_BYTES_PER_SECOND,
+    PCMSegment,
+    PCMSegmenter,
+    VoiceActivityFilter,
+)
 import asyncio
 import json
 import time
 import logging
 
 
+class VoskResult:
+    # Long audio yields thousands of these, so they are kept as plain records;
+    # the validated pydantic model is only built where results leave the bot.
+    __slots__ = ("text", "startTime", "endTime", "overallConfidence")
+
+    def __init__(
+        self, text: str, startTime: float, endTime: float, overallConfidence: float
+    ) -> None:
+        self.text = text
+        self.startTime = startTime
+        self.endTime = endTime
+        self.overallConfidence = overallConfidence
+
+    def copy(self) -> "VoskResult":
+        return VoskResult(
+            self.text, self.startTime, self.endTime, self.overallConfidence
+        )
+
+    def to_model(self) -> SpeechRecognitionVoskPartialResult:
+        return SpeechRecognitionVoskPartialResult(
+            text=self.text,
+            startTime=self.startTime,
+            endTime=self.endTime,
+            overallConfidence=self.overallConfidence,
+        )
+
+    @staticmethod
+    def from_model(model: SpeechRecognitionVoskPartialResult) -> "VoskResult":
+        return VoskResult(
+            model.text, model.startTime, model.endTime, model.overallConfidence
+        )
+
+
 class VoskAPI:
-    def __init__(self, apiKey: str, language: AvailableLanguages) -> None:
+    def __init__(
+        self,
+        apiKey: str,
+        language: AvailableLanguages,
+        connectionPool: Optional[VoskConnectionPool] = None,
+        voiceActivityThreshold: Optional[float] = None,
+        keepSilenceSeconds: float = 0.3,
+        chunkSizePolicy: ChunkSizePolicy = ChunkSizePolicy.FIXED,
+        targetPartialsPerSecond: float = 2,
+    ) -> None:
         self.__ENDPOINT = Config.get_vosk_endpoint(language)
         self.__APIKEY = apiKey
         self.__LANGUAGE = language
-        self.__RESULTS: list[SpeechRecognitionVoskPartialResult] = []
+        self.__CONNECTION_POOL = connectionPool
+        self.__VOICE_ACTIVITY_THRESHOLD = voiceActivityThreshold
+        self.__KEEP_SILENCE_SECONDS = keepSilenceSeconds
+        self.__CHUNK_SIZE_POLICY = chunkSizePolicy
+        self.__TARGET_PARTIALS_PER_SECOND = targetPartialsPerSecond
+        self.__CHUNK_SIZE_CONTROLLERS: list[ChunkSizeController] = []
+        self.__RESULTS: list[VoskResult] = []
         self.__FINISHED_STATUS: bool = False
+        self.__SUBSCRIBERS: list[asyncio.Queue] = []
+        self.__BYTES_DECODED: int = 0
+        self.__BYTES_SENT: int = 0
+        self.__CHUNKS_SENT: int = 0
+        self.__STARTED_AT: Optional[float] = None
+        self.__FINISHED_AT: Optional[float] = None
         logging.debug("Initialized VoskAPI with endpoint `%s`", self.__ENDPOINT)
 
     def __get_headers(self) -> list:
         return [["X-API-Key", self.__APIKEY]]
 
+    def __open_connection(self):
+        if self.__CONNECTION_POOL is not None:
+            return self.__CONNECTION_POOL.connection()
+        return websockets.connect(  # type: ignore
+            self.__ENDPOINT, extra_headers=self.__get_headers()
+        )
+
+    @asynccontextmanager
+    async def __connect(self) -> AsyncIterator:
+        async with AsyncExitStack() as stack:
+            with track_stage("vosk", "connect"):
+                websocket = await stack.enter_async_context(self.__open_connection())
+            yield websocket
+
     @staticmethod
     def __get_vosk_server_config_message(
         maxAlternatives: int = 20,
@@ -50,16 +136,16 @@ class VoskAPI:
         return data
 
     @staticmethod
-    def __get_ffmpeg_arguments(audioFile: Path) -> list:
+    def __get_ffmpeg_arguments(audioInput: str) -> list:
         return [
             "ffmpeg",
             "-nostdin",
             "-loglevel",
             "quiet",
             "-i",
-            audioFile.__str__(),
+            audioInput,
             "-ar",
-            "16000",
+            str(PCM_SAMPLE_RATE),
             "-ac",
             "1",
             "-f",
@@ -68,21 +154,16 @@ class VoskAPI:
         ]
 
     @staticmethod
-    def __parse_response(response: str) -> Optional[SpeechRecognitionVoskPartialResult]:
+    def __parse_response(response: str) -> Optional[VoskResult]:
         try:
             data = json.loads(response)
             if "result" in data:
-                confidence = sum(word["conf"] for word in data["result"]) / len(
-                    data["result"]
-                )
-                startTime = data["result"][0]["start"]
-                endTime = data["result"][-1]["end"]
-                text = data["text"]
-                return SpeechRecognitionVoskPartialResult(
-                    overallConfidence=confidence,
-                    startTime=startTime,
-                    endTime=endTime,
-                    text=text,
+                words = data["result"]
+                return VoskResult(
+                    data["text"],
+                    float(words[0]["start"]),
+                    float(words[-1]["end"]),
+                    sum(word["conf"] for word in words) / len(words),
                 )
             return None
         except json.JSONDecodeError:
@@ -91,17 +172,36 @@ class VoskAPI:
             return None
 
     def __add_result(
-        self, result: Optional[SpeechRecognitionVoskPartialResult]
+        self, result: Optional[VoskResult]
     ) -> None:
         if result is not None:
+            mark_current_trace_once("first_result", "vosk")
             self.__RESULTS.append(result)
+            for subscriber in self.__SUBSCRIBERS:
+                subscriber.put_nowait(result)
 
-    def get_results(self) -> list[SpeechRecognitionVoskPartialResult]:
+    def add_response(self, response: str) -> Optional[VoskResult]:
+        # Feeds a raw vosk-server message through the same parsing and
+        # publishing the receive loop uses, without a websocket.
+        result = self.__parse_response(response)
+        self.__add_result(result)
+        return result
+
+    def subscribe(self) -> asyncio.Queue:
+        subscriber: asyncio.Queue = asyncio.Queue()
+        for result in self.__RESULTS:
+            subscriber.put_nowait(result)
+        if self.__FINISHED_STATUS:
+            subscriber.put_nowait(None)
+        self.__SUBSCRIBERS.append(subscriber)
+        return subscriber
+
+    def get_results(self) -> list[VoskResult]:
         return self.__RESULTS
 
     def get_result(
         self, index: int = -1
-    ) -> Optional[SpeechRecognitionVoskPartialResult]:
+    ) -> Optional[VoskResult]:
         try:
             return self.__RESULTS[index]
         except IndexError:
@@ -110,68 +210,530 @@ class VoskAPI:
     def get_finished_status(self) -> bool:
         return self.__FINISHED_STATUS
 
+    def get_stream_statistics(self) -> VoskStreamStatistics:
+        if self.__STARTED_AT is None:
+            return VoskStreamStatistics()
+        wallSeconds = (self.__FINISHED_AT or time.monotonic()) - self.__STARTED_AT
+        audioSeconds = self.__BYTES_DECODED / PCM_BYTES_PER_SECOND
+        chunkBytesRanges = [
+            controller.get_chunk_bytes_range()
+            for controller in self.__CHUNK_SIZE_CONTROLLERS
+        ]
+        return VoskStreamStatistics(
+            bytesDecoded=self.__BYTES_DECODED,
+            bytesSent=self.__BYTES_SENT,
+            chunksSent=self.__CHUNKS_SENT,
+            audioSeconds=audioSeconds,
+            wallSeconds=wallSeconds,
+            decodeBytesPerSecond=(
+                self.__BYTES_DECODED / wallSeconds if wallSeconds > 0 else 0
+            ),
+            realtimeFactor=wallSeconds / audioSeconds if audioSeconds > 0 else 0,
+            chunkSizePolicy=self.__CHUNK_SIZE_POLICY,
+            chunkBytesMin=min((low for low, _ in chunkBytesRanges), default=0),
+            chunkBytesMax=max((high for _, high in chunkBytesRanges), default=0),
+            chunkBytesAverage=(
+                self.__BYTES_SENT / self.__CHUNKS_SENT if self.__CHUNKS_SENT > 0 else 0
+            ),
+            averageRoundTripSeconds=(
+                sum(
+                    controller.get_average_round_trip_seconds()
+                    for controller in self.__CHUNK_SIZE_CONTROLLERS
+                )
+                / len(self.__CHUNK_SIZE_CONTROLLERS)
+                if self.__CHUNK_SIZE_CONTROLLERS
+                else 0
+            ),
+        )
+
     def __set_finished_status(self, status: bool) -> None:
         self.__FINISHED_STATUS = status
+        if status:
+            for subscriber in self.__SUBSCRIBERS:
+                subscriber.put_nowait(None)
 
-    async def process_audio_file(
-        self, audioFile: Path, bytesToReadEveryTime: int = 8000
+    async def __send_audio_chunk(
+        self,
+        websocket,
+        data: bytes,
+        inFlightWindow: asyncio.Semaphore,
+        streamState: dict,
     ) -> None:
-        logging.debug("Processing audio file `%s`", audioFile.__str__())
-        startTime = time.time()
-        async with websockets.connect(  # type: ignore
-            self.__ENDPOINT, extra_headers=self.__get_headers()
-        ) as websocket:
-            logging.debug(
-                "Using ffmpeg to convert audio file real-time to 16kHz and send it to Vosk server"
+        self.__BYTES_SENT += len(data)
+        self.__CHUNKS_SENT += 1
+        await inFlightWindow.acquire()
+        streamState["messagesSent"] += 1
+        streamState["chunkSizeController"].on_sent(len(data))
+        VOSK_CHUNK_BYTES.observe(
+            len(data),
+            language=self.get_language().value,
+            policy=self.__CHUNK_SIZE_POLICY.value,
+        )
+        await websocket.send(self.__get_vosk_server_message(data))
+
+    async def __send_audio_chunks(
+        self,
+        websocket,
+        stream: Optional[asyncio.StreamReader],
+        inFlightWindow: asyncio.Semaphore,
+        streamState: dict,
+    ) -> None:
+        while True:
+            data = (
+                await stream.read(streamState["chunkSizeController"].get_chunk_bytes())
+                if stream
+                else None
+            )
+            if data is None:
+                logging.warning("No data read from the ffmpeg subprocess stdout stream")
+                break
+            if len(data) == 0:
+                break
+            if streamState["countDecodedBytes"]:
+                self.__BYTES_DECODED += len(data)
+            if streamState["voiceActivityFilter"] is not None:
+                data = streamState["voiceActivityFilter"].filter(data)
+                if len(data) == 0:
+                    continue
+            await self.__send_audio_chunk(websocket, data, inFlightWindow, streamState)
+        if streamState["voiceActivityFilter"] is not None:
+            data = streamState["voiceActivityFilter"].flush()
+            if len(data) > 0:
+                await self.__send_audio_chunk(
+                    websocket, data, inFlightWindow, streamState
+                )
+        await inFlightWindow.acquire()
+        streamState["messagesSent"] += 1
+        streamState["eofSent"].set()
+        await websocket.send('{"eof" : 1}')
+
+    async def __receive_responses(
+        self,
+        websocket,
+        inFlightWindow: asyncio.Semaphore,
+        streamState: dict,
+    ) -> None:
+        responsesReceived = 0
+        while not (
+            streamState["eofSent"].is_set()
+            and responsesReceived >= streamState["messagesSent"]
+        ):
+            response = await websocket.recv()
+            responsesReceived += 1
+            inFlightWindow.release()
+            streamState["chunkSizeController"].on_response()
+            result = self.__parse_response(response)
+            if result is not None and streamState["voiceActivityFilter"] is not None:
+                # Vosk only saw the audio that survived the filter, so its
+                # timestamps are mapped back onto the original audio.
+                result.startTime = streamState[
+                    "voiceActivityFilter"
+                ].to_original_seconds(result.startTime)
+                result.endTime = streamState["voiceActivityFilter"].to_original_seconds(
+                    result.endTime
+                )
+            streamState["onResult"](result)
+        mark_current_trace("eof", "vosk", responses=responsesReceived)
+
+    async def __exchange(
+        self,
+        websocket,
+        stream: Optional[asyncio.StreamReader],
+        bytesToReadEveryTime: int,
+        maxChunksInFlight: int,
+        onResult: Callable[[Optional[VoskResult]], None],
+        countDecodedBytes: bool = True,
+    ) -> None:
+        await websocket.send(json.dumps(self.__get_vosk_server_config_message()))
+        inFlightWindow = asyncio.Semaphore(maxChunksInFlight)
+        chunkSizeController = ChunkSizeController(
+            policy=self.__CHUNK_SIZE_POLICY,
+            initialChunkBytes=bytesToReadEveryTime,
+            targetPartialsPerSecond=self.__TARGET_PARTIALS_PER_SECOND,
+        )
+        self.__CHUNK_SIZE_CONTROLLERS.append(chunkSizeController)
+        streamState: dict = {
+            "chunkSizeController": chunkSizeController,
+            "messagesSent": 0,
+            "eofSent": asyncio.Event(),
+            "onResult": onResult,
+            "countDecodedBytes": countDecodedBytes,
+            "voiceActivityFilter": (
+                VoiceActivityFilter(
+                    energyThreshold=self.__VOICE_ACTIVITY_THRESHOLD,
+                    keepSilenceSeconds=self.__KEEP_SILENCE_SECONDS,
+                )
+                if self.__VOICE_ACTIVITY_THRESHOLD is not None
+                else None
+            ),
+        }
+        tasks = [
+            asyncio.create_task(
+                self.__send_audio_chunks(
+                    websocket,
+                    stream,
+                    inFlightWindow,
+                    streamState,
+                )
+            ),
+            asyncio.create_task(
+                self.__receive_responses(websocket, inFlightWindow, streamState)
+            ),
+        ]
+        try:
+            with track_stage("vosk", "stream"):
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    @staticmethod
+    async def __feed_ffmpeg(
+        stdin: Optional[asyncio.StreamWriter], inputChunks: AsyncIterator[bytes]
+    ) -> None:
+        if stdin is None:
+            return
+        try:
+            async for chunk in inputChunks:
+                stdin.write(chunk)
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.warning("ffmpeg closed its stdin before the input stream ended")
+        finally:
+            if not stdin.is_closing():
+                stdin.close()
+
+    async def __start_ffmpeg(
+        self, ffmpegInput: str, inputChunks: Optional[AsyncIterator[bytes]]
+    ) -> asyncio.subprocess.Process:
+        logging.debug(
+            "Using ffmpeg to convert audio real-time to 16kHz and send it to Vosk server"
+        )
+        return await asyncio.create_subprocess_exec(
+            *self.__get_ffmpeg_arguments(ffmpegInput),
+            stdin=(
+                asyncio.subprocess.PIPE
+                if inputChunks is not None
+                else asyncio.subprocess.DEVNULL
+            ),
+            stdout=asyncio.subprocess.PIPE,
+        )
+
+    def __log_finished(
+        self,
+        sourceDescription: str,
+        bytesToReadEveryTime: int,
+        maxChunksInFlight: int,
+        parallelSessions: int,
+    ) -> None:
+        self.__FINISHED_AT = time.monotonic()
+        streamStatistics = self.get_stream_statistics()
+        AUDIO_SECONDS_DECODED.inc(
+            streamStatistics.audioSeconds, language=self.get_language().value
+        )
+        if streamStatistics.audioSeconds > 0:
+            VOSK_REALTIME_FACTOR.observe(
+                streamStatistics.realtimeFactor, language=self.get_language().value
             )
-            proc = await asyncio.create_subprocess_exec(
-                *self.__get_ffmpeg_arguments(audioFile),
-                stdout=asyncio.subprocess.PIPE,
+        if streamStatistics.averageRoundTripSeconds > 0:
+            VOSK_ROUND_TRIP_SECONDS.observe(
+                streamStatistics.averageRoundTripSeconds,
+                language=self.get_language().value,
             )
-            await websocket.send(json.dumps(self.__get_vosk_server_config_message()))
-            while True:
-                data = (
-                    await proc.stdout.read(bytesToReadEveryTime)
-                    if proc.stdout
-                    else None
+        logging.info(
+            "Took %s seconds to process %s seconds of audio (RTF %.3f) with `%s` chunks of %d..%d bytes (initially %d), up to %d chunks in flight and %d parallel sessions for language `%s` and source `%s`",
+            streamStatistics.wallSeconds,
+            streamStatistics.audioSeconds,
+            streamStatistics.realtimeFactor,
+            streamStatistics.chunkSizePolicy.value,
+            streamStatistics.chunkBytesMin,
+            streamStatistics.chunkBytesMax,
+            bytesToReadEveryTime,
+            maxChunksInFlight,
+            parallelSessions,
+            self.get_language().value,
+            sourceDescription,
+        )
+
+    async def __process(
+        self,
+        ffmpegInput: str,
+        sourceDescription: str,
+        inputChunks: Optional[AsyncIterator[bytes]],
+        bytesToReadEveryTime: int,
+        maxChunksInFlight: int,
+    ) -> None:
+        self.__STARTED_AT = time.monotonic()
+        try:
+            async with self.__connect() as websocket:
+                proc = await self.__start_ffmpeg(ffmpegInput, inputChunks)
+                tasks = [
+                    asyncio.create_task(
+                        self.__exchange(
+                            websocket,
+                            proc.stdout,
+                            bytesToReadEveryTime,
+                            maxChunksInFlight,
+                            onResult=self.__add_result,
+                        )
+                    )
+                ]
+                if inputChunks is not None:
+                    tasks.append(
+                        asyncio.create_task(self.__feed_ffmpeg(proc.stdin, inputChunks))
+                    )
+                try:
+                    with track_stage("ffmpeg", "decode"):
+                        await asyncio.gather(*tasks)
+                        await proc.wait()
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    if proc.returncode is None:
+                        proc.kill()
+                    raise
+                self.__log_finished(
+                    sourceDescription, bytesToReadEveryTime, maxChunksInFlight, 1
+                )
+        finally:
+            if self.__FINISHED_AT is None:
+                self.__FINISHED_AT = time.monotonic()
+            self.__set_finished_status(True)
+
+    def __emit_segment_results(self, segmentState: dict) -> None:
+        # Results are published in audio order: the earliest unfinished
+        # segment streams live, later ones are held back until it is done.
+        buffered, finished = segmentState["buffered"], segmentState["finished"]
+        while segmentState["nextToEmit"] < len(buffered):
+            index = segmentState["nextToEmit"]
+            for result in buffered[index]:
+                self.__add_result(result)
+            buffered[index].clear()
+            if not finished[index]:
+                return
+            segmentState["nextToEmit"] += 1
+
+    def __add_segment_result(
+        self,
+        segment: PCMSegment,
+        segmentState: dict,
+        result: Optional[VoskResult],
+    ) -> None:
+        if result is None:
+            return
+        # Timestamps arrive segment-relative (already mapped back through the
+        # VAD filter, if any) and are clamped to the audio the segment holds.
+        offsetSeconds = segment.startOffset / PCM_BYTES_PER_SECOND
+        cutSeconds = segment.cutOffset / PCM_BYTES_PER_SECOND
+        endSeconds = (segment.startOffset + len(segment.pcm)) / PCM_BYTES_PER_SECOND
+        result.startTime = min(result.startTime + offsetSeconds, endSeconds)
+        result.endTime = min(result.endTime + offsetSeconds, endSeconds)
+        # Utterances centered in the overlap were already recognized at the
+        # end of the previous segment.
+        if (result.startTime + result.endTime) / 2 < cutSeconds:
+            return
+        # The previous segment ends at the cut, so an utterance straddling it
+        # starts there; otherwise results would overlap and go out of order.
+        result.startTime = max(result.startTime, cutSeconds)
+        segmentState["buffered"][segment.index].append(result)
+        self.__emit_segment_results(segmentState)
+
+    async def __transcribe_segment(
+        self,
+        segment: PCMSegment,
+        sessions: asyncio.Semaphore,
+        segmentState: dict,
+        bytesToReadEveryTime: int,
+        maxChunksInFlight: int,
+    ) -> None:
+        try:
+            stream = asyncio.StreamReader()
+            stream.feed_data(segment.pcm)
+            stream.feed_eof()
+            async with self.__connect() as websocket:
+                await self.__exchange(
+                    websocket,
+                    stream,
+                    bytesToReadEveryTime,
+                    maxChunksInFlight,
+                    onResult=lambda result: self.__add_segment_result(
+                        segment, segmentState, result
+                    ),
+                    countDecodedBytes=False,
                 )
-                if data is None:
-                    logging.warning(
-                        "No data read from the ffmpeg subprocess stdout stream"
+            segmentState["finished"][segment.index] = True
+            self.__emit_segment_results(segmentState)
+        finally:
+            sessions.release()
+
+    async def __read_segments(
+        self,
+        stdout: Optional[asyncio.StreamReader],
+        segmenter: PCMSegmenter,
+        sessions: asyncio.Semaphore,
+        segmentTasks: list[asyncio.Task],
+        segmentState: dict,
+        bytesToReadEveryTime: int,
+        maxChunksInFlight: int,
+    ) -> None:
+        while True:
+            data = await stdout.read(bytesToReadEveryTime) if stdout else b""
+            self.__BYTES_DECODED += len(data)
+            for segment in segmenter.feed(data) if data else segmenter.flush():
+                # Waiting for a free session before decoding further keeps
+                # at most `parallelSessions` segments of PCM in memory.
+                await sessions.acquire()
+                for segmentTask in segmentTasks:
+                    if segmentTask.done() and segmentTask.exception() is not None:
+                        sessions.release()
+                        raise segmentTask.exception()  # type: ignore
+                segmentState["buffered"].append([])
+                segmentState["finished"].append(False)
+                segmentTasks.append(
+                    asyncio.create_task(
+                        self.__transcribe_segment(
+                            segment,
+                            sessions,
+                            segmentState,
+                            bytesToReadEveryTime,
+                            maxChunksInFlight,
+                        )
                     )
-                    break
-                if len(data) == 0:
-                    break
-                await websocket.send(self.__get_vosk_server_message(data))
-                self.__add_result(self.__parse_response(await websocket.recv()))
-            await websocket.send('{"eof" : 1}')
-            self.__add_result(self.__parse_response(await websocket.recv()))
+                )
+            if not data:
+                return
+
+    async def __process_segmented(
+        self,
+        ffmpegInput: str,
+        sourceDescription: str,
+        inputChunks: Optional[AsyncIterator[bytes]],
+        bytesToReadEveryTime: int,
+        maxChunksInFlight: int,
+        parallelSessions: int,
+        segmentSeconds: float,
+    ) -> None:
+        self.__STARTED_AT = time.monotonic()
+        try:
+            proc = await self.__start_ffmpeg(ffmpegInput, inputChunks)
+            sessions = asyncio.Semaphore(parallelSessions)
+            segmentTasks: list[asyncio.Task] = []
+            segmentState: dict = {"buffered": [], "finished": [], "nextToEmit": 0}
+            tasks = [
+                asyncio.create_task(
+                    self.__read_segments(
+                        proc.stdout,
+                        PCMSegmenter(segmentSeconds=segmentSeconds),
+                        sessions,
+                        segmentTasks,
+                        segmentState,
+                        bytesToReadEveryTime,
+                        maxChunksInFlight,
+                    )
+                )
+            ]
+            if inputChunks is not None:
+                tasks.append(
+                    asyncio.create_task(self.__feed_ffmpeg(proc.stdin, inputChunks))
+                )
+            try:
+                # Decoding is done once the last segment is cut; segments
+                # still being transcribed after that count as Vosk streams.
+                with track_stage("ffmpeg", "decode"):
+                    await asyncio.gather(*tasks)
+                await asyncio.gather(*segmentTasks)
+            except BaseException:
+                for task in tasks + segmentTasks:
+                    task.cancel()
+                if proc.returncode is None:
+                    proc.kill()
+                raise
             await proc.wait()
-            self.__set_finished_status(True)
-            logging.info(
-                "Took %s seconds to process audio file with %d bytes sent each time for language `%s` and file `%s`",
-                time.time() - startTime,
+            self.__log_finished(
+                sourceDescription,
                 bytesToReadEveryTime,
-                self.get_language().value,
-                audioFile.__str__(),
+                maxChunksInFlight,
+                parallelSessions,
             )
-            # logging.info("Using native audio file format")
-            # waveFile = wave.open(audioFile.__str__(), "rb")
-            # await websocket.send(
-            #     json.dumps(
-            #         self.__get_vosk_server_config_message(
-            #             sampleRate=waveFile.getframerate(),
-            #             altFormat=True,
-            #         )
-            #     ).__str__()
-            # )
-            # buffer_size = int(waveFile.getframerate() * 0.2)
-            # while True:
-            #     data = waveFile.readframes(buffer_size)
-            #     if len(data) == 0:
-            #         break
-            #     await websocket.send(self.__get_vosk_server_message(data))
-            #     self.__add_result(self.__parse_response(await websocket.recv()))
-            # await websocket.send('{"eof" : 1}')
-            # self.__add_result(self.__parse_response(await websocket.recv()))
-            # self.__set_finished_status(True)
+        finally:
+            if self.__FINISHED_AT is None:
+                self.__FINISHED_AT = time.monotonic()
+            self.__set_finished_status(True)
+
+    async def process_audio_file(
+        self,
+        audioFile: Path,
+        bytesToReadEveryTime: int = 8000,
+        maxChunksInFlight: int = 8,
+        parallelSessions: int = 1,
+        segmentSeconds: float = 60,
+    ) -> None:
+        logging.debug("Processing audio file `%s`", audioFile.__str__())
+        if parallelSessions > 1:
+            await self.__process_segmented(
+                ffmpegInput=audioFile.__str__(),
+                sourceDescription=audioFile.__str__(),
+                inputChunks=None,
+                bytesToReadEveryTime=bytesToReadEveryTime,
+                maxChunksInFlight=maxChunksInFlight,
+                parallelSessions=parallelSessions,
+                segmentSeconds=segmentSeconds,
+            )
+            return
+        await self.__process(
+            ffmpegInput=audioFile.__str__(),
+            sourceDescription=audioFile.__str__(),
+            inputChunks=None,
+            bytesToReadEveryTime=bytesToReadEveryTime,
+            maxChunksInFlight=maxChunksInFlight,
+        )
+        # logging.info("Using native audio file format")
+        # waveFile = wave.open(audioFile.__str__(), "rb")
+        # await websocket.send(
+        #     json.dumps(
+        #         self.__get_vosk_server_config_message(
+        #             sampleRate=waveFile.getframerate(),
+        #             altFormat=True,
+        #         )
+        #     ).__str__()
+        # )
+        # buffer_size = int(waveFile.getframerate() * 0.2)
+        # while True:
+        #     data = waveFile.readframes(buffer_size)
+        #     if len(data) == 0:
+        #         break
+        #     await websocket.send(self.__get_vosk_server_message(data))
+        #     self.__add_result(self.__parse_response(await websocket.recv()))
+        # await websocket.send('{"eof" : 1}')
+        # self.__add_result(self.__parse_response(await websocket.recv()))
+        # self.__set_finished_status(True)
+
+    async def process_audio_stream(
+        self,
+        inputChunks: AsyncIterator[bytes],
+        sourceDescription: str = "stream",
+        bytesToReadEveryTime: int = 8000,
+        maxChunksInFlight: int = 8,
+        parallelSessions: int = 1,
+        segmentSeconds: float = 60,
+    ) -> None:
+        logging.debug("Processing audio stream `%s`", sourceDescription)
+        if parallelSessions > 1:
+            await self.__process_segmented(
+                ffmpegInput="pipe:0",
+                sourceDescription=sourceDescription,
+                inputChunks=inputChunks,
+                bytesToReadEveryTime=bytesToReadEveryTime,
+                maxChunksInFlight=maxChunksInFlight,
+                parallelSessions=parallelSessions,
+                segmentSeconds=segmentSeconds,
+            )
+            return
+        await self.__process(
+            ffmpegInput="pipe:0",
+            sourceDescription=sourceDescription,
+            inputChunks=inputChunks,
+            bytesToReadEveryTime=bytesToReadEveryTime,
+            maxChunksInFlight=maxChunksInFlight,
+        )
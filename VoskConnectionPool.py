@@ -0,0 +1,279 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import websockets
+from websockets.client import WebSocketClientProtocol
+from config import AvailableLanguages, Config
+from models import VoskConnectionPoolStatistics
+from Metrics import (
+    VOSK_POOL_ACQUIRE_WAIT_SECONDS,
+    VOSK_POOL_ACQUISITIONS,
+    VOSK_POOL_CONNECTIONS,
+    track_stage,
+)
+import asyncio
+import contextvars
+import time
+import logging
+
+
+class VoskConnectionPool:
+    def __init__(
+        self,
+        endpoint: str,
+        headers: list,
+        minSize: int = 1,
+        maxSize: int = 16,
+        maxIdleSeconds: float = 60,
+        healthCheckAfterSeconds: float = 10,
+        healthCheckTimeout: float = 5,
+        closeGraceSeconds: float = 1,
+    ) -> None:
+        self.__ENDPOINT = endpoint
+        self.__HEADERS = headers
+        self.__MIN_SIZE = min(minSize, maxSize)
+        self.__MAX_SIZE = maxSize
+        self.__MAX_IDLE_SECONDS = maxIdleSeconds
+        self.__HEALTH_CHECK_AFTER_SECONDS = healthCheckAfterSeconds
+        self.__HEALTH_CHECK_TIMEOUT = healthCheckTimeout
+        self.__CLOSE_GRACE_SECONDS = closeGraceSeconds
+        self.__IDLE: deque[tuple[WebSocketClientProtocol, float]] = deque()
+        self.__SLOTS = asyncio.Semaphore(maxSize)
+        self.__IN_USE: int = 0
+        self.__PENDING: int = 0
+        self.__BACKGROUND_TASKS: set[asyncio.Task] = set()
+        self.__MAINTENANCE_TASK: Optional[asyncio.Task] = None
+        self.__CLOSED: bool = False
+        self.__STATISTICS = VoskConnectionPoolStatistics(endpoint=endpoint)
+        logging.debug(
+            "Initialized VoskConnectionPool for endpoint `%s` with size %d..%d",
+            endpoint,
+            self.__MIN_SIZE,
+            maxSize,
+        )
+
+    def get_statistics(self) -> VoskConnectionPoolStatistics:
+        self.__STATISTICS.idleConnections = len(self.__IDLE)
+        self.__STATISTICS.inUseConnections = self.__IN_USE
+        return self.__STATISTICS.copy()
+
+    def __spawn(self, coroutine) -> None:
+        # Pool upkeep outlives the message that triggered it, so it must not
+        # inherit and report into that message's trace.
+        task = asyncio.create_task(coroutine, context=contextvars.Context())
+        self.__BACKGROUND_TASKS.add(task)
+        task.add_done_callback(self.__BACKGROUND_TASKS.discard)
+
+    async def __open(self) -> WebSocketClientProtocol:
+        with track_stage("vosk", "open"):
+            websocket = await websockets.connect(  # type: ignore
+                self.__ENDPOINT, extra_headers=self.__HEADERS
+            )
+        self.__STATISTICS.connectionsOpened += 1
+        return websocket
+
+    async def __discard(self, websocket: WebSocketClientProtocol) -> None:
+        self.__STATISTICS.connectionsDiscarded += 1
+        try:
+            await websocket.close()
+        except Exception as e:
+            logging.debug("Error while closing pooled Vosk connection: %s", e)
+
+    async def __is_healthy(
+        self, websocket: WebSocketClientProtocol, lastUsedAt: float
+    ) -> bool:
+        if not websocket.open:
+            return False
+        if time.monotonic() - lastUsedAt < self.__HEALTH_CHECK_AFTER_SECONDS:
+            return True
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, timeout=self.__HEALTH_CHECK_TIMEOUT)
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            return False
+        return True
+
+    def __ensure_maintenance(self) -> None:
+        if self.__MAINTENANCE_TASK is None or self.__MAINTENANCE_TASK.done():
+            self.__MAINTENANCE_TASK = asyncio.create_task(
+                self.__maintenance_loop(), context=contextvars.Context()
+            )
+
+    async def __maintenance_loop(self) -> None:
+        while not self.__CLOSED:
+            await self.__evict_idle()
+            await self.__replenish()
+            await asyncio.sleep(max(self.__MAX_IDLE_SECONDS / 2, 1))
+
+    async def __evict_idle(self) -> None:
+        now = time.monotonic()
+        while (
+            len(self.__IDLE) > self.__MIN_SIZE
+            and now - self.__IDLE[0][1] > self.__MAX_IDLE_SECONDS
+        ):
+            websocket, _ = self.__IDLE.popleft()
+            self.__STATISTICS.connectionsEvicted += 1
+            await self.__discard(websocket)
+
+    async def __replenish(self) -> None:
+        while (
+            not self.__CLOSED
+            and len(self.__IDLE) + self.__PENDING < self.__MIN_SIZE
+            and len(self.__IDLE) + self.__PENDING + self.__IN_USE < self.__MAX_SIZE
+        ):
+            self.__PENDING += 1
+            try:
+                websocket = await self.__open()
+            except Exception as e:
+                logging.warning(
+                    "Could not open warm Vosk connection to `%s`: %s",
+                    self.__ENDPOINT,
+                    e,
+                )
+                return
+            finally:
+                self.__PENDING -= 1
+            self.__IDLE.append((websocket, time.monotonic()))
+
+    async def warm_up(self) -> None:
+        self.__ensure_maintenance()
+        await self.__replenish()
+
+    async def acquire(self) -> WebSocketClientProtocol:
+        self.__ensure_maintenance()
+        startWait = time.monotonic()
+        await self.__SLOTS.acquire()
+        waitedFor = time.monotonic() - startWait
+        self.__STATISTICS.acquisitions += 1
+        self.__STATISTICS.acquireWaitSecondsTotal += waitedFor
+        self.__STATISTICS.acquireWaitSecondsMax = max(
+            self.__STATISTICS.acquireWaitSecondsMax, waitedFor
+        )
+        try:
+            while self.__IDLE:
+                websocket, lastUsedAt = self.__IDLE.pop()
+                if await self.__is_healthy(websocket, lastUsedAt):
+                    self.__STATISTICS.acquisitionsReused += 1
+                    self.__IN_USE += 1
+                    return websocket
+                await self.__discard(websocket)
+            websocket = await self.__open()
+        except BaseException:
+            self.__SLOTS.release()
+            raise
+        self.__IN_USE += 1
+        return websocket
+
+    async def release(
+        self, websocket: WebSocketClientProtocol, reusable: bool = True
+    ) -> None:
+        self.__IN_USE -= 1
+        self.__SLOTS.release()
+        if self.__CLOSED or not reusable or not websocket.open:
+            await self.__discard(websocket)
+            self.__spawn(self.__replenish())
+            return
+        self.__PENDING += 1
+        self.__spawn(self.__return_after_grace(websocket))
+
+    async def __return_after_grace(self, websocket: WebSocketClientProtocol) -> None:
+        # Stock vosk-server closes the socket right after answering EOF, so
+        # only connections that survive the grace period go back to the pool.
+        try:
+            await asyncio.wait_for(
+                websocket.wait_closed(), timeout=self.__CLOSE_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.__PENDING -= 1
+        if websocket.open and not self.__CLOSED:
+            self.__IDLE.append((websocket, time.monotonic()))
+            return
+        await self.__discard(websocket)
+        await self.__replenish()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[WebSocketClientProtocol]:
+        websocket = await self.acquire()
+        try:
+            yield websocket
+        except BaseException:
+            await self.release(websocket, reusable=False)
+            raise
+        await self.release(websocket)
+
+    async def close(self) -> None:
+        self.__CLOSED = True
+        if self.__MAINTENANCE_TASK is not None:
+            self.__MAINTENANCE_TASK.cancel()
+        for task in list(self.__BACKGROUND_TASKS):
+            task.cancel()
+        while self.__IDLE:
+            websocket, _ = self.__IDLE.popleft()
+            await self.__discard(websocket)
+
+
+class VoskConnectionPools:
+    def __init__(self) -> None:
+        self.__POOLS: dict[AvailableLanguages, VoskConnectionPool] = {}
+
+    def get(self, language: AvailableLanguages) -> VoskConnectionPool:
+        if language not in self.__POOLS:
+            self.__POOLS[language] = VoskConnectionPool(
+                endpoint=Config.get_vosk_endpoint(language),
+                headers=[["X-API-Key", Config.get_vosk_api_key()]],
+                minSize=Config.get_vosk_pool_min_size(),
+                maxSize=Config.get_vosk_pool_max_size(),
+                maxIdleSeconds=Config.get_vosk_pool_max_idle_seconds(),
+            )
+        return self.__POOLS[language]
+
+    async def warm_up(self) -> None:
+        for language in AvailableLanguages:
+            await self.get(language).warm_up()
+
+    def get_statistics(
+        self,
+    ) -> dict[AvailableLanguages, VoskConnectionPoolStatistics]:
+        return {
+            language: pool.get_statistics() for language, pool in self.__POOLS.items()
+        }
+
+    async def close(self) -> None:
+        for pool in self.__POOLS.values():
+            await pool.close()
+
+    def get_connection_metrics(self) -> dict[tuple[str, ...], float]:
+        return {
+            (language.value, state): count
+            for language, statistics in self.get_statistics().items()
+            for state, count in (
+                ("idle", statistics.idleConnections),
+                ("in_use", statistics.inUseConnections),
+            )
+        }
+
+    def get_acquisition_metrics(self) -> dict[tuple[str, ...], float]:
+        return {
+            (language.value, reused): count
+            for language, statistics in self.get_statistics().items()
+            for reused, count in (
+                ("true", statistics.acquisitionsReused),
+                ("false", statistics.acquisitions - statistics.acquisitionsReused),
+            )
+        }
+
+    def get_acquire_wait_metrics(self) -> dict[tuple[str, ...], float]:
+        return {
+            (language.value,): statistics.acquireWaitSecondsTotal
+            for language, statistics in self.get_statistics().items()
+        }
+
+
+VOSK_CONNECTION_POOLS = VoskConnectionPools()
+VOSK_POOL_CONNECTIONS.set_collector(VOSK_CONNECTION_POOLS.get_connection_metrics)
+VOSK_POOL_ACQUISITIONS.set_collector(VOSK_CONNECTION_POOLS.get_acquisition_metrics)
+VOSK_POOL_ACQUIRE_WAIT_SECONDS.set_collector(
+    VOSK_CONNECTION_POOLS.get_acquire_wait_metrics
+)
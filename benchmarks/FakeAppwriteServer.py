@@ -0,0 +1,128 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import json
+import threading
+import time
+
+
+class FakeAppwriteServer:
+    # Just the part of the Users API that UserCache and StatisticsAggregator use.
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latencySeconds: float = 0.02,
+    ) -> None:
+        self.__HOST = host
+        self.__PORT = port
+        self.__LATENCY_SECONDS = latencySeconds
+        self.__SERVER: Optional[ThreadingHTTPServer] = None
+        self.__LOCK = threading.RLock()
+        self.users: dict[str, dict] = {}
+        self.requestsReceived: dict[str, int] = {}
+
+    def __count(self, operation: str) -> None:
+        with self.__LOCK:
+            self.requestsReceived[operation] = (
+                self.requestsReceived.get(operation, 0) + 1
+            )
+
+    def __make_user(self, userId: str, name: Optional[str]) -> dict:
+        return {
+            "$id": userId,
+            "$createdAt": time.time(),
+            "$updatedAt": time.time(),
+            "name": name or "",
+            "registration": int(time.time()),
+            "status": True,
+            "passwordUpdate": 0,
+            "email": "",
+            "phone": "",
+            "emailVerification": False,
+            "phoneVerification": False,
+            "prefs": {},
+        }
+
+    def __handle(self, method: str, path: str, body: dict) -> tuple[int, dict]:
+        parts = path.split("?")[0].strip("/").split("/")
+        # The client is pointed at `<endpoint>/v1`.
+        if parts[:2] != ["v1", "users"]:
+            return 404, {"message": "Route not found", "code": 404}
+        parts = parts[2:]
+        with self.__LOCK:
+            if method == "POST" and not parts:
+                self.__count("create")
+                user = self.__make_user(body["userId"], body.get("name"))
+                self.users[body["userId"]] = user
+                return 201, user
+            user = self.users.get(parts[0]) if parts else None
+            if user is None:
+                self.__count("notFound")
+                return 404, {
+                    "message": "User with the requested ID could not be found.",
+                    "code": 404,
+                    "type": "user_not_found",
+                }
+            if method == "GET" and len(parts) == 1:
+                self.__count("get")
+                return 200, user
+            if method == "PATCH" and parts[1:] == ["prefs"]:
+                self.__count("updatePrefs")
+                user["prefs"] = body["prefs"]
+                return 200, user["prefs"]
+            if method == "PATCH" and parts[1:] == ["name"]:
+                self.__count("updateName")
+                user["name"] = body["name"]
+                return 200, user
+        return 404, {"message": "Route not found", "code": 404}
+
+    def __make_handler(self):
+        latencySeconds = self.__LATENCY_SECONDS
+        handle = self.__handle
+
+        class Handler(BaseHTTPRequestHandler):
+            def __respond(self, method: str) -> None:
+                contentLength = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(contentLength) or b"{}")
+                time.sleep(latencySeconds)
+                status, response = handle(method, self.path, body)
+                encoded = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_GET(self) -> None:
+                self.__respond("GET")
+
+            def do_POST(self) -> None:
+                self.__respond("POST")
+
+            def do_PATCH(self) -> None:
+                self.__respond("PATCH")
+
+            def log_message(self, format: str, *args) -> None:
+                return
+
+        return Handler
+
+    def get_endpoint(self) -> str:
+        if self.__SERVER is None:
+            raise Exception("FakeAppwriteServer is not started")
+        host, port = self.__SERVER.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        self.__SERVER = ThreadingHTTPServer(
+            (self.__HOST, self.__PORT), self.__make_handler()
+        )
+        self.__SERVER.daemon_threads = True
+        threading.Thread(target=self.__SERVER.serve_forever, daemon=True).start()
+        return self.get_endpoint()
+
+    def close(self) -> None:
+        if self.__SERVER is not None:
+            self.__SERVER.shutdown()
+            self.__SERVER.server_close()
+            self.__SERVER = None
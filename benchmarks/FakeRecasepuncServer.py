@@ -0,0 +1,84 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import json
+import threading
+import time
+
+
+def punctuate(text: str) -> str:
+    # Mimics recasepunc: only casing changes and punctuation is added.
+    words = text.split()
+    for index in range(len(words)):
+        if index == 0 or words[index - 1].endswith("."):
+            words[index] = words[index].capitalize()
+        if index % 8 == 7 and index != len(words) - 1:
+            words[index] += ","
+    if words:
+        words[-1] += "."
+    return " ".join(words)
+
+
+class FakeRecasepuncServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latencySeconds: float = 0.01,
+        secondsPerCharacter: float = 0.00002,
+    ) -> None:
+        self.__HOST = host
+        self.__PORT = port
+        self.__LATENCY_SECONDS = latencySeconds
+        self.__SECONDS_PER_CHARACTER = secondsPerCharacter
+        self.__SERVER: Optional[ThreadingHTTPServer] = None
+        self.__THREAD: Optional[threading.Thread] = None
+        self.requestsReceived: int = 0
+        self.charactersReceived: int = 0
+
+    def __make_handler(self):
+        server = self
+        latencySeconds = self.__LATENCY_SECONDS
+        secondsPerCharacter = self.__SECONDS_PER_CHARACTER
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.requestsReceived += 1
+                server.charactersReceived += len(body["text"])
+                time.sleep(latencySeconds + len(body["text"]) * secondsPerCharacter)
+                response = json.dumps(
+                    {"error": None, "result": punctuate(body["text"])}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format: str, *args) -> None:
+                return
+
+        return Handler
+
+    def get_endpoint(self) -> str:
+        if self.__SERVER is None:
+            raise Exception("FakeRecasepuncServer is not started")
+        host, port = self.__SERVER.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self.__SERVER = ThreadingHTTPServer(
+            (self.__HOST, self.__PORT), self.__make_handler()
+        )
+        self.__SERVER.daemon_threads = True
+        self.__THREAD = threading.Thread(
+            target=self.__SERVER.serve_forever, daemon=True
+        )
+        self.__THREAD.start()
+        return self.get_endpoint()
+
+    def close(self) -> None:
+        if self.__SERVER is not None:
+            self.__SERVER.shutdown()
+            self.__SERVER.server_close()
+            self.__SERVER = None
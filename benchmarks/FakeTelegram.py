@@ -0,0 +1,158 @@
+from typing import AsyncIterator, Optional
+import asyncio
+import itertools
+import time
+
+
+class TelegramCallRecorder:
+    def __init__(
+        self, latencySeconds: float = 0, downloadBytesPerSecond: float = 0
+    ) -> None:
+        self.latencySeconds = latencySeconds
+        self.downloadBytesPerSecond = downloadBytesPerSecond
+        self.calls: list[tuple[str, float, int]] = []
+        self.__MESSAGE_IDS = itertools.count(1000)
+
+    def next_message_id(self) -> int:
+        return next(self.__MESSAGE_IDS)
+
+    async def record(self, method: str, size: int = 0) -> None:
+        self.calls.append((method, time.monotonic(), size))
+        if self.latencySeconds > 0:
+            await asyncio.sleep(self.latencySeconds)
+
+    async def transfer(self, size: int) -> None:
+        await self.record("download", size)
+        if self.downloadBytesPerSecond > 0:
+            await asyncio.sleep(size / self.downloadBytesPerSecond)
+
+    def count(self, method: Optional[str] = None) -> int:
+        return sum(1 for call in self.calls if method is None or call[0] == method)
+
+    def reset(self) -> None:
+        self.calls.clear()
+
+
+class FakeUser:
+    def __init__(self, userId: int) -> None:
+        self.id = userId
+        self.first_name = "Bench"
+        self.last_name = "Mark"
+        self.username = f"bench{userId}"
+
+
+class FakeChat:
+    def __init__(self, chatId: int) -> None:
+        self.id = chatId
+
+
+class FakeMedia:
+    def __init__(
+        self,
+        duration: int,
+        content: bytes = b"",
+        fileName: str = "audio.wav",
+        fileUniqueId: Optional[str] = None,
+    ) -> None:
+        self.duration = duration
+        self.content = content
+        self.file_size = len(content)
+        self.file_unique_id = fileUniqueId or f"bench-{duration}-{len(content)}"
+        self.file_name = fileName
+        self.mime_type = "audio/wav"
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        recorder: TelegramCallRecorder,
+        chatId: int = 1,
+        messageId: Optional[int] = None,
+        fromUser: Optional[FakeUser] = None,
+        voice: Optional[FakeMedia] = None,
+        audio: Optional[FakeMedia] = None,
+        text: str = "",
+    ) -> None:
+        self.recorder = recorder
+        self.chat = FakeChat(chatId)
+        self.id = messageId if messageId is not None else recorder.next_message_id()
+        self.from_user = fromUser or FakeUser(chatId)
+        self.voice = voice
+        self.audio = audio
+        self.text = text
+        self.empty = False
+        self.edits: list[str] = []
+        self.trace: dict[str, float] = {}
+
+    def __reply(self, text: str = "") -> "FakeMessage":
+        return FakeMessage(
+            self.recorder, chatId=self.chat.id, fromUser=self.from_user, text=text
+        )
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self.recorder.record("edit_text", len(text))
+        self.text = text
+        self.edits.append(text)
+        return self
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self.recorder.record("reply_text", len(text))
+        return self.__reply(text)
+
+    async def reply_document(self, document, **kwargs) -> "FakeMessage":
+        size = len(document.getvalue()) if hasattr(document, "getvalue") else 0
+        await self.recorder.record("reply_document", size)
+        return self.__reply()
+
+    async def delete(self, **kwargs) -> bool:
+        await self.recorder.record("delete")
+        return True
+
+    def get_media(self) -> Optional[FakeMedia]:
+        return self.voice or self.audio
+
+    async def download(self, file_name: str, **kwargs) -> str:
+        media = self.get_media()
+        content = media.content if media is not None else b""
+        self.trace.setdefault("downloadStartedAt", time.monotonic())
+        await self.recorder.transfer(len(content))
+        with open(file_name, "wb") as f:
+            f.write(content)
+        self.trace["downloadFinishedAt"] = time.monotonic()
+        return file_name
+
+
+class FakeClient:
+    def __init__(
+        self, recorder: TelegramCallRecorder, chunkBytes: int = 1024 * 1024
+    ) -> None:
+        self.recorder = recorder
+        self.__CHUNK_BYTES = chunkBytes
+
+    async def stream_media(self, message: FakeMessage) -> AsyncIterator[bytes]:
+        media = message.get_media()
+        content = media.content if media is not None else b""
+        message.trace.setdefault("downloadStartedAt", time.monotonic())
+        # Telegram serves files in 1 MiB parts, like Client.stream_media.
+        for start in range(0, len(content), self.__CHUNK_BYTES):
+            chunk = content[start : start + self.__CHUNK_BYTES]
+            await self.recorder.transfer(len(chunk))
+            yield chunk
+        message.trace["downloadFinishedAt"] = time.monotonic()
+
+
+class FakeCallbackQuery:
+    def __init__(
+        self,
+        recorder: TelegramCallRecorder,
+        data: str,
+        fromUser: FakeUser,
+    ) -> None:
+        self.recorder = recorder
+        self.data = data
+        self.from_user = fromUser
+        self.message = FakeMessage(recorder, chatId=fromUser.id, fromUser=fromUser)
+
+    async def edit_message_text(self, text: str, **kwargs) -> FakeMessage:
+        await self.recorder.record("edit_message_text", len(text))
+        return self.message
@@ -0,0 +1,95 @@
+from typing import Optional
+import websockets
+import asyncio
+import json
+import random
+
+
+PCM_BYTES_PER_SECOND = 32000
+
+
+class FakeVoskServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latencySeconds: float = 0.005,
+        realtimeFactor: float = 0.05,
+        secondsPerResult: float = 4,
+        wordsPerSecond: float = 2.5,
+        closeAfterEof: bool = True,
+    ) -> None:
+        self.__HOST = host
+        self.__PORT = port
+        self.__LATENCY_SECONDS = latencySeconds
+        self.__REALTIME_FACTOR = realtimeFactor
+        self.__SECONDS_PER_RESULT = secondsPerResult
+        self.__WORDS_PER_SECOND = wordsPerSecond
+        self.__CLOSE_AFTER_EOF = closeAfterEof
+        self.__SERVER = None
+        self.connectionsAccepted: int = 0
+        self.messagesReceived: int = 0
+
+    def get_endpoint(self) -> str:
+        if self.__SERVER is None:
+            raise Exception("FakeVoskServer is not started")
+        host, port = list(self.__SERVER.sockets)[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    def __make_result(self, startTime: float, endTime: float) -> str:
+        wordCount = max(int((endTime - startTime) * self.__WORDS_PER_SECOND), 1)
+        wordLength = (endTime - startTime) / wordCount
+        words = [
+            {
+                "conf": round(random.uniform(0.6, 1), 3),
+                "start": round(startTime + index * wordLength, 3),
+                "end": round(startTime + (index + 1) * wordLength, 3),
+                "word": f"word{index}",
+            }
+            for index in range(wordCount)
+        ]
+        return json.dumps(
+            {"result": words, "text": " ".join(word["word"] for word in words)}
+        )
+
+    async def __handler(self, websocket, path: Optional[str] = None) -> None:
+        self.connectionsAccepted += 1
+        receivedSeconds = 0.0
+        resultStartedAt = 0.0
+        async for message in websocket:
+            if isinstance(message, str):
+                if "eof" not in message:
+                    continue
+                await asyncio.sleep(self.__LATENCY_SECONDS)
+                await websocket.send(
+                    self.__make_result(resultStartedAt, receivedSeconds)
+                    if receivedSeconds > resultStartedAt
+                    else json.dumps({"text": ""})
+                )
+                if self.__CLOSE_AFTER_EOF:
+                    return
+                receivedSeconds = resultStartedAt = 0.0
+                continue
+            self.messagesReceived += 1
+            chunkSeconds = len(message) / PCM_BYTES_PER_SECOND
+            await asyncio.sleep(
+                self.__LATENCY_SECONDS + chunkSeconds * self.__REALTIME_FACTOR
+            )
+            receivedSeconds += chunkSeconds
+            if receivedSeconds - resultStartedAt >= self.__SECONDS_PER_RESULT:
+                await websocket.send(self.__make_result(resultStartedAt, receivedSeconds))
+                resultStartedAt = receivedSeconds
+            else:
+                await websocket.send(json.dumps({"partial": "word"}))
+
+    async def start(self) -> str:
+        self.__SERVER = await websockets.serve(  # type: ignore
+            self.__handler, self.__HOST, self.__PORT, max_size=None
+        )
+        return self.get_endpoint()
+
+    async def close(self) -> None:
+        if self.__SERVER is not None:
+            self.__SERVER.close()
+            await self.__SERVER.wait_closed()
+            self.__SERVER = None
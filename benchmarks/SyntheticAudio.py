@@ -0,0 +1,65 @@
+from array import array
+from pathlib import Path
+import io
+import math
+import random
+import sys
+import wave
+
+
+SAMPLE_RATE = 16000
+
+
+def generate_speech_like_pcm(
+    durationSeconds: float,
+    seed: int = 0,
+    burstSeconds: tuple[float, float] = (0.4, 3),
+    pauseSeconds: tuple[float, float] = (0.2, 1.2),
+) -> bytes:
+    # Tone bursts with a wobbling pitch separated by near-silent pauses, which
+    # is enough for the segmenter and the energy VAD to behave as on speech.
+    randomizer = random.Random(seed)
+    totalSamples = int(durationSeconds * SAMPLE_RATE)
+    samples = array("h")
+    speaking = True
+    while len(samples) < totalSamples:
+        spanSamples = min(
+            int(
+                randomizer.uniform(*(burstSeconds if speaking else pauseSeconds))
+                * SAMPLE_RATE
+            ),
+            totalSamples - len(samples),
+        )
+        if speaking:
+            frequency = randomizer.uniform(110, 260)
+            amplitude = randomizer.uniform(3000, 9000)
+            samples.extend(
+                int(
+                    amplitude
+                    * math.sin(2 * math.pi * frequency * index / SAMPLE_RATE)
+                    * (1 + 0.3 * math.sin(2 * math.pi * 4 * index / SAMPLE_RATE))
+                    / 1.3
+                )
+                for index in range(spanSamples)
+            )
+        else:
+            samples.extend(randomizer.randint(-40, 40) for _ in range(spanSamples))
+        speaking = not speaking
+    if sys.byteorder != "little":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def make_wav(pcm: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def write_wav(path: Path, pcm: bytes) -> Path:
+    path.write_bytes(make_wav(pcm))
+    return path
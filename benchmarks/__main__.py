@@ -0,0 +1,161 @@
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from benchmarks.environment import get_git_commit, prepare_environment
+
+# Telegram is a local stand-in here, so the rate limiter should not be what
+# is being measured.
+prepare_environment(
+    {
+        "TELEGRAM_GLOBAL_RATE_PER_SECOND": "1000000",
+        "TELEGRAM_GLOBAL_BURST": "1000000",
+        "TELEGRAM_CHAT_RATE_PER_SECOND": "1000000",
+        "TELEGRAM_CHAT_BURST": "1000000",
+    }
+)
+
+from config import ChunkSizePolicy  # noqa: E402
+from ReCasePuncAPI import RecasepuncAPI  # noqa: E402
+from benchmarks.FakeRecasepuncServer import FakeRecasepuncServer  # noqa: E402
+from benchmarks.FakeVoskServer import FakeVoskServer  # noqa: E402
+from benchmarks.scenarios import (  # noqa: E402
+    run_format_scenarios,
+    run_result_scenarios,
+    run_scheduler_scenarios,
+    run_send_scenarios,
+    run_vosk_scenarios,
+    run_vtt_scenarios,
+)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Offline benchmarks against local Vosk, recasepunc and Telegram stand-ins.",
+    )
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument(
+        "--only",
+        choices=["vosk", "format", "send", "vtt", "results", "scheduler"],
+        action="append",
+        default=None,
+    )
+    parser.add_argument("--vosk-latency", type=float, default=0.005)
+    parser.add_argument("--vosk-realtime-factor", type=float, default=0.05)
+    parser.add_argument("--recasepunc-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-latency", type=float, default=0)
+    parser.add_argument(
+        "--chunk-size-policy",
+        type=ChunkSizePolicy,
+        choices=list(ChunkSizePolicy),
+        default=ChunkSizePolicy.FIXED,
+    )
+    return parser.parse_args()
+
+
+async def run(arguments: argparse.Namespace) -> dict:
+    scenarios = set(
+        arguments.only or ["vosk", "format", "send", "vtt", "results", "scheduler"]
+    )
+    audioDurations = [15, 120] if arguments.quick else [15, 120, 600, 1800]
+    segmentCounts = [10, 100] if arguments.quick else [10, 100, 1000, 5000]
+    reports: list[dict] = []
+    notes: list[str] = []
+
+    if "vosk" in scenarios:
+        if shutil.which("ffmpeg") is None:
+            notes.append("vosk scenarios skipped: ffmpeg is not installed")
+        else:
+            voskServer = FakeVoskServer(
+                latencySeconds=arguments.vosk_latency,
+                realtimeFactor=arguments.vosk_realtime_factor,
+            )
+            endpoint = await voskServer.start()
+            os.environ["VOSK_ENDPOINT_RUSSIAN"] = endpoint
+            os.environ["VOSK_ENDPOINT_ENGLISH"] = endpoint
+            try:
+                with tempfile.TemporaryDirectory() as workDirectory:
+                    reports += await run_vosk_scenarios(
+                        Path(workDirectory),
+                        audioDurations,
+                        [1, 4],
+                        arguments.repeats,
+                        chunkSizePolicy=arguments.chunk_size_policy,
+                        voiceActivityThresholds=(None, 300),
+                    )
+            finally:
+                await voskServer.close()
+
+    if "format" in scenarios:
+        reports += await run_format_scenarios(segmentCounts, arguments.repeats)
+        recasepuncServer = FakeRecasepuncServer(
+            latencySeconds=arguments.recasepunc_latency
+        )
+        try:
+            reports += await run_format_scenarios(
+                segmentCounts,
+                arguments.repeats,
+                rcpapi=RecasepuncAPI(
+                    endpointBase=recasepuncServer.start(),  # type: ignore
+                    apiKey="bench",
+                ),
+            )
+        finally:
+            recasepuncServer.close()
+
+    if "send" in scenarios:
+        reports += await run_send_scenarios(
+            segmentCounts,
+            arguments.repeats,
+            telegramLatencySeconds=arguments.telegram_latency,
+        )
+
+    if "vtt" in scenarios:
+        reports += await run_vtt_scenarios(
+            segmentCounts + [segmentCounts[-1] * 10], arguments.repeats
+        )
+
+    if "results" in scenarios:
+        reports += await run_result_scenarios(segmentCounts, arguments.repeats)
+
+    if "scheduler" in scenarios:
+        reports += await run_scheduler_scenarios(arguments.repeats)
+
+    return {
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "createdAt": time.time(),
+        "repeats": arguments.repeats,
+        "quick": arguments.quick,
+        "notes": notes,
+        "results": reports,
+    }
+
+
+def main() -> None:
+    arguments = parse_arguments()
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    logging.getLogger("benchmarks").setLevel(logging.INFO)
+    output = json.dumps(asyncio.run(run(arguments)), indent=2)
+    if arguments.output is None:
+        print(output)
+        return
+    arguments.output.write_text(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from pathlib import Path
+from typing import Optional
+import os
+import subprocess
+import sys
+
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+
+# Config refuses to load without these, and several singletons read it on
+# import, so they have to be in place before any of the bot's modules load.
+PLACEHOLDER_ENVIRONMENT = {
+    "VOSK_API_KEY": "bench",
+    "VOSK_ENDPOINT_RUSSIAN": "ws://127.0.0.1:1",
+    "VOSK_ENDPOINT_ENGLISH": "ws://127.0.0.1:1",
+    "TELEGRAM_API_ID": "1",
+    "TELEGRAM_API_HASH": "bench",
+    "TELEGRAM_BOT_TOKEN": "bench",
+    "TELEGRAM_BOT_WORKERS": "1",
+    "VPRW_RCPAPI_ENDPOINT": "http://127.0.0.1:1",
+    "VPRW_RCPAPI_KEY": "bench",
+    "APPWRITE_API_ENDPOINT": "http://127.0.0.1:1",
+    "APPWRITE_PROJECT_ID": "bench",
+    "APPWRITE_API_KEY": "bench",
+    "APPWRITE_STORAGE_BOTAVATAR": "http://127.0.0.1:1",
+}
+
+
+def prepare_environment(defaults: Optional[dict[str, str]] = None) -> None:
+    for key, value in {**PLACEHOLDER_ENVIRONMENT, **(defaults or {})}.items():
+        os.environ.setdefault(key, value)
+    if REPOSITORY_ROOT.__str__() not in sys.path:
+        sys.path.insert(0, REPOSITORY_ROOT.__str__())
+    # Downloads and uploads go through the relative `files_download` directory.
+    os.chdir(REPOSITORY_ROOT)
+    (REPOSITORY_ROOT / "files_download").mkdir(exist_ok=True)
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPOSITORY_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,415 @@
+from typing import Optional
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import time
+
+
+from benchmarks.environment import get_git_commit, prepare_environment
+
+prepare_environment()
+
+from benchmarks.FakeAppwriteServer import FakeAppwriteServer  # noqa: E402
+from benchmarks.FakeRecasepuncServer import FakeRecasepuncServer  # noqa: E402
+from benchmarks.FakeTelegram import (  # noqa: E402
+    FakeCallbackQuery,
+    FakeClient,
+    FakeMedia,
+    FakeMessage,
+    FakeUser,
+    TelegramCallRecorder,
+)
+from benchmarks.FakeVoskServer import FakeVoskServer  # noqa: E402
+from benchmarks.SyntheticAudio import (  # noqa: E402
+    SAMPLE_RATE,
+    generate_speech_like_pcm,
+    make_wav,
+)
+from benchmarks.scenarios import summarize_seconds  # noqa: E402
+
+
+LOGGER = logging.getLogger("benchmarks")
+
+# Consecutive pairs of marks on a message's trace, in pipeline order.
+STAGES = (
+    ("handler", "sentAt", "handledAt"),
+    ("queue", "handledAt", "startedAt"),
+    ("download", "downloadStartedAt", "downloadFinishedAt"),
+    ("transcription", "startedAt", "sendStartedAt"),
+    ("send", "sendStartedAt", "sendFinishedAt"),
+    ("finalize", "sendFinishedAt", "finishedAt"),
+    ("endToEnd", "sentAt", "finishedAt"),
+)
+
+SETTINGS_CALLBACKS = (
+    "vclblls-actn-punc-toggle-{}",
+    "vclblls-actn-sbta-toggle-{}",
+    "vclblls-actn-ssub-toggle-{}",
+    "vclblls-actn-lang-en-{}",
+    "vclblls-actn-lang-ru-{}",
+)
+
+
+def parse_range(value: str) -> tuple[float, float]:
+    lowest, _, highest = value.partition(",")
+    return float(lowest), float(highest or lowest)
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix: dict[str, float] = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("voice", "audio", "settings"):
+            raise argparse.ArgumentTypeError(f"Unknown traffic kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.loadtest",
+        description="Replay simulated users against the bot's real handlers with local stand-ins for Telegram, Appwrite, Vosk and recasepunc.",
+    )
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument(
+        "--mix", type=parse_mix, default=parse_mix("voice=0.75,audio=0.05,settings=0.2")
+    )
+    parser.add_argument("--voice-seconds", type=parse_range, default=(3, 60))
+    parser.add_argument("--audio-seconds", type=parse_range, default=(300, 1200))
+    parser.add_argument("--think-time", type=parse_range, default=(0.5, 3))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vosk-latency", type=float, default=0.01)
+    parser.add_argument("--vosk-realtime-factor", type=float, default=0.1)
+    parser.add_argument("--recasepunc-latency", type=float, default=0.05)
+    parser.add_argument("--appwrite-latency", type=float, default=0.03)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--telegram-download-bytes-per-second", type=float, default=5 * 1024 * 1024
+    )
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+class AudioLibrary:
+    # A minute of synthetic speech is generated once and tiled, so preparing
+    # hour-long files does not dominate the run.
+    def __init__(self, seed: int, baseSeconds: int = 60) -> None:
+        self.__BASE_PCM = generate_speech_like_pcm(baseSeconds, seed=seed)
+        self.__CACHE: dict[int, bytes] = {}
+
+    def get_wav(self, durationSeconds: int) -> bytes:
+        if durationSeconds not in self.__CACHE:
+            pcmBytes = durationSeconds * SAMPLE_RATE * 2
+            repeats = -(-pcmBytes // len(self.__BASE_PCM))
+            self.__CACHE[durationSeconds] = make_wav(
+                (self.__BASE_PCM * repeats)[:pcmBytes]
+            )
+        return self.__CACHE[durationSeconds]
+
+
+class LoadGenerator:
+    def __init__(self, bot, arguments: argparse.Namespace) -> None:
+        self.__BOT = bot
+        self.__ARGUMENTS = arguments
+        self.__RECORDER = TelegramCallRecorder(
+            latencySeconds=arguments.telegram_latency,
+            downloadBytesPerSecond=arguments.telegram_download_bytes_per_second,
+        )
+        self.__CLIENT = FakeClient(self.__RECORDER)
+        self.__AUDIO = AudioLibrary(arguments.seed)
+        self.__FILE_IDS = itertools.count()
+        self.__PENDING: dict[int, asyncio.Future] = {}
+        self.traces: list[tuple[str, dict[str, float]]] = []
+        self.schedulerDepths: list[int] = []
+        self.__install_probes()
+
+    def __install_probes(self) -> None:
+        # The handlers are the real ones; only the two calls that bracket a
+        # transcription are wrapped to stamp its trace.
+        runVoicePipeline = self.__BOT.run_voice_pipeline
+        sendResult = self.__BOT.Utils.send_stt_result_with_respecting_max_message_length
+        pending = self.__PENDING
+
+        async def traced_run_voice_pipeline(STTP, message, *args, **kwargs) -> None:
+            message.trace["startedAt"] = time.monotonic()
+            try:
+                await runVoicePipeline(STTP, message, *args, **kwargs)
+            except BaseException:
+                message.trace["failed"] = 1
+                raise
+            finally:
+                message.trace["finishedAt"] = time.monotonic()
+                completion = pending.pop(message.id, None)
+                if completion is not None and not completion.done():
+                    completion.set_result(None)
+
+        async def traced_send_result(*args, **kwargs) -> None:
+            message = kwargs.get("message", args[0] if args else None)
+            message.trace["sendStartedAt"] = time.monotonic()
+            try:
+                await sendResult(*args, **kwargs)
+            finally:
+                message.trace["sendFinishedAt"] = time.monotonic()
+
+        self.__BOT.run_voice_pipeline = traced_run_voice_pipeline
+        self.__BOT.Utils.send_stt_result_with_respecting_max_message_length = (
+            staticmethod(traced_send_result)
+        )
+
+    async def __send_media(
+        self, kind: str, user: FakeUser, randomizer: random.Random
+    ) -> None:
+        duration = int(
+            randomizer.uniform(
+                *(
+                    self.__ARGUMENTS.voice_seconds
+                    if kind == "voice"
+                    else self.__ARGUMENTS.audio_seconds
+                )
+            )
+        )
+        # Unique file ids, so the transcript cache does not short-circuit.
+        media = FakeMedia(
+            duration,
+            self.__AUDIO.get_wav(duration),
+            fileName=f"bench-{duration}.wav",
+            fileUniqueId=f"bench-{next(self.__FILE_IDS)}",
+        )
+        message = FakeMessage(
+            self.__RECORDER,
+            chatId=user.id,
+            fromUser=user,
+            voice=media if kind == "voice" else None,
+            audio=media if kind == "audio" else None,
+        )
+        completion = asyncio.get_running_loop().create_future()
+        self.__PENDING[message.id] = completion
+        message.trace["sentAt"] = time.monotonic()
+        message.trace["audioSeconds"] = duration
+        self.traces.append((kind, message.trace))
+        handler = (
+            self.__BOT.on_voice_message_private
+            if kind == "voice"
+            else self.__BOT.on_audio_message_private
+        )
+        try:
+            await handler(self.__CLIENT, message)
+        except Exception:
+            message.trace["failed"] = 1
+            self.__PENDING.pop(message.id, None)
+            raise
+        finally:
+            message.trace["handledAt"] = time.monotonic()
+        await completion
+
+    async def __send_settings(self, user: FakeUser, randomizer: random.Random) -> None:
+        callbackQuery = FakeCallbackQuery(
+            self.__RECORDER,
+            randomizer.choice(SETTINGS_CALLBACKS).format(user.id),
+            user,
+        )
+        trace = {"sentAt": time.monotonic()}
+        self.traces.append(("settings", trace))
+        try:
+            await self.__BOT.on_callback(None, callbackQuery)
+        finally:
+            trace["handledAt"] = trace["finishedAt"] = time.monotonic()
+
+    async def __simulate_user(self, userId: int, deadline: float) -> None:
+        randomizer = random.Random(self.__ARGUMENTS.seed * 1000003 + userId)
+        user = FakeUser(userId)
+        kinds = list(self.__ARGUMENTS.mix.keys())
+        weights = list(self.__ARGUMENTS.mix.values())
+        # Users start spread over the first think time instead of all at once.
+        await asyncio.sleep(randomizer.uniform(0, self.__ARGUMENTS.think_time[1]))
+        while time.monotonic() < deadline:
+            kind = randomizer.choices(kinds, weights)[0]
+            try:
+                if kind == "settings":
+                    await self.__send_settings(user, randomizer)
+                else:
+                    await self.__send_media(kind, user, randomizer)
+            except Exception as e:
+                LOGGER.error("Simulated user #%s failed on %s: %s", userId, kind, e)
+            await asyncio.sleep(randomizer.uniform(*self.__ARGUMENTS.think_time))
+
+    async def __sample_scheduler(self) -> None:
+        while True:
+            self.schedulerDepths.append(
+                self.__BOT.TRANSCRIPTION_SCHEDULER.get_queue_depth()
+            )
+            await asyncio.sleep(0.5)
+
+    async def run(self) -> float:
+        startedAt = time.monotonic()
+        deadline = startedAt + self.__ARGUMENTS.duration
+        sampler = asyncio.create_task(self.__sample_scheduler())
+        # Simulated users are unknown to the fake Appwrite, so each one is
+        # created on first contact like a real newcomer.
+        try:
+            await asyncio.gather(
+                *[
+                    self.__simulate_user(1_000_000 + index, deadline)
+                    for index in range(self.__ARGUMENTS.users)
+                ]
+            )
+        finally:
+            sampler.cancel()
+        return time.monotonic() - startedAt
+
+    def get_telegram_calls(self) -> dict[str, int]:
+        return {
+            method: self.__RECORDER.count(method)
+            for method in sorted({call[0] for call in self.__RECORDER.calls})
+        }
+
+
+def summarize_traces(
+    traces: list[tuple[str, dict[str, float]]], elapsedSeconds: float
+) -> dict:
+    summary: dict[str, dict] = {}
+    for kind in sorted({kind for kind, _ in traces}):
+        kindTraces = [trace for traceKind, trace in traces if traceKind == kind]
+        completed = [
+            trace
+            for trace in kindTraces
+            if "finishedAt" in trace and "failed" not in trace
+        ]
+        stages: dict[str, dict] = {}
+        for stage, startMark, endMark in STAGES:
+            durations = [
+                trace[endMark] - trace[startMark]
+                for trace in completed
+                if startMark in trace and endMark in trace
+            ]
+            if durations:
+                stages[stage] = summarize_seconds(durations)
+        endToEndTotal = sum(
+            trace["finishedAt"] - trace["sentAt"] for trace in completed
+        )
+        summary[kind] = {
+            "sent": len(kindTraces),
+            "completed": len(completed),
+            "failed": sum(1 for trace in kindTraces if "failed" in trace),
+            "unfinished": sum(1 for trace in kindTraces if "finishedAt" not in trace),
+            "completedPerSecond": len(completed) / elapsedSeconds,
+            "audioSecondsPerSecond": sum(
+                trace.get("audioSeconds", 0) for trace in completed
+            )
+            / elapsedSeconds,
+            "stages": stages,
+            # Stages after the handler are sequential, except that streamed
+            # downloads overlap transcription.
+            "shareOfEndToEnd": {
+                stage: sum(
+                    trace[endMark] - trace[startMark]
+                    for trace in completed
+                    if startMark in trace and endMark in trace
+                )
+                / endToEndTotal
+                for stage, startMark, endMark in STAGES
+                if stage != "endToEnd" and stage in stages and endToEndTotal > 0
+            },
+        }
+    return summary
+
+
+async def run(arguments: argparse.Namespace) -> dict:
+    voskServer = FakeVoskServer(
+        latencySeconds=arguments.vosk_latency,
+        realtimeFactor=arguments.vosk_realtime_factor,
+    )
+    recasepuncServer = FakeRecasepuncServer(latencySeconds=arguments.recasepunc_latency)
+    appwriteServer = FakeAppwriteServer(latencySeconds=arguments.appwrite_latency)
+    voskEndpoint = await voskServer.start()
+    os.environ["VOSK_ENDPOINT_RUSSIAN"] = voskEndpoint
+    os.environ["VOSK_ENDPOINT_ENGLISH"] = voskEndpoint
+    os.environ["VPRW_RCPAPI_ENDPOINT"] = recasepuncServer.start()
+    os.environ["APPWRITE_API_ENDPOINT"] = appwriteServer.start()
+    # The in-process worker fetches messages back from Telegram by id, which
+    # the stand-in cannot serve, so the scheduler path is what gets measured.
+    os.environ["TRANSCRIPTION_MODE"] = "direct"
+    bot = importlib.import_module("main")
+    logging.getLogger().setLevel(arguments.log_level.upper())
+    logging.getLogger("benchmarks").setLevel(logging.INFO)
+    generator: Optional[LoadGenerator] = None
+    try:
+        await bot.VOSK_CONNECTION_POOLS.warm_up()
+        bot.USER_STATISTICS.start()
+        generator = LoadGenerator(bot, arguments)
+        LOGGER.info(
+            "Running %s simulated users for %s seconds",
+            arguments.users,
+            arguments.duration,
+        )
+        elapsedSeconds = await generator.run()
+    finally:
+        await bot.TRANSCRIPTION_SCHEDULER.close()
+        await bot.VOSK_CONNECTION_POOLS.close()
+        await bot.USER_STATISTICS.close()
+        await bot.USER_CACHE.close()
+        await voskServer.close()
+        recasepuncServer.close()
+        appwriteServer.close()
+    completed = [
+        trace
+        for _, trace in generator.traces
+        if "finishedAt" in trace and "failed" not in trace
+    ]
+    return {
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "createdAt": time.time(),
+        "parameters": {
+            key: value
+            for key, value in vars(arguments).items()
+            if key not in ("output", "log_level")
+        },
+        "elapsedSeconds": elapsedSeconds,
+        "messagesPerSecond": len(completed) / elapsedSeconds,
+        "endToEndSeconds": summarize_seconds(
+            [trace["finishedAt"] - trace["sentAt"] for trace in completed]
+        )
+        if completed
+        else None,
+        "byKind": summarize_traces(generator.traces, elapsedSeconds),
+        "schedulerQueueDepth": {
+            "max": max(generator.schedulerDepths, default=0),
+            "mean": sum(generator.schedulerDepths)
+            / max(len(generator.schedulerDepths), 1),
+        },
+        "telegramCalls": generator.get_telegram_calls(),
+        "appwriteRequests": dict(appwriteServer.requestsReceived),
+        "voskConnections": voskServer.connectionsAccepted,
+        "recasepuncRequests": recasepuncServer.requestsReceived,
+    }
+
+
+def main() -> None:
+    arguments = parse_arguments()
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    if shutil.which("ffmpeg") is None:
+        raise SystemExit("The load test decodes real audio and needs ffmpeg installed")
+    output = json.dumps(asyncio.run(run(arguments)), indent=2)
+    if arguments.output is None:
+        print(output)
+        return
+    with open(arguments.output, "w") as f:
+        f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+from config import AvailableLanguages, ChunkSizePolicy
+from models import UserModel
+from ReCasePuncAPI import RecasepuncAPI
+from subtitles import genereate_vtt_subs
+from TranscriptionScheduler import TranscriptionJob, TranscriptionScheduler
+from utils import Utils
+from VoskAPI import VoskAPI, VoskResult
+from benchmarks.FakeTelegram import FakeMessage, TelegramCallRecorder
+from benchmarks.SyntheticAudio import generate_speech_like_pcm, write_wav
+import asyncio
+import json
+import logging
+import random
+import statistics
+import time
+import tracemalloc
+
+
+LOGGER = logging.getLogger("benchmarks")
+
+
+def get_percentile(sortedSamples: list[float], percentile: float) -> float:
+    # Nearest-rank percentile, so every reported value was actually observed.
+    index = max(int(-(-percentile * len(sortedSamples) // 100)) - 1, 0)
+    return sortedSamples[min(index, len(sortedSamples) - 1)]
+
+
+def summarize_seconds(samples: list[float]) -> dict:
+    sortedSamples = sorted(samples)
+    return {
+        "count": len(sortedSamples),
+        "min": sortedSamples[0],
+        "p50": get_percentile(sortedSamples, 50),
+        "p90": get_percentile(sortedSamples, 90),
+        "p95": get_percentile(sortedSamples, 95),
+        "p99": get_percentile(sortedSamples, 99),
+        "max": sortedSamples[-1],
+        "mean": statistics.fmean(sortedSamples),
+    }
+
+
+def make_results(
+    segmentCount: int, wordsPerSegment: int = 12, seed: int = 0
+) -> list[VoskResult]:
+    randomizer = random.Random(seed)
+    results: list[VoskResult] = []
+    startTime = 0.0
+    for index in range(segmentCount):
+        endTime = startTime + randomizer.uniform(2, 8)
+        results.append(
+            VoskResult(
+                text=" ".join(
+                    f"word{index}x{wordIndex}" for wordIndex in range(wordsPerSegment)
+                ),
+                startTime=startTime,
+                endTime=endTime,
+                overallConfidence=randomizer.uniform(0.6, 1),
+            )
+        )
+        startTime = endTime + randomizer.uniform(0, 1)
+    return results
+
+
+def make_vosk_responses(
+    segmentCount: int, wordsPerSegment: tuple[int, int] = (3, 14), seed: int = 0
+) -> list[str]:
+    # Final results as the Vosk server sends them, word timings included.
+    randomizer = random.Random(seed)
+    responses: list[str] = []
+    startTime = 0.0
+    for index in range(segmentCount):
+        words = []
+        for wordIndex in range(randomizer.randint(*wordsPerSegment)):
+            endTime = startTime + randomizer.uniform(0.1, 0.6)
+            words.append(
+                {
+                    "conf": randomizer.uniform(0.5, 1),
+                    "start": round(startTime, 2),
+                    "end": round(endTime, 2),
+                    "word": f"word{index}x{wordIndex}",
+                }
+            )
+            startTime = endTime
+        responses.append(
+            json.dumps(
+                {"result": words, "text": " ".join(word["word"] for word in words)}
+            )
+        )
+    return responses
+
+
+def find_out_of_order_results(results: list[VoskResult]) -> list[tuple[int, int]]:
+    # Pairs of neighbouring results that overlap or go back in time.
+    return [
+        (index, index + 1)
+        for index in range(len(results) - 1)
+        if results[index + 1].startTime < results[index].endTime
+        or results[index].endTime < results[index].startTime
+    ]
+
+
+def make_user(sendSubtitles: bool, sendBigTextAsFile: bool) -> UserModel:
+    return UserModel(
+        **{
+            "$id": "bench-user",
+            "status": True,
+            "prefs": {
+                "sendSubtitles": sendSubtitles,
+                "sendBigTextAsFile": sendBigTextAsFile,
+            },
+        }
+    )
+
+
+async def measure(
+    repeats: int,
+    prepare: Callable[[], object],
+    run: Callable[[object], Awaitable[object]],
+) -> tuple[list[float], list[object]]:
+    durations: list[float] = []
+    outputs: list[object] = []
+    for _ in range(repeats):
+        state = prepare()
+        startedAt = time.perf_counter()
+        outputs.append(await run(state))
+        durations.append(time.perf_counter() - startedAt)
+    return durations, outputs
+
+
+def make_report(
+    scenario: str,
+    parameters: dict,
+    durations: list[float],
+    throughputUnit: str,
+    unitsPerRun: float,
+    **extra,
+) -> dict:
+    report = {
+        "scenario": scenario,
+        "parameters": parameters,
+        "latencySeconds": summarize_seconds(durations),
+        "throughput": {
+            "unit": throughputUnit,
+            "perSecond": unitsPerRun * len(durations) / sum(durations),
+        },
+    }
+    report.update(extra)
+    LOGGER.info(
+        "%s %s: p50 %.4fs, %.1f %s/s",
+        scenario,
+        parameters,
+        report["latencySeconds"]["p50"],
+        report["throughput"]["perSecond"],
+        throughputUnit,
+    )
+    return report
+
+
+async def run_vosk_scenarios(
+    workDirectory: Path,
+    audioDurations: list[float],
+    parallelSessions: list[int],
+    repeats: int,
+    chunkSizePolicy: ChunkSizePolicy = ChunkSizePolicy.FIXED,
+    voiceActivityThresholds: tuple[Optional[float], ...] = (None,),
+) -> list[dict]:
+    reports: list[dict] = []
+    for audioDuration in audioDurations:
+        audioFile = write_wav(
+            workDirectory / f"bench-{int(audioDuration)}s.wav",
+            generate_speech_like_pcm(audioDuration, seed=int(audioDuration)),
+        )
+        for sessions, voiceActivityThreshold in (
+            (sessions, threshold)
+            for sessions in parallelSessions
+            for threshold in voiceActivityThresholds
+        ):
+            realtimeFactors: list[float] = []
+            segmentCounts: list[int] = []
+
+            def prepare() -> VoskAPI:
+                return VoskAPI(
+                    apiKey="bench",
+                    language=AvailableLanguages.EN,
+                    chunkSizePolicy=chunkSizePolicy,
+                    voiceActivityThreshold=voiceActivityThreshold,
+                )
+
+            async def run(vosk: VoskAPI) -> None:
+                await vosk.process_audio_file(
+                    audioFile,
+                    parallelSessions=sessions,
+                    segmentSeconds=min(60, max(audioDuration / sessions, 5)),
+                )
+                # Segments are transcribed concurrently, so their results
+                # must still come out as one monotonic timeline.
+                outOfOrder = find_out_of_order_results(vosk.get_results())
+                if outOfOrder:
+                    raise Exception(
+                        f"Results out of order with {sessions} sessions and "
+                        f"VAD threshold {voiceActivityThreshold}: {outOfOrder[:5]}"
+                    )
+                realtimeFactors.append(vosk.get_stream_statistics().realtimeFactor)
+                segmentCounts.append(len(vosk.get_results()))
+
+            durations, _ = await measure(repeats, prepare, run)
+            reports.append(
+                make_report(
+                    "vosk.process_audio_file",
+                    {
+                        "audioSeconds": audioDuration,
+                        "parallelSessions": sessions,
+                        "chunkSizePolicy": chunkSizePolicy.value,
+                        "voiceActivityThreshold": voiceActivityThreshold,
+                    },
+                    durations,
+                    "audioSeconds",
+                    audioDuration,
+                    realtimeFactor=statistics.fmean(realtimeFactors),
+                    segmentsRecognized=statistics.fmean(segmentCounts),
+                )
+            )
+        audioFile.unlink()
+    return reports
+
+
+async def run_format_scenarios(
+    segmentCounts: list[int],
+    repeats: int,
+    rcpapi: Optional[RecasepuncAPI] = None,
+) -> list[dict]:
+    reports: list[dict] = []
+    for segmentCount in segmentCounts:
+
+        async def run(results: list[VoskResult]) -> str:
+            text, _ = await Utils.get_formatted_stt_result(
+                results, rcpapi=rcpapi, language=AvailableLanguages.EN
+            )
+            return text
+
+        durations, outputs = await measure(
+            repeats, lambda: make_results(segmentCount), run
+        )
+        reports.append(
+            make_report(
+                "utils.get_formatted_stt_result",
+                {"segments": segmentCount, "recasepunc": rcpapi is not None},
+                durations,
+                "segments",
+                segmentCount,
+                outputCharacters=len(outputs[-1]),  # type: ignore
+            )
+        )
+    return reports
+
+
+async def run_send_scenarios(
+    segmentCounts: list[int],
+    repeats: int,
+    telegramLatencySeconds: float = 0,
+) -> list[dict]:
+    reports: list[dict] = []
+    preferences = {
+        "text": make_user(sendSubtitles=False, sendBigTextAsFile=False),
+        "subtitles+file": make_user(sendSubtitles=True, sendBigTextAsFile=True),
+    }
+    for segmentCount in segmentCounts:
+        for preferencesName, user in preferences.items():
+            recorder = TelegramCallRecorder(latencySeconds=telegramLatencySeconds)
+
+            def prepare() -> tuple:
+                return (
+                    FakeMessage(recorder, chatId=segmentCount),
+                    make_results(segmentCount),
+                )
+
+            async def run(state: tuple) -> None:
+                message, results = state
+                await Utils.send_stt_result_with_respecting_max_message_length(
+                    message=message,
+                    initialMessage=FakeMessage(recorder, chatId=segmentCount),
+                    results=results,
+                    user=user,
+                    language=AvailableLanguages.EN,
+                )
+
+            durations, _ = await measure(repeats, prepare, run)
+            reports.append(
+                make_report(
+                    "utils.send_stt_result_with_respecting_max_message_length",
+                    {"segments": segmentCount, "preferences": preferencesName},
+                    durations,
+                    "segments",
+                    segmentCount,
+                    telegramCallsPerRun={
+                        method: recorder.count(method) / repeats
+                        for method in sorted({call[0] for call in recorder.calls})
+                    },
+                )
+            )
+    return reports
+
+
+async def run_vtt_scenarios(segmentCounts: list[int], repeats: int) -> list[dict]:
+    reports: list[dict] = []
+    for segmentCount in segmentCounts:
+
+        async def run(results: list[VoskResult]) -> str:
+            return genereate_vtt_subs(results)
+
+        durations, outputs = await measure(
+            repeats, lambda: make_results(segmentCount), run
+        )
+        reports.append(
+            make_report(
+                "subtitles.genereate_vtt_subs",
+                {"segments": segmentCount},
+                durations,
+                "segments",
+                segmentCount,
+                outputCharacters=len(outputs[-1]),  # type: ignore
+            )
+        )
+    return reports
+
+
+async def run_result_scenarios(segmentCounts: list[int], repeats: int) -> list[dict]:
+    reports: list[dict] = []
+    for segmentCount in segmentCounts:
+        responses = make_vosk_responses(segmentCount)
+
+        def prepare() -> VoskAPI:
+            return VoskAPI(apiKey="bench", language=AvailableLanguages.EN)
+
+        async def run(vosk: VoskAPI) -> list[VoskResult]:
+            for response in responses:
+                vosk.add_response(response)
+            return vosk.get_results()
+
+        durations, _ = await measure(repeats, prepare, run)
+        vosk = prepare()
+        tracemalloc.start()
+        try:
+            await run(vosk)
+            storedBytes = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        reports.append(
+            make_report(
+                "VoskAPI.results",
+                {"segments": segmentCount},
+                durations,
+                "segments",
+                segmentCount,
+                bytesPerSegment=storedBytes / segmentCount,
+            )
+        )
+    return reports
+
+
+async def run_scheduler_scenarios(repeats: int) -> list[dict]:
+    # One user floods short voice notes while another waits with a few long
+    # files; with a single slot the two must take turns, whatever the costs.
+    reports: list[dict] = []
+    for shortJobs, longJobs in [(10, 3), (100, 10)]:
+        dispatchOrders: list[list[int]] = []
+
+        def prepare() -> list[int]:
+            return []
+
+        async def run(dispatchOrder: list[int]) -> list[int]:
+            scheduler = TranscriptionScheduler(
+                maxConcurrentJobs=1, maxConcurrentJobsPerUser=1
+            )
+            finished = asyncio.Event()
+            totalJobs = shortJobs + longJobs
+
+            def make_job(telegramUserId: int, estimatedCost: float) -> TranscriptionJob:
+                async def job() -> None:
+                    dispatchOrder.append(telegramUserId)
+                    await asyncio.sleep(0)
+                    if len(dispatchOrder) == totalJobs:
+                        finished.set()
+
+                return TranscriptionJob(
+                    telegramUserId=telegramUserId,
+                    language=AvailableLanguages.EN,
+                    run=job,
+                    estimatedCost=estimatedCost,
+                )
+
+            for _ in range(shortJobs):
+                scheduler.submit(make_job(1, 1))
+            for _ in range(longJobs):
+                scheduler.submit(make_job(2, 100))
+            await finished.wait()
+            await scheduler.close()
+            dispatchOrders.append(dispatchOrder)
+            return dispatchOrder
+
+        durations, _ = await measure(repeats, prepare, run)
+        for dispatchOrder in dispatchOrders:
+            # The first short job starts before the long ones are submitted.
+            alternating = dispatchOrder[1 : 1 + 2 * longJobs]
+            if alternating != [1, 2] * longJobs:
+                raise Exception(
+                    f"Users did not take turns with {shortJobs} short and "
+                    f"{longJobs} long jobs: {dispatchOrder}"
+                )
+        reports.append(
+            make_report(
+                "TranscriptionScheduler.dispatch",
+                {"shortJobs": shortJobs, "longJobs": longJobs},
+                durations,
+                "jobs",
+                shortJobs + longJobs,
+                lastLongJobPosition=max(
+                    index
+                    for index, telegramUserId in enumerate(dispatchOrders[-1])
+                    if telegramUserId == 2
+                ),
+            )
+        )
+    return reports
@@ -1,4 +1,7 @@
-from os import environ as env
+from pathlib import Path
+from typing import Optional
+from os import environ as env, getpid
+from socket import gethostname
 from pydantic import AnyUrl, HttpUrl, parse_obj_as, PositiveInt
 from enum import Enum
 
@@ -8,6 +11,17 @@ class AvailableLanguages(str, Enum):
     RU = "ru"
 
 
+class ChunkSizePolicy(str, Enum):
+    FIXED = "fixed"
+    LATENCY = "latency"
+    THROUGHPUT = "throughput"
+
+
+class TraceFormat(str, Enum):
+    JSONL = "jsonl"
+    CHROME = "chrome"
+
+
 class Config:
     def __init__(self) -> None:
         __REQUIRED = [
@@ -89,3 +103,225 @@ class Config:
     @staticmethod
     def get_appwrite_storage_botavatar() -> HttpUrl:
         return parse_obj_as(HttpUrl, env["APPWRITE_STORAGE_BOTAVATAR"])
+
+    @staticmethod
+    def get_vosk_pool_min_size() -> int:
+        return int(env.get("VOSK_POOL_MIN_SIZE", 1))
+
+    @staticmethod
+    def get_vosk_pool_max_size() -> PositiveInt:
+        return int(env.get("VOSK_POOL_MAX_SIZE", 16))
+
+    @staticmethod
+    def get_vosk_pool_max_idle_seconds() -> float:
+        return float(env.get("VOSK_POOL_MAX_IDLE_SECONDS", 60))
+
+    @staticmethod
+    def get_vosk_parallel_sessions() -> PositiveInt:
+        return int(env.get("VOSK_PARALLEL_SESSIONS", 4))
+
+    @staticmethod
+    def get_vosk_parallel_min_duration_seconds() -> float:
+        return float(env.get("VOSK_PARALLEL_MIN_DURATION_SECONDS", 600))
+
+    @staticmethod
+    def get_vosk_parallel_segment_seconds() -> float:
+        return float(env.get("VOSK_PARALLEL_SEGMENT_SECONDS", 60))
+
+    @staticmethod
+    def get_vosk_vad_enabled() -> bool:
+        return env.get("VOSK_VAD_ENABLED", "false").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_vosk_vad_energy_threshold() -> float:
+        return float(env.get("VOSK_VAD_ENERGY_THRESHOLD", 300))
+
+    @staticmethod
+    def get_vosk_vad_keep_silence_seconds() -> float:
+        return float(env.get("VOSK_VAD_KEEP_SILENCE_SECONDS", 0.3))
+
+    @staticmethod
+    def get_vosk_chunk_size_policy() -> ChunkSizePolicy:
+        return ChunkSizePolicy(env.get("VOSK_CHUNK_SIZE_POLICY", "latency"))
+
+    @staticmethod
+    def get_vosk_initial_chunk_bytes() -> int:
+        return int(env.get("VOSK_INITIAL_CHUNK_BYTES", 64000))
+
+    @staticmethod
+    def get_vosk_target_partials_per_second() -> float:
+        return float(env.get("VOSK_TARGET_PARTIALS_PER_SECOND", 2))
+
+    @staticmethod
+    def get_telegram_stream_media() -> bool:
+        return env.get("TELEGRAM_STREAM_MEDIA", "true").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_telegram_global_rate_per_second() -> float:
+        return float(env.get("TELEGRAM_GLOBAL_RATE_PER_SECOND", 25))
+
+    @staticmethod
+    def get_telegram_global_burst() -> int:
+        return int(env.get("TELEGRAM_GLOBAL_BURST", 30))
+
+    @staticmethod
+    def get_telegram_chat_rate_per_second() -> float:
+        return float(env.get("TELEGRAM_CHAT_RATE_PER_SECOND", 1))
+
+    @staticmethod
+    def get_telegram_chat_burst() -> int:
+        return int(env.get("TELEGRAM_CHAT_BURST", 3))
+
+    @staticmethod
+    def get_telegram_flood_wait_max_retries() -> int:
+        return int(env.get("TELEGRAM_FLOOD_WAIT_MAX_RETRIES", 3))
+
+    @staticmethod
+    def get_transcript_cache_max_entries() -> int:
+        return int(env.get("TRANSCRIPT_CACHE_MAX_ENTRIES", 1024))
+
+    @staticmethod
+    def get_transcript_cache_ttl_seconds() -> float:
+        return float(env.get("TRANSCRIPT_CACHE_TTL_SECONDS", 86400))
+
+    @staticmethod
+    def get_transcript_cache_directory() -> Optional[Path]:
+        return (
+            Path(env["TRANSCRIPT_CACHE_DIRECTORY"])
+            if env.get("TRANSCRIPT_CACHE_DIRECTORY")
+            else None
+        )
+
+    @staticmethod
+    def get_transcript_cache_disk_max_bytes() -> int:
+        return int(env.get("TRANSCRIPT_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024))
+
+    @staticmethod
+    def get_vprw_rcpapi_timeout_seconds() -> float:
+        return float(env.get("VPRW_RCPAPI_TIMEOUT_SECONDS", 10))
+
+    @staticmethod
+    def get_vprw_rcpapi_max_retries() -> int:
+        return int(env.get("VPRW_RCPAPI_MAX_RETRIES", 2))
+
+    @staticmethod
+    def get_vprw_rcpapi_max_concurrency() -> PositiveInt:
+        return int(env.get("VPRW_RCPAPI_MAX_CONCURRENCY", 8))
+
+    @staticmethod
+    def get_vprw_rcpapi_batch_max_characters() -> int:
+        return int(env.get("VPRW_RCPAPI_BATCH_MAX_CHARACTERS", 2000))
+
+    @staticmethod
+    def get_vprw_rcpapi_batch_linger_seconds() -> float:
+        return float(env.get("VPRW_RCPAPI_BATCH_LINGER_SECONDS", 0.15))
+
+    @staticmethod
+    def get_user_cache_max_entries() -> int:
+        return int(env.get("USER_CACHE_MAX_ENTRIES", 10000))
+
+    @staticmethod
+    def get_user_cache_ttl_seconds() -> float:
+        return float(env.get("USER_CACHE_TTL_SECONDS", 300))
+
+    @staticmethod
+    def get_user_cache_flush_delay_seconds() -> float:
+        return float(env.get("USER_CACHE_FLUSH_DELAY_SECONDS", 2))
+
+    @staticmethod
+    def get_statistics_flush_interval_seconds() -> float:
+        return float(env.get("STATISTICS_FLUSH_INTERVAL_SECONDS", 30))
+
+    @staticmethod
+    def get_scheduler_max_concurrent_jobs() -> PositiveInt:
+        return int(env.get("SCHEDULER_MAX_CONCURRENT_JOBS", 16))
+
+    @staticmethod
+    def get_scheduler_max_concurrent_jobs_per_language() -> PositiveInt:
+        return int(env.get("SCHEDULER_MAX_CONCURRENT_JOBS_PER_LANGUAGE", 8))
+
+    @staticmethod
+    def get_scheduler_max_concurrent_jobs_per_user() -> PositiveInt:
+        return int(env.get("SCHEDULER_MAX_CONCURRENT_JOBS_PER_USER", 1))
+
+    @staticmethod
+    def get_scheduler_aging_factor() -> float:
+        return float(env.get("SCHEDULER_AGING_FACTOR", 10))
+
+    @staticmethod
+    def get_transcription_mode() -> str:
+        return env.get("TRANSCRIPTION_MODE", "local")
+
+    @staticmethod
+    def get_transcription_queue_backend() -> str:
+        return env.get("TRANSCRIPTION_QUEUE_BACKEND", "sqlite")
+
+    @staticmethod
+    def get_transcription_queue_sqlite_path() -> Path:
+        return Path(
+            env.get("TRANSCRIPTION_QUEUE_SQLITE_PATH", "transcription_queue.sqlite3")
+        )
+
+    @staticmethod
+    def get_transcription_queue_lease_seconds() -> float:
+        return float(env.get("TRANSCRIPTION_QUEUE_LEASE_SECONDS", 60))
+
+    @staticmethod
+    def get_transcription_queue_max_attempts() -> PositiveInt:
+        return int(env.get("TRANSCRIPTION_QUEUE_MAX_ATTEMPTS", 3))
+
+    @staticmethod
+    def get_transcription_worker_concurrency() -> PositiveInt:
+        return int(env.get("TRANSCRIPTION_WORKER_CONCURRENCY", 4))
+
+    @staticmethod
+    def get_transcription_worker_id() -> str:
+        return env.get("TRANSCRIPTION_WORKER_ID", f"{gethostname()}-{getpid()}")
+
+    @staticmethod
+    def get_transcription_worker_session_name() -> str:
+        # Only leases need a per-process id; the Pyrogram session has to
+        # survive restarts, or every start logs the bot in again.
+        return env.get(
+            "TRANSCRIPTION_WORKER_SESSION_NAME", "vocal_balls_bot-worker"
+        )
+
+    @staticmethod
+    def get_metrics_enabled() -> bool:
+        return env.get("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_metrics_host() -> str:
+        return env.get("METRICS_HOST", "127.0.0.1")
+
+    @staticmethod
+    def get_metrics_port() -> int:
+        return int(env.get("METRICS_PORT", 9108))
+
+    @staticmethod
+    def get_trace_directory() -> Optional[Path]:
+        return Path(env["TRACE_DIRECTORY"]) if env.get("TRACE_DIRECTORY") else None
+
+    @staticmethod
+    def get_trace_format() -> TraceFormat:
+        return TraceFormat(env.get("TRACE_FORMAT", "jsonl"))
+
+    @staticmethod
+    def get_trace_slow_threshold_seconds() -> float:
+        return float(env.get("TRACE_SLOW_THRESHOLD_SECONDS", 30))
+
+    @staticmethod
+    def get_profiling_directory() -> Optional[Path]:
+        return (
+            Path(env["PROFILING_DIRECTORY"])
+            if env.get("PROFILING_DIRECTORY")
+            else None
+        )
+
+    @staticmethod
+    def get_profiling_enabled() -> bool:
+        return env.get("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def get_profiling_sample_every() -> PositiveInt:
+        return int(env.get("PROFILING_SAMPLE_EVERY", 100))
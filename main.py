@@ -2,21 +2,38 @@ from config import Config, AvailableLanguages
 import logging
 from pyrogram import Client as BotClient  # type: ignore
 from pyrogram import filters as PyrogramFilters
+from pyrogram import idle as pyrogram_idle
 from pyrogram.types import Message as PyrogramMessage
 from pyrogram.errors import MessageNotModified
 from appwrite.client import Client as AppWriteClient
 from appwrite.services.users import Users as AppWriteUsers
-from appwrite.exception import AppwriteException
 from models import (
     UserModel,
+    TranscriptionQueueJobModel,
     CallbackQueryActionTypes,
     CallbackQueryActionsObjects,
     CallbackQueryActionsValues,
 )
 import sys
+import uuid
 from utils import Utils
 from Locale import LOCALE
 from SpeechToTextPipeline import STTPipeline, MESSAGE_TYPES_FILTRED
+from VoskConnectionPool import VOSK_CONNECTION_POOLS
+from TelegramRateLimiter import TELEGRAM_RATE_LIMITER
+from UserCache import UserCache
+from StatisticsAggregator import StatisticsAggregator
+from TranscriptionScheduler import TranscriptionScheduler, TranscriptionJob
+from TranscriptionQueue import create_transcription_queue, InProcessTranscriptionQueue
+from TranscriptionWorker import TranscriptionWorker, run_voice_pipeline
+from Metrics import (
+    METRICS,
+    MetricsServer,
+    SCHEDULER_QUEUE_DEPTH,
+    TRANSCRIPTION_QUEUE_DEPTH,
+    track_stage,
+)
+from Tracing import MESSAGE_PROFILER
 
 
 logging.basicConfig(
@@ -41,94 +58,190 @@ APPWRITECLIENT = AppWriteClient()
 )
 APPWRITEUSERS = AppWriteUsers(APPWRITECLIENT)
 
+TRANSCRIPTION_SCHEDULER = TranscriptionScheduler(
+    maxConcurrentJobs=CONFIG.get_scheduler_max_concurrent_jobs(),
+    maxConcurrentJobsPerLanguage=CONFIG.get_scheduler_max_concurrent_jobs_per_language(),
+    maxConcurrentJobsPerUser=CONFIG.get_scheduler_max_concurrent_jobs_per_user(),
+    agingFactor=CONFIG.get_scheduler_aging_factor(),
+)
+SCHEDULER_QUEUE_DEPTH.set_collector(TRANSCRIPTION_SCHEDULER.get_queue_depth)
 
-def get_user(user_id: int) -> UserModel:
-    INTERNAL_ID = f"tlgrm-vocalballsbot-{user_id}"
-    try:
-        USER: UserModel = UserModel(
-            **APPWRITEUSERS.get(user_id=INTERNAL_ID)  # type: ignore
-        )
-    except AppwriteException:
-        USER: UserModel = UserModel(
-            **APPWRITEUSERS.create(user_id=INTERNAL_ID)  # type: ignore
-        )
-        APPWRITEUSERS.update_prefs(
-            user_id=f"tlgrm-vocalballsbot-{user_id}",
-            prefs=USER.prefs.dict(),
-        )
-    return USER
+
+USER_CACHE = UserCache(
+    APPWRITEUSERS,
+    maxEntries=CONFIG.get_user_cache_max_entries(),
+    ttlSeconds=CONFIG.get_user_cache_ttl_seconds(),
+    flushDelaySeconds=CONFIG.get_user_cache_flush_delay_seconds(),
+)
 
 
-@bot.on_message(PyrogramFilters.command("settings") & PyrogramFilters.private)
-def on_settings_command(_, message) -> None:
-    USER = get_user(message.from_user.id)
-    message.reply_text(
-        f"<b>{LOCALE.get(USER.prefs.language, 'settings')}</b> <i>(ID: <code>{USER.id}</code>)</i>",
-        quote=True,
-        reply_markup=Utils.generate_settings_keyboard(USER, message.from_user.id),
+USER_STATISTICS = StatisticsAggregator(
+    USER_CACHE,
+    flushIntervalSeconds=CONFIG.get_statistics_flush_interval_seconds(),
+)
+
+
+TRANSCRIPTION_QUEUE = (
+    create_transcription_queue(CONFIG)
+    if CONFIG.get_transcription_mode() == "queue"
+    else None
+)
+if TRANSCRIPTION_QUEUE is not None:
+    TRANSCRIPTION_QUEUE_DEPTH.set_collector(TRANSCRIPTION_QUEUE.get_depth)
+
+
+# The in-process backend cannot be shared with other processes, so the
+# frontend has to run its own worker on top of it.
+TRANSCRIPTION_WORKER = (
+    TranscriptionWorker(
+        client=bot,
+        queue=TRANSCRIPTION_QUEUE,
+        config=CONFIG,
+        userCache=USER_CACHE,
+        statistics=USER_STATISTICS,
+        workerId=CONFIG.get_transcription_worker_id(),
+        concurrency=CONFIG.get_transcription_worker_concurrency(),
+        leaseSeconds=CONFIG.get_transcription_queue_lease_seconds(),
     )
+    if isinstance(TRANSCRIPTION_QUEUE, InProcessTranscriptionQueue)
+    else None
+)
+
+
+METRICS_SERVER = (
+    MetricsServer(METRICS, CONFIG.get_metrics_host(), CONFIG.get_metrics_port())
+    if CONFIG.get_metrics_enabled()
+    else None
+)
+
+
+async def get_user(user_id: int) -> UserModel:
+    return await USER_CACHE.get(user_id)
+
+
+@bot.on_message(PyrogramFilters.command("settings") & PyrogramFilters.private)
+async def on_settings_command(_, message) -> None:
+    with track_stage("handler", "settings"):
+        USER = await get_user(message.from_user.id)
+        await message.reply_text(
+            f"<b>{LOCALE.get(USER.prefs.language, 'settings')}</b> <i>(ID: <code>{USER.id}</code>)</i>",
+            quote=True,
+            reply_markup=Utils.generate_settings_keyboard(USER, message.from_user.id),
+        )
     return
 
 
 @bot.on_message(PyrogramFilters.command("stats") & PyrogramFilters.private)
-def on_stats_command(_, message) -> None:
-    USER = get_user(message.from_user.id)
-    message.reply_text(
-        Utils.generate_statistics_text(USER), quote=True, disable_web_page_preview=True
-    )
+async def on_stats_command(_, message) -> None:
+    with track_stage("handler", "stats"):
+        USER = await get_user(message.from_user.id)
+        await message.reply_text(
+            Utils.generate_statistics_text(USER),
+            quote=True,
+            disable_web_page_preview=True,
+        )
     return
 
 
-def internal_voice_pipeline(STTP: STTPipeline, message: PyrogramMessage) -> None:
-    APPWRITEUSERS.update_prefs(
-        user_id=f"tlgrm-vocalballsbot-{message.from_user.id}",
-        prefs=STTP.get_user().prefs.dict(),
-    )
-    if STTP.run() != 0:
-        return
-    STTP.analytics(get_user(message.from_user.id))
-    APPWRITEUSERS.update_prefs(
-        user_id=f"tlgrm-vocalballsbot-{message.from_user.id}",
-        prefs=STTP.get_user().prefs.dict(),
+async def run_voice_pipeline_safely(
+    STTP: STTPipeline, message: PyrogramMessage
+) -> None:
+    try:
+        await run_voice_pipeline(STTP, message, USER_CACHE, USER_STATISTICS)
+    except Exception as e:
+        logging.error(
+            "Error while processing message ID #%s from user #%s: %s",
+            message.id,
+            message.from_user.id,
+            e,
+        )
+
+
+async def enqueue_voice_pipeline_remotely(
+    message: PyrogramMessage, messageType: MESSAGE_TYPES_FILTRED, user: UserModel
+) -> None:
+    # Workers build the pipeline (and its trace) themselves, so only the
+    # job is described here.
+    position = await TRANSCRIPTION_QUEUE.get_depth() + 1  # type: ignore
+    statusMessage = await TELEGRAM_RATE_LIMITER.reply_text(
+        message,
+        f"__⏳ {LOCALE.get(user.prefs.language, 'messageQueued')} {position}...__",
+        quote=True,
     )
-    APPWRITEUSERS.update_name(
-        user_id=f"tlgrm-vocalballsbot-{message.from_user.id}", name=STTP.get_user().name
+    await TRANSCRIPTION_QUEUE.enqueue(  # type: ignore
+        TranscriptionQueueJobModel(
+            jobId=uuid.uuid4().hex,
+            chatId=message.chat.id,
+            messageId=message.id,
+            statusMessageId=statusMessage.id,
+            messageType=messageType.value,
+            telegramUserId=message.from_user.id,
+            prefs=user.prefs.copy(deep=True),
+            estimatedCost=STTPipeline.estimate_media_duration(
+                STTPipeline.get_message_media(message, messageType)
+            ),
+        )
     )
-    return
 
 
-@bot.on_message(PyrogramFilters.voice & PyrogramFilters.private)
-def on_voice_message_private(_, message: PyrogramMessage) -> None:
+async def enqueue_voice_pipeline(
+    client, message: PyrogramMessage, messageType: MESSAGE_TYPES_FILTRED
+) -> None:
+    user = await get_user(message.from_user.id)
+    if TRANSCRIPTION_QUEUE is not None:
+        await enqueue_voice_pipeline_remotely(message, messageType, user)
+        return
     STTP = STTPipeline(
-        messageType=MESSAGE_TYPES_FILTRED.VOICE,
+        messageType=messageType,
         message=message,
-        user=get_user(message.from_user.id),
+        user=user,
         config=CONFIG,
+        client=client,
+    )
+    estimatedCost = STTP.get_estimated_duration()
+    position = TRANSCRIPTION_SCHEDULER.estimate_position(
+        message.from_user.id, STTP.initialLanguage, estimatedCost
     )
-    internal_voice_pipeline(STTP, message)
+    if position > 0:
+        STTP.set_status_message(
+            await TELEGRAM_RATE_LIMITER.reply_text(
+                message,
+                f"__⏳ {LOCALE.get(STTP.get_user().prefs.language, 'messageQueued')} {position}...__",
+                quote=True,
+            )
+        )
+    TRANSCRIPTION_SCHEDULER.submit(
+        TranscriptionJob(
+            telegramUserId=message.from_user.id,
+            language=STTP.initialLanguage,
+            run=lambda: run_voice_pipeline_safely(STTP, message),
+            estimatedCost=estimatedCost,
+        )
+    )
+
+
+@bot.on_message(PyrogramFilters.voice & PyrogramFilters.private)
+async def on_voice_message_private(client, message: PyrogramMessage) -> None:
+    with track_stage("handler", "voice"):
+        await enqueue_voice_pipeline(client, message, MESSAGE_TYPES_FILTRED.VOICE)
     return
 
 
 @bot.on_message(PyrogramFilters.audio & PyrogramFilters.private)
-def on_audio_message_private(_, message: PyrogramMessage) -> None:
-    STTP = STTPipeline(
-        messageType=MESSAGE_TYPES_FILTRED.AUDIO,
-        message=message,
-        user=get_user(message.from_user.id),
-        config=CONFIG,
-    )
-    internal_voice_pipeline(STTP, message)
+async def on_audio_message_private(client, message: PyrogramMessage) -> None:
+    with track_stage("handler", "audio"):
+        await enqueue_voice_pipeline(client, message, MESSAGE_TYPES_FILTRED.AUDIO)
     return
 
 
 @bot.on_callback_query()
-def on_callback(_, callbackQuery) -> None:
+async def on_callback(_, callbackQuery) -> None:
     callback = Utils.check_callback_query(callbackQuery)
     if callback is None:
         return
     if callback.telegramUserId != callbackQuery.from_user.id:
         return
-    USER = get_user(callbackQuery.from_user.id)
+    USER = await get_user(callbackQuery.from_user.id)
     try:
         if (
             callback.actionType == CallbackQueryActionTypes.ACTION
@@ -175,12 +288,9 @@ def on_callback(_, callbackQuery) -> None:
                 USER.prefs.sendSubtitles,
                 USER.id,
             )
-        APPWRITEUSERS.update_prefs(
-            user_id=f"tlgrm-vocalballsbot-{callbackQuery.from_user.id}",
-            prefs=USER.prefs.dict(),
-        )
+        USER_CACHE.update_prefs(callbackQuery.from_user.id, USER)
         try:
-            callbackQuery.edit_message_text(
+            await callbackQuery.edit_message_text(
                 text=f"<b>{LOCALE.get(USER.prefs.language, 'settings')}</b> <i>(ID: <code>{USER.id}</code>)</i>",
                 reply_markup=Utils.generate_settings_keyboard(
                     USER, callbackQuery.from_user.id
@@ -194,9 +304,29 @@ def on_callback(_, callbackQuery) -> None:
         return
 
 
+async def main() -> None:
+    async with bot:
+        if METRICS_SERVER is not None:
+            await METRICS_SERVER.start()
+        MESSAGE_PROFILER.install_signal_toggle()
+        await VOSK_CONNECTION_POOLS.warm_up()
+        USER_STATISTICS.start()
+        if TRANSCRIPTION_WORKER is not None:
+            TRANSCRIPTION_WORKER.start()
+        await pyrogram_idle()
+        if TRANSCRIPTION_WORKER is not None:
+            await TRANSCRIPTION_WORKER.close()
+        await TRANSCRIPTION_SCHEDULER.close()
+        await VOSK_CONNECTION_POOLS.close()
+        await USER_STATISTICS.close()
+        await USER_CACHE.close()
+        if METRICS_SERVER is not None:
+            await METRICS_SERVER.close()
+
+
 if __name__ == "__main__":
     try:
-        bot.run()
+        bot.run(main())
     except KeyboardInterrupt:
         logging.debug("Exiting the program due to KeyboardInterrupt")
         sys.exit(0)
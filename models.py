@@ -1,7 +1,19 @@
 from typing import Optional
 from pydantic import BaseModel, NonNegativeFloat
-from config import AvailableLanguages
+from config import AvailableLanguages, ChunkSizePolicy
 from enum import Enum
+import re
+
+
+RECASEPUNC_SPACING_PATTERN = re.compile(r" (['\-]) | ([?!.])| ([,:;])(?= )")
+
+
+def _fix_recasepunc_spacing(match: re.Match) -> str:
+    if match.group(1):
+        return match.group(1)
+    if match.group(2):
+        return match.group(2)
+    return match.group(3)
 
 
 class SpeechRecognitionVoskPartialResult(BaseModel):
@@ -22,18 +34,8 @@ class RecasepuncResponseModel(BaseModel):
 
     def fix_result_apostrophe(self) -> Optional[str]:
         if self.result is not None:
-            self.result = (
-                self.result.replace(" ' ", "'")
-                .replace(" ? ", "? ")
-                .replace(" ?", "?")
-                .replace(" ! ", "! ")
-                .replace(" !", "!")
-                .replace(" , ", ", ")
-                .replace(" . ", ". ")
-                .replace(" .", ".")
-                .replace(" - ", "-")
-                .replace(" : ", ": ")
-                .replace(" ; ", "; ")
+            self.result = RECASEPUNC_SPACING_PATTERN.sub(
+                _fix_recasepunc_spacing, self.result
             )
         return self.result
 
@@ -48,6 +50,16 @@ class UserStatisticsModel(BaseModel):
         AvailableLanguages.EN: 0,
     }
 
+    def add(self, delta: "UserStatisticsModel") -> None:
+        self.messagesReceived += delta.messagesReceived
+        self.messagesProcessed += delta.messagesProcessed
+        self.charactersProcessed += delta.charactersProcessed
+        self.secondsOfAudioProcessed += delta.secondsOfAudioProcessed
+        for language, amount in delta.processedWithLanguage.items():
+            self.processedWithLanguage[language] = (
+                self.processedWithLanguage.get(language, 0) + amount
+            )
+
 
 class UserPreferencesModel(BaseModel):
     howManyDigitsAfterDot: int = 1
@@ -93,3 +105,43 @@ class CallbackQueryDataModel(BaseModel):
     actionObject: CallbackQueryActionsObjects
     actionValue: CallbackQueryActionsValues
     telegramUserId: int
+
+
+class VoskConnectionPoolStatistics(BaseModel):
+    endpoint: str
+    idleConnections: int = 0
+    inUseConnections: int = 0
+    connectionsOpened: int = 0
+    connectionsDiscarded: int = 0
+    connectionsEvicted: int = 0
+    acquisitions: int = 0
+    acquisitionsReused: int = 0
+    acquireWaitSecondsTotal: float = 0
+    acquireWaitSecondsMax: float = 0
+
+
+class VoskStreamStatistics(BaseModel):
+    bytesDecoded: int = 0
+    bytesSent: int = 0
+    chunksSent: int = 0
+    audioSeconds: float = 0
+    wallSeconds: float = 0
+    decodeBytesPerSecond: float = 0
+    realtimeFactor: float = 0
+    chunkSizePolicy: ChunkSizePolicy = ChunkSizePolicy.FIXED
+    chunkBytesMin: int = 0
+    chunkBytesMax: int = 0
+    chunkBytesAverage: float = 0
+    averageRoundTripSeconds: float = 0
+
+
+class TranscriptionQueueJobModel(BaseModel):
+    jobId: str
+    chatId: int
+    messageId: int
+    statusMessageId: Optional[int] = None
+    messageType: str
+    telegramUserId: int
+    prefs: UserPreferencesModel
+    estimatedCost: float = 0
+    attempts: int = 0
@@ -1,10 +1,16 @@
-from models import SpeechRecognitionVoskPartialResult
+from VoskAPI import VoskResult
 
 
-def genereate_vtt_subs(results: list[SpeechRecognitionVoskPartialResult]) -> str:
-    resultingVTT = "WEBVTT\n\n"
-    for result in results:
-        startTime = f"{int(result.startTime // 3600):02d}:{int(result.startTime // 60) - int(result.startTime // 3600) * 60:02d}:{result.startTime % 60:06.3f}"
-        endTime = f"{int(result.endTime // 3600):02d}:{int(result.endTime // 60) - int(result.endTime // 3600) * 60:02d}:{result.endTime % 60:06.3f}"
-        resultingVTT += f"{startTime} --> {endTime}\n{result.text}\n\n"
-    return resultingVTT
+VTT_HEADER = "WEBVTT\n\n"
+
+
+def format_vtt_timestamp(seconds: float) -> str:
+    return f"{int(seconds // 3600):02d}:{int(seconds // 60) - int(seconds // 3600) * 60:02d}:{seconds % 60:06.3f}"
+
+
+def format_vtt_cue(result: VoskResult) -> str:
+    return f"{format_vtt_timestamp(result.startTime)} --> {format_vtt_timestamp(result.endTime)}\n{result.text}\n\n"
+
+
+def genereate_vtt_subs(results: list[VoskResult]) -> str:
+    return VTT_HEADER + "".join(format_vtt_cue(result) for result in results)
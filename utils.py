@@ -1,8 +1,6 @@
 from typing import Optional
-from VoskAPI import VoskAPI
+from VoskAPI import VoskAPI, VoskResult
 from models import (
-    SpeechRecognitionVoskPartialResult,
-    RecasepuncRequestBodyModel,
     UserModel,
     CallbackQueryDataModel,
     CallbackQueryActionTypes,
@@ -12,141 +10,264 @@ from models import (
 from pyrogram.types import Message as PyrogramMessage
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from pyrogram.errors.exceptions.bad_request_400 import MessageNotModified
-import time
+import asyncio
+import io
 import logging
-from pathlib import Path
 import uuid
 from ReCasePuncAPI import RecasepuncAPI
 from config import AvailableLanguages
 from Locale import LOCALE
-from subtitles import genereate_vtt_subs
+from subtitles import VTT_HEADER, format_vtt_cue
+from TelegramRateLimiter import TELEGRAM_RATE_LIMITER
 
 
 class Utils:
     @staticmethod
-    def get_formatted_stt_result(
-        results: list[SpeechRecognitionVoskPartialResult],
+    async def get_formatted_stt_result(
+        results: list[VoskResult],
         digitsAfterDot: int = 1,
         rcpapi: Optional[RecasepuncAPI] = None,
         language: AvailableLanguages = AvailableLanguages.RU,
-    ) -> tuple[str, list[SpeechRecognitionVoskPartialResult]]:
-        resultingString: str = ""
-        for partialResult in results:
-            try:
-                formattedText = (
-                    partialResult.text
-                    if not rcpapi
-                    else rcpapi.make_request(
-                        RecasepuncRequestBodyModel(
-                            text=partialResult.text, lang=language
-                        )
-                    ).fix_result_apostrophe()  # type: ignore
-                )
-                results[results.index(partialResult)].text = (
-                    formattedText if formattedText else partialResult.text
-                )
-            except AttributeError:
-                formattedText = partialResult.text
-            resultingString += f"""__{round(partialResult.startTime, digitsAfterDot) if int(partialResult.startTime) != 0 else int(partialResult.startTime)} → {round(partialResult.endTime, digitsAfterDot)}:__
-{formattedText}
-"""
+    ) -> tuple[str, list[VoskResult]]:
+        if rcpapi:
+            await Utils.punctuate_stt_results(results, rcpapi, language)
+        resultingString = "".join(
+            Utils.format_stt_result_part(partialResult, digitsAfterDot)
+            for partialResult in results
+        )
         return resultingString, results
 
     @staticmethod
-    def update_stt_result_as_everything_comes_in(
+    async def punctuate_stt_results(
+        results: list[VoskResult],
+        rcpapi: RecasepuncAPI,
+        language: AvailableLanguages = AvailableLanguages.RU,
+    ) -> None:
+        formattedTexts = await rcpapi.make_batched_requests(
+            [partialResult.text for partialResult in results], language
+        )
+        for partialResult, formattedText in zip(results, formattedTexts):
+            if formattedText:
+                partialResult.text = formattedText
+
+    @staticmethod
+    def format_stt_result_time_range(
+        partialResult: VoskResult, digitsAfterDot: int = 1
+    ) -> str:
+        return f"{round(partialResult.startTime, digitsAfterDot) if int(partialResult.startTime) != 0 else int(partialResult.startTime)} → {round(partialResult.endTime, digitsAfterDot)}"
+
+    @staticmethod
+    def format_stt_result_part(
+        partialResult: VoskResult, digitsAfterDot: int = 1
+    ) -> str:
+        return f"""__{Utils.format_stt_result_time_range(partialResult, digitsAfterDot)}:__
+{partialResult.text}
+"""
+
+    @staticmethod
+    def __append_plain_text_part(
+        plainTextParts: list[str], timeRange: str, partialResult: VoskResult
+    ) -> None:
+        # Markdown underscores are dropped; results are separated by an
+        # empty line.
+        if plainTextParts:
+            plainTextParts.append("\n")
+        plainTextParts.append(timeRange)
+        plainTextParts.append(":\n")
+        plainTextParts.append(
+            partialResult.text.replace(":__", ":").replace("__", "\n")
+        )
+        plainTextParts.append("\n")
+
+    @staticmethod
+    def render_stt_result(
+        results: list[VoskResult],
+        digitsAfterDot: int = 1,
+        textLimitPerMessage: int = 4096,
+        renderPlainText: bool = False,
+        renderSubtitles: bool = False,
+    ) -> tuple[list[str], Optional[str], Optional[str]]:
+        # Message parts, the plain-text file and the subtitles are all built
+        # in the same pass over the results. The plain text is only sent
+        # instead of several messages, so it is started once the limit is
+        # crossed and the few results before that are caught up then.
+        unsplitParts: list[str] = []
+        fullTextLength = 0
+        messageParts: list[str] = []
+        currentPart: list[str] = []
+        currentPartLength = 0
+        plainTextParts: Optional[list[str]] = None
+        subtitlesParts: Optional[list[str]] = [VTT_HEADER] if renderSubtitles else None
+        for index, partialResult in enumerate(results):
+            timeRange = Utils.format_stt_result_time_range(
+                partialResult, digitsAfterDot
+            )
+            part = f"__{timeRange}:__\n{partialResult.text}\n"
+            unsplitParts.append(part)
+            fullTextLength += len(part)
+            if (
+                renderPlainText
+                and plainTextParts is None
+                and fullTextLength >= textLimitPerMessage
+            ):
+                plainTextParts = []
+                for earlierResult in results[:index]:
+                    Utils.__append_plain_text_part(
+                        plainTextParts,
+                        Utils.format_stt_result_time_range(
+                            earlierResult, digitsAfterDot
+                        ),
+                        earlierResult,
+                    )
+            # A transcript that fits into one message is sent as is, so lines
+            # are only walked once the limit is crossed; messages are only
+            # ever cut between lines.
+            if fullTextLength >= textLimitPerMessage:
+                for unsplitPart in unsplitParts:
+                    for line in unsplitPart.splitlines():
+                        if currentPartLength + len(line) >= textLimitPerMessage:
+                            messageParts.append("".join(currentPart))
+                            currentPart = []
+                            currentPartLength = 0
+                        currentPart.append(line)
+                        currentPart.append("\n")
+                        currentPartLength += len(line) + 1
+                unsplitParts.clear()
+            if plainTextParts is not None:
+                Utils.__append_plain_text_part(plainTextParts, timeRange, partialResult)
+            if subtitlesParts is not None:
+                subtitlesParts.append(format_vtt_cue(partialResult))
+        if fullTextLength >= textLimitPerMessage:
+            messageParts.append("".join(currentPart))
+        else:
+            messageParts = ["".join(unsplitParts)]
+        return (
+            messageParts,
+            "".join(plainTextParts) if plainTextParts is not None else None,
+            "".join(subtitlesParts) if subtitlesParts is not None else None,
+        )
+
+    @staticmethod
+    def make_document(text: str, fileName: str) -> io.BytesIO:
+        # Pyrogram takes the upload's file name from the buffer.
+        document = io.BytesIO(text.encode("utf-8"))
+        document.name = fileName
+        return document
+
+    @staticmethod
+    async def update_stt_result_as_everything_comes_in(
         message: PyrogramMessage,
         vosk: VoskAPI,
         digitsAfterDot: int = 1,
-        checkEvery: float = 2,
+        minEditInterval: float = 2,
+        textLimitPerMessage: int = 4096,
+        subscriber: Optional[asyncio.Queue] = None,
     ) -> None:
-        lastResult = None
+        loop = asyncio.get_running_loop()
+        if subscriber is None:
+            subscriber = vosk.subscribe()
+        renderedParts: list[str] = []
+        # Punctuation puts a segment into the queue again once its text is
+        # final, so it is looked up by identity and re-rendered in place.
+        renderedIndexes: dict[int, int] = {}
+        renderedLength = 0
+        renderChanged = False
+        lastSentText: Optional[str] = None
+        nextEditAt = 0.0
         while True:
-            results = vosk.get_results()
-            if results is not None and len(results) > 0 and lastResult != results[-1]:
+            if not renderChanged or not subscriber.empty():
+                result = await subscriber.get()
+            else:
+                # Segments finalized before the next allowed edit are coalesced
+                # into it; the final render replaces the message anyway.
                 try:
-                    resText, _ = Utils.get_formatted_stt_result(results, digitsAfterDot)
-                    if len(resText) >= 4096:
-                        resText = resText[:4000] + "..."
-                        resText += f"\n\n__⏳ {LOCALE.get(vosk.get_language(), 'fullMessageAfterProcessing')}...__"
-                    _ = message.edit_text(text=resText)
-                except MessageNotModified:
-                    logging.warning("Message not modified for message #%s", message.id)
-                    checkEvery = 10
-            lastResult = vosk.get_result()
-            if vosk.get_finished_status():
-                logging.info(
-                    "Finished processing audio file for message #%s", message.id
-                )
+                    result = await asyncio.wait_for(
+                        subscriber.get(), timeout=max(nextEditAt - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    visibleText = "".join(renderedParts)
+                    if renderedLength >= textLimitPerMessage:
+                        visibleText = visibleText[:4000] + "..."
+                        visibleText += f"\n\n__⏳ {LOCALE.get(vosk.get_language(), 'fullMessageAfterProcessing')}...__"
+                    # Past the limit the truncated text rarely changes, and an
+                    # identical edit is rejected but still costs a token.
+                    if visibleText == lastSentText:
+                        renderChanged = False
+                        continue
+                    try:
+                        _ = await TELEGRAM_RATE_LIMITER.edit_text(
+                            message, text=visibleText
+                        )
+                    except MessageNotModified:
+                        logging.debug(
+                            "Message not modified for message #%s", message.id
+                        )
+                    lastSentText = visibleText
+                    renderChanged = False
+                    nextEditAt = loop.time() + minEditInterval
+                    continue
+            if result is None:
                 break
-            time.sleep(checkEvery)
+            if id(result) in renderedIndexes:
+                index = renderedIndexes[id(result)]
+                part = Utils.format_stt_result_part(result, digitsAfterDot)
+                renderedLength += len(part) - len(renderedParts[index])
+                renderedParts[index] = part
+                renderChanged = True
+            # Once the text overflows the visible window it never changes
+            # again, so later segments are not even formatted.
+            elif renderedLength < textLimitPerMessage:
+                part = Utils.format_stt_result_part(result, digitsAfterDot)
+                renderedIndexes[id(result)] = len(renderedParts)
+                renderedParts.append(part)
+                renderedLength += len(part)
+                renderChanged = True
+        logging.info("Finished processing audio file for message #%s", message.id)
 
     @staticmethod
-    def send_stt_result_with_respecting_max_message_length(
+    async def send_stt_result_with_respecting_max_message_length(
         message: PyrogramMessage,
         initialMessage: PyrogramMessage,
-        vosk: VoskAPI,
+        results: list[VoskResult],
         user: UserModel,
         rcpapi: Optional[RecasepuncAPI] = None,
         language: AvailableLanguages = AvailableLanguages.RU,
         textLimitPerMessage: int = 4096,
     ) -> None:
-        results = vosk.get_results()
-        resultingText, updatedResults = Utils.get_formatted_stt_result(
+        if rcpapi:
+            await Utils.punctuate_stt_results(results, rcpapi, language)
+        textToSend, plainText, subtitles = Utils.render_stt_result(
             results,
-            rcpapi=rcpapi,
-            language=language,
             digitsAfterDot=user.prefs.howManyDigitsAfterDot,
+            textLimitPerMessage=textLimitPerMessage,
+            renderPlainText=user.prefs.sendBigTextAsFile,
+            renderSubtitles=user.prefs.sendSubtitles,
         )
-        textToSend: list[str] = []
-        if len(resultingText) >= textLimitPerMessage:
-            currentPart = ""
-            for line in resultingText.splitlines():
-                if len(currentPart) + len(line) >= textLimitPerMessage:
-                    textToSend.append(currentPart)
-                    currentPart = ""
-                currentPart += line + "\n"
-            textToSend.append(currentPart)
-        else:
-            textToSend.append(resultingText)
         logging.debug(
             "Total resulting messages amount for user #%s and message #%s: %s",
             user.id,
             message.id,
             len(textToSend),
         )
-        if user.prefs.sendSubtitles:
-            subsFilePath: Path = (
-                Path("files_download")
-                / f"{user.id.replace('-', '')}-{uuid.uuid4().__str__().replace('-', '')}.vtt"
-            )
-            with open(subsFilePath, "w") as f:
-                f.write(genereate_vtt_subs(updatedResults))
-            _ = message.reply_document(
-                document=subsFilePath.__str__(),
+        if subtitles is not None:
+            subsFileName = f"{user.id.replace('-', '')}-{uuid.uuid4().__str__().replace('-', '')}.vtt"
+            _ = await TELEGRAM_RATE_LIMITER.reply_document(
+                message,
+                document=Utils.make_document(subtitles, subsFileName),
                 caption=f"📄 __{LOCALE.get(user.prefs.language, 'messageSentAsAFileWithSubtitles')}__",
-                file_name=subsFilePath.name,
+                file_name=subsFileName,
                 quote=True,
             )
-            subsFilePath.unlink()
-        if user.prefs.sendBigTextAsFile and len(textToSend) > 1:
-            outputFile: Path = (
-                Path("files_download")
-                / f"{user.id.replace('-', '')}-{uuid.uuid4().__str__().replace('-', '')}.txt"
-            )
-            with open(outputFile, "w") as f:
-                f.write(
-                    resultingText.replace(":__", ":")
-                    .replace("__", "", 1)
-                    .replace("__", "\n")
-                )
-            _ = message.reply_document(
-                document=outputFile.__str__(),
+        if plainText is not None and len(textToSend) > 1:
+            outputFileName = f"{user.id.replace('-', '')}-{uuid.uuid4().__str__().replace('-', '')}.txt"
+            _ = await TELEGRAM_RATE_LIMITER.reply_document(
+                message,
+                document=Utils.make_document(plainText, outputFileName),
                 caption=f"📄 __{LOCALE.get(user.prefs.language, 'messageSentAsAFile')}__",
-                file_name=outputFile.name,
+                file_name=outputFileName,
                 quote=True,
             )
-            outputFile.unlink()
-            _ = initialMessage.delete()
+            _ = await TELEGRAM_RATE_LIMITER.delete(initialMessage)
             logging.debug(
                 "Sent STT'ed text as a file for user #%s and message #%s",
                 user.id,
@@ -156,19 +277,21 @@ class Utils:
         for text in textToSend:
             if text == textToSend[0]:
                 try:
-                    _ = initialMessage.edit_text(text=text)
+                    _ = await TELEGRAM_RATE_LIMITER.edit_text(
+                        initialMessage, text=text
+                    )
                 except MessageNotModified:
                     logging.warning(
                         "Initial message not modified for message #%s", message.id
                     )
             else:
-                _ = message.reply_text(
+                _ = await TELEGRAM_RATE_LIMITER.reply_text(
+                    message,
                     text=text,
                     quote=True,
                     disable_web_page_preview=True,
                     disable_notification=True,
                 )
-                time.sleep(0.5)
         return
 
     @staticmethod
@@ -0,0 +1,96 @@
+from config import Config
+import logging
+from pyrogram import Client as BotClient  # type: ignore
+from pyrogram import idle as pyrogram_idle
+from appwrite.client import Client as AppWriteClient
+from appwrite.services.users import Users as AppWriteUsers
+import sys
+from VoskConnectionPool import VOSK_CONNECTION_POOLS
+from UserCache import UserCache
+from StatisticsAggregator import StatisticsAggregator
+from TranscriptionQueue import create_transcription_queue
+from TranscriptionWorker import TranscriptionWorker
+from Metrics import METRICS, MetricsServer, TRANSCRIPTION_QUEUE_DEPTH
+from Tracing import MESSAGE_PROFILER
+
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+CONFIG = Config()
+
+WORKER_ID = CONFIG.get_transcription_worker_id()
+
+bot = BotClient(
+    name=CONFIG.get_transcription_worker_session_name(),
+    api_id=CONFIG.get_telegram_api_id(),
+    api_hash=CONFIG.get_telegram_api_hash(),
+    bot_token=CONFIG.get_telegram_bot_token(),
+    no_updates=True,
+)
+
+APPWRITECLIENT = AppWriteClient()
+(
+    APPWRITECLIENT.set_endpoint(CONFIG.get_appwrite_api_endpoint())
+    .set_project(CONFIG.get_appwrite_project_id())
+    .set_key(CONFIG.get_appwrite_api_key())
+)
+APPWRITEUSERS = AppWriteUsers(APPWRITECLIENT)
+
+USER_CACHE = UserCache(
+    APPWRITEUSERS,
+    maxEntries=CONFIG.get_user_cache_max_entries(),
+    ttlSeconds=CONFIG.get_user_cache_ttl_seconds(),
+    flushDelaySeconds=CONFIG.get_user_cache_flush_delay_seconds(),
+)
+
+USER_STATISTICS = StatisticsAggregator(
+    USER_CACHE,
+    flushIntervalSeconds=CONFIG.get_statistics_flush_interval_seconds(),
+)
+
+TRANSCRIPTION_QUEUE = create_transcription_queue(CONFIG)
+TRANSCRIPTION_QUEUE_DEPTH.set_collector(TRANSCRIPTION_QUEUE.get_depth)
+
+TRANSCRIPTION_WORKER = TranscriptionWorker(
+    client=bot,
+    queue=TRANSCRIPTION_QUEUE,
+    config=CONFIG,
+    userCache=USER_CACHE,
+    statistics=USER_STATISTICS,
+    workerId=WORKER_ID,
+    concurrency=CONFIG.get_transcription_worker_concurrency(),
+    leaseSeconds=CONFIG.get_transcription_queue_lease_seconds(),
+)
+
+METRICS_SERVER = (
+    MetricsServer(METRICS, CONFIG.get_metrics_host(), CONFIG.get_metrics_port())
+    if CONFIG.get_metrics_enabled()
+    else None
+)
+
+
+async def main() -> None:
+    async with bot:
+        if METRICS_SERVER is not None:
+            await METRICS_SERVER.start()
+        MESSAGE_PROFILER.install_signal_toggle()
+        await VOSK_CONNECTION_POOLS.warm_up()
+        USER_STATISTICS.start()
+        TRANSCRIPTION_WORKER.start()
+        await pyrogram_idle()
+        await TRANSCRIPTION_WORKER.close()
+        await VOSK_CONNECTION_POOLS.close()
+        await USER_STATISTICS.close()
+        await USER_CACHE.close()
+        if METRICS_SERVER is not None:
+            await METRICS_SERVER.close()
+
+
+if __name__ == "__main__":
+    try:
+        bot.run(main())
+    except KeyboardInterrupt:
+        logging.debug("Exiting the program due to KeyboardInterrupt")
+        sys.exit(0)